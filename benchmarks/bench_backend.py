@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""End-to-end backend benchmark against local OpenAI/Pinecone stand-ins.
+
+Runs the real FastAPI app in-process (httpx ASGI transport, background tasks included),
+ingests a synthetic Discord corpus through /batch_ingest in the bot's batch size and
+measures, at each corpus size:
+
+- ingestion throughput (messages/s and upserted chunks/s)
+- /query latency percentiles (p50/p95/p99)
+- peak resident memory
+
+Sizes are cumulative: the corpus grows to each size in turn and queries run against
+everything ingested so far. Results are written to JSON so runs can be compared across
+commits (`--baseline` prints the change against an earlier result file).
+
+Usage:
+    python -m benchmarks.bench_backend --sizes 1000 5000 20000 --queries 200 \\
+        --embed-latency 0.05 --chat-latency 0.4 --output bench_backend.json
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.bench_preprocess import WORDS, make_message
+from benchmarks.offline import Latency, offline_backend
+
+BATCH_SIZE = 50  # the bot's /ingest_history batch size
+CHANNELS = 20
+
+
+def make_payloads(start: int, n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Message payloads in the shape the bot sends, spread over a few channels."""
+    base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    payloads = []
+    for i in range(start, start + n):
+        payloads.append({
+            "message_id": str(10**17 + i),
+            "channel_id": str(1000 + rng.randrange(CHANNELS)),
+            "user_id": str(2000 + rng.randrange(200)),
+            "content": make_message(rng),
+            "timestamp": (base + datetime.timedelta(seconds=i * 30)).isoformat(),
+            "attachments": [],
+            "thread_id": None,
+            "roles": [],
+        })
+    return payloads
+
+
+def make_question(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))) + "?"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+async def ingest(client: httpx.AsyncClient, headers: Dict[str, str], payloads: List[Dict[str, Any]]) -> int:
+    errors = 0
+    for start in range(0, len(payloads), BATCH_SIZE):
+        resp = await client.post("/batch_ingest", json={"messages": payloads[start:start + BATCH_SIZE]}, headers=headers)
+        errors += resp.status_code >= 400
+    return errors
+
+
+async def run_queries(client: httpx.AsyncClient, n: int, rng: random.Random) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    for _ in range(n):
+        payload = {"user_id": "1", "channel_id": str(1000 + rng.randrange(CHANNELS)), "roles": [], "question": make_question(rng), "top_k": 5}
+        start = time.perf_counter()
+        resp = await client.post("/query", json=payload)
+        latencies.append((time.perf_counter() - start) * 1000)
+        errors += resp.status_code >= 400
+    latencies.sort()
+    return {
+        "count": n,
+        "errors": errors,
+        "mean_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    embed_latency = Latency(args.embed_latency, args.embed_latency_per_item)
+    chat_latency = Latency(args.chat_latency)
+    results = []
+    with offline_backend(dim=args.dim, embed_latency=embed_latency, chat_latency=chat_latency,
+                         storage=args.storage) as (api, openai_client, index):
+        from src.backend.security import API_KEY
+        headers = {"X-API-Key": API_KEY}
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            ingested = 0
+            for size in sorted(args.sizes):
+                payloads = make_payloads(ingested, size - ingested, rng)
+                upserted_before = index.upserted
+                start = time.perf_counter()
+                errors = await ingest(client, headers, payloads)
+                elapsed = time.perf_counter() - start
+                ingested = size
+                chunks = index.upserted - upserted_before
+                query = await run_queries(client, args.queries, rng)
+                result = {
+                    "messages": size,
+                    "ingest": {
+                        "seconds": elapsed,
+                        "messages_per_s": len(payloads) / elapsed if elapsed else 0.0,
+                        "chunks_per_s": chunks / elapsed if elapsed else 0.0,
+                        "chunks_upserted": chunks,
+                        "errors": errors,
+                        "embedding_calls": openai_client.embeddings.calls,
+                    },
+                    "index_vectors": index.describe_index_stats()["total_vector_count"],
+                    "query": query,
+                    "memory": {"peak_rss_mb": peak_rss_mb(), "index_matrix_mb": index.matrix_bytes / 2**20},
+                }
+                results.append(result)
+                print(
+                    f"{size:>8,} msgs | ingest {result['ingest']['messages_per_s']:>9,.0f} msg/s "
+                    f"{result['ingest']['chunks_per_s']:>9,.0f} chunks/s | query p50 {query['p50_ms']:.1f} "
+                    f"p95 {query['p95_ms']:.1f} p99 {query['p99_ms']:.1f} ms | rss {result['memory']['peak_rss_mb']:.0f} MB"
+                )
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "results": results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline_path: str) -> None:
+    """Print relative changes against an earlier result file, matching rows by corpus size."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {r["messages"]: r for r in baseline["results"]}
+    print(f"\nChange vs {baseline.get('commit', baseline_path)}:")
+    for row in report["results"]:
+        old = previous.get(row["messages"])
+        if not old:
+            continue
+        changes = []
+        for section, key in (("ingest", "messages_per_s"), ("query", "p50_ms"), ("query", "p99_ms"), ("memory", "peak_rss_mb")):
+            before, after = old[section][key], row[section][key]
+            if before:
+                changes.append(f"{section}.{key} {100 * (after - before) / before:+.1f}%")
+        print(f"{row['messages']:>8,} msgs | " + " | ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--storage", choices=["float32", "float16", "int8"], default="float32",
+                        help="Precision of the stand-in index's search matrix")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per embedding request")
+    parser.add_argument("--embed-latency-per-item", type=float, default=0.0, help="Extra seconds per embedded text")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="Seconds per chat completion")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_backend.json")
+    parser.add_argument("--baseline", help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
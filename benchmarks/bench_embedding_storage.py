@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Recall versus memory for shortened and quantized embeddings.
+
+Embeds a corpus once at the model's native size, then for every combination of output
+dimension (`--dims`, 0 = native) and storage precision (`--storage`) measures:
+
+- recall@k against exact float32 search at the native size, with and without rescoring the
+  shortlist at full precision (`--rescore-factor` candidates per result)
+- bytes per vector in a local index and in upsert/fetch payloads
+
+Shortened vectors are the native ones truncated and re-normalised, which is what the
+`dimensions` parameter of text-embedding-3-* returns. With the default offline provider the
+embeddings are hashed bags of words: good enough to compare storage precisions, but not to
+pick a dimension (hashed vectors are not trained to be truncated). Use `--provider openai` or
+`--provider local` on exported history (`--history`, as in loadgen) for that.
+
+Usage:
+    python -m benchmarks.bench_embedding_storage --history export.jsonl --provider openai \\
+        --dims 0 1024 512 256 --storage float32 float16 int8 --output bench_embedding_storage.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.bench_preprocess import make_corpus
+from benchmarks.loadgen import load_history
+from benchmarks.offline import hashed_embedding
+from src.backend.quantization import QuantizedMatrix, search, shorten
+
+EMBED_BATCH = 256
+
+
+async def embed_texts(texts: List[str], provider: str, model: str, dim: int) -> np.ndarray:
+    if provider == "offline":
+        return np.asarray([hashed_embedding(t, dim) for t in texts], dtype=np.float32)
+    from src.backend.embedding import provider_for
+    embedder = provider_for(provider, model)
+    vectors: List[List[float]] = []
+    for start in range(0, len(texts), EMBED_BATCH):
+        vectors.extend(await embedder.embed(texts[start:start + EMBED_BATCH]))
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def exact_top_k(corpus: np.ndarray, query: np.ndarray, k: int) -> set:
+    scores = corpus @ query
+    return set(np.argpartition(-scores, k - 1)[:k].tolist())
+
+
+def measure(corpus: np.ndarray, queries: np.ndarray, truth: List[set], dims: int, storage: str,
+            k: int, rescore_factor: int) -> Dict[str, Any]:
+    full = shorten(corpus, dims)
+    shortened_queries = shorten(queries, dims)
+    matrix = QuantizedMatrix(full, storage)
+    recall = {"rescored": 0.0, "approximate": 0.0}
+    start = time.perf_counter()
+    for query, expected in zip(shortened_queries, truth):
+        top, _ = search(matrix, query, k, lambda rows: full[rows], rescore_factor)
+        recall["rescored"] += len(expected & set(top.tolist())) / k
+        approximate = matrix.scores(query)
+        recall["approximate"] += len(expected & set(np.argpartition(-approximate, k - 1)[:k].tolist())) / k
+    elapsed = time.perf_counter() - start
+    return {
+        "dims": full.shape[1],
+        "storage": storage,
+        "recall_at_k": recall["rescored"] / len(queries),
+        "recall_at_k_without_rescoring": recall["approximate"] / len(queries),
+        "bytes_per_vector": matrix.nbytes / len(full),
+        "index_mb": matrix.nbytes / 2**20,
+        "payload_bytes_per_vector": full.shape[1] * 4,
+        "ms_per_query": 1000 * elapsed / len(queries),
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    if args.history:
+        texts = [m["content"] for m in load_history(args.history) if (m.get("content") or "").strip()]
+    else:
+        texts = make_corpus(args.messages + args.queries, args.seed)
+    rng = random.Random(args.seed)
+    rng.shuffle(texts)
+    query_texts, corpus_texts = texts[:args.queries], texts[args.queries:]
+    vectors = await embed_texts(query_texts + corpus_texts, args.provider, args.model, args.dim)
+    queries, corpus = vectors[:len(query_texts)], vectors[len(query_texts):]
+    k = min(args.k, len(corpus))
+    truth = [exact_top_k(corpus, q, k) for q in queries]
+    print(f"{len(corpus):,} vectors of {corpus.shape[1]} dims, {len(queries)} queries, recall@{k}")
+    results = []
+    for dims in args.dims:
+        for storage in args.storage:
+            row = measure(corpus, queries, truth, dims, storage, k, args.rescore_factor)
+            results.append(row)
+            print(
+                f"{row['dims']:>5} dims {storage:<8} | recall {row['recall_at_k']:.3f} "
+                f"(no rescoring {row['recall_at_k_without_rescoring']:.3f}) | {row['bytes_per_vector']:>6,.0f} B/vector "
+                f"{row['index_mb']:>8.1f} MB | payload {row['payload_bytes_per_vector']:>6,} B | {row['ms_per_query']:.2f} ms/query"
+            )
+    return {"config": {k: v for k, v in vars(args).items() if k != "output"}, "vectors": len(corpus), "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", help="Exported message payloads (JSON lines) to use as the corpus")
+    parser.add_argument("--messages", type=int, default=20000, help="Synthetic corpus size when no history is given")
+    parser.add_argument("--queries", type=int, default=200, help="Held-out messages used as queries")
+    parser.add_argument("--provider", choices=["offline", "openai", "local"], default="offline")
+    parser.add_argument("--model", default="text-embedding-3-small", help="Embedding model for openai/local")
+    parser.add_argument("--dim", type=int, default=1536, help="Native size of the offline embeddings")
+    parser.add_argument("--dims", type=int, nargs="+", default=[0, 1024, 512, 256])
+    parser.add_argument("--storage", nargs="+", choices=["float32", "float16", "int8"], default=["float32", "float16", "int8"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_embedding_storage.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
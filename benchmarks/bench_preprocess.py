@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for message preprocessing (clean_text + redact_pii).
+
+Compares the legacy per-message passes with the gated batch engine on a synthetic
+corpus shaped like Discord chat: short replies, emoji reactions, "+1"s, slash commands,
+mentions, links, code snippets and the occasional e-mail address or number.
+
+Usage:
+    python -m benchmarks.bench_preprocess --messages 200000 --processes 4
+"""
+
+import argparse
+import random
+import time
+from src.backend.preprocess import preprocess_text, preprocess_texts
+from src.backend.utils import clean_text, redact_pii
+
+WORDS = (
+    "the bot index should we ship it tomorrow lol yeah ok thanks deploy release notes "
+    "pinecone query latency fixed broken works for me can you check again meeting at"
+).split()
+EMOJIS = ["😀", "👍", "🔥", "🎉", "👀", "✅", "😂", "🙏🏽"]
+EXTRAS = [
+    "+1", "<@123456789012345678>", "https://discord.com/channels/1/2/3", "`pip install -r requirements.txt`",
+    "ping me at someone.name@example.com", "call 555-12-3456", "v2.4.1", "#general",
+]
+
+
+def make_message(rng: random.Random) -> str:
+    """Generate one message with a realistic length distribution (mostly one-liners)."""
+    n_words = min(int(rng.expovariate(1 / 12)) + 1, 200)
+    parts = [rng.choice(WORDS) for _ in range(n_words)]
+    for _ in range(rng.randint(0, 2)):
+        parts.insert(rng.randint(0, len(parts)), rng.choice(EMOJIS))
+    if rng.random() < 0.3:
+        parts.insert(rng.randint(0, len(parts)), rng.choice(EXTRAS))
+    text = " ".join(parts)
+    if rng.random() < 0.05:
+        text = "/" + rng.choice(["ask", "summarize", "remind"]) + " " + text
+    if rng.random() < 0.1:
+        text += "\n\n" + " ".join(rng.choice(WORDS) for _ in range(30))
+    return text
+
+
+def make_corpus(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [make_message(rng) for _ in range(n)]
+
+
+def bench(label: str, fn, corpus) -> list:
+    start = time.perf_counter()
+    out = fn(corpus)
+    elapsed = time.perf_counter() - start
+    n_bytes = sum(len(t.encode("utf-8")) for t in corpus)
+    print(f"{label:<28} {len(corpus) / elapsed:>12,.0f} msg/s {n_bytes / elapsed / 1e6:>8.1f} MB/s  ({elapsed:.3f}s)")
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--processes", type=int, default=0, help="Process pool size for the parallel run (0 = skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages, args.seed)
+    print(f"Corpus: {len(corpus):,} messages, avg {sum(map(len, corpus)) / len(corpus):.0f} chars")
+    legacy = bench("legacy (4 passes)", lambda c: [redact_pii(clean_text(t)) for t in c], corpus)
+    single = bench("preprocess_text", lambda c: [preprocess_text(t) for t in c], corpus)
+    assert single == legacy, "single-scan output diverged from the legacy pipeline"
+    if args.processes > 1:
+        parallel = bench(f"batch x{args.processes} processes", lambda c: preprocess_texts(c, processes=args.processes), corpus)
+        assert parallel == legacy, "parallel output diverged from the legacy pipeline"
+
+
+if __name__ == "__main__":
+    main()
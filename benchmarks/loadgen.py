@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""Load generator that replays Discord-shaped traffic against a running backend.
+
+Sends the same payloads the bot sends to /ingest, /batch_ingest, /ingest_thread and
+/query, mixed in configurable proportions, at a series of increasing arrival rates. Each
+step reports throughput, latency percentiles, error rate and the backend's background
+queue depth (scraped from /metrics). The first step that falls behind the offered rate,
+exceeds the error budget or the p95 budget is reported as the saturation point.
+
+Traffic is synthetic by default. It can instead be seeded from:
+- `--history export.jsonl`: message payloads exported from a server (one JSON object per
+  line, or a JSON list). Their contents, channels and threads are replayed and their real
+  inter-arrival gaps are kept, rescaled to each step's rate.
+- `--seed-ids processed_messages.json`: message IDs already ingested. Their snowflake
+  timestamps give the arrival pattern; contents are synthetic.
+
+Replayed messages get fresh IDs unless `--reuse-ids` is given, which exercises the
+already-processed path instead of ingestion.
+
+Usage:
+    python -m benchmarks.loadgen --url http://localhost:8000 --rates 5 10 20 40 \\
+        --step-seconds 30 --mix ingest=0.6,query=0.3,ingest_thread=0.1 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from benchmarks.bench_preprocess import WORDS, make_message
+
+DISCORD_EPOCH_MS = 1420070400000
+SCENARIOS = ("ingest", "batch_ingest", "ingest_thread", "query")
+BATCH_SIZE = 50  # the bot's /ingest_history batch size
+
+
+def snowflake_ms(message_id: str) -> int:
+    return (int(message_id) >> 22) + DISCORD_EPOCH_MS
+
+
+def make_snowflake(ms: int, sequence: int) -> str:
+    return str(((ms - DISCORD_EPOCH_MS) << 22) | (sequence & 0x3FFFFF))
+
+
+def load_history(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def normalized_gaps(timestamps_ms: List[int]) -> List[float]:
+    """Inter-arrival gaps scaled to mean 1, so they can be replayed at any rate."""
+    ordered = sorted(timestamps_ms)
+    gaps = [b - a for a, b in zip(ordered, ordered[1:]) if b >= a]
+    mean = sum(gaps) / len(gaps) if gaps else 0
+    return [g / mean for g in gaps] if mean else []
+
+
+class TrafficSource:
+    """Builds request payloads for each scenario, from history or synthetically."""
+
+    def __init__(self, rng: random.Random, history: Optional[List[Dict[str, Any]]] = None,
+                 gaps: Optional[List[float]] = None, reuse_ids: bool = False, channels: int = 20,
+                 thread_length: int = 40, attachment_urls: Optional[List[str]] = None,
+                 attachment_ratio: float = 0.1, burst_size: float = 1.0):
+        self.rng = rng
+        self.history = history or []
+        self.gaps = gaps or []
+        self.reuse_ids = reuse_ids
+        self.channels = channels
+        self.thread_length = thread_length
+        self.attachment_urls = attachment_urls or []
+        self.attachment_ratio = attachment_ratio
+        self.burst_size = max(1.0, burst_size)
+        self._sequence = itertools.count(rng.randrange(1 << 20))
+        self._history_pos = 0
+        self._gap_pos = 0
+
+    def _new_id(self) -> str:
+        return make_snowflake(int(time.time() * 1000), next(self._sequence))
+
+    def message(self, channel_id: Optional[str] = None, thread_id: Optional[str] = None) -> Dict[str, Any]:
+        if self.history:
+            payload = dict(self.history[self._history_pos % len(self.history)])
+            self._history_pos += 1
+            if not self.reuse_ids:
+                payload["message_id"] = self._new_id()
+        else:
+            payload = {
+                "message_id": self._new_id(),
+                "channel_id": channel_id or str(1000 + self.rng.randrange(self.channels)),
+                "user_id": str(2000 + self.rng.randrange(500)),
+                "content": make_message(self.rng),
+                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "attachments": [],
+                "thread_id": None,
+                "roles": [],
+            }
+        if thread_id is not None:
+            payload.update(channel_id=thread_id, thread_id=thread_id)
+        if self.attachment_urls and self.rng.random() < self.attachment_ratio:
+            payload["attachments"] = [self.rng.choice(self.attachment_urls)]
+        return payload
+
+    def request(self, scenario: str) -> Tuple[str, Dict[str, Any]]:
+        if scenario == "ingest":
+            return "/ingest", self.message()
+        if scenario == "batch_ingest":
+            return "/batch_ingest", {"messages": [self.message() for _ in range(BATCH_SIZE)]}
+        if scenario == "ingest_thread":
+            thread_id = self._new_id()
+            length = max(1, int(self.rng.expovariate(1 / self.thread_length)))
+            # The bot re-sends the whole thread on every new message, so threads arrive already long
+            messages = [self.message(thread_id=thread_id) for _ in range(length)]
+            return "/ingest_thread", {"thread_id": thread_id, "parent_message_id": thread_id, "messages": messages}
+        if scenario == "query":
+            question = " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(4, 12))) + "?"
+            channel = self.message()["channel_id"] if self.history else str(1000 + self.rng.randrange(self.channels))
+            return "/query", {"user_id": str(2000 + self.rng.randrange(500)), "channel_id": channel, "roles": [], "question": question, "top_k": 5}
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    def next_gap(self) -> float:
+        """Gap (in mean inter-arrival units) before the next arrival; 0 within a burst."""
+        if self.gaps:
+            gap = self.gaps[self._gap_pos % len(self.gaps)]
+            self._gap_pos += 1
+            return gap
+        if self.burst_size > 1 and self.rng.random() < 1 - 1 / self.burst_size:
+            return 0.0
+        return self.rng.expovariate(1.0) * self.burst_size
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+async def queue_depth(session: aiohttp.ClientSession, url: str) -> Optional[float]:
+    """Total background work queued or running, from the backend's /metrics.
+
+    In-process background tasks (vita_background_tasks) plus, in queue mode, the shared job
+    queue's backlog (vita_job_queue_depth).
+    """
+    try:
+        async with session.get(f"{url}/metrics") as resp:
+            if resp.status != 200:
+                return None
+            text = await resp.text()
+    except Exception:
+        return None
+    return sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+               if line.startswith(("vita_background_tasks{", "vita_job_queue_depth{")))
+
+
+async def run_step(session: aiohttp.ClientSession, args, source: TrafficSource, mix: Dict[str, float], rate: float) -> Dict[str, Any]:
+    scenarios, weights = zip(*mix.items())
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: Dict[str, List[float]] = {s: [] for s in scenarios}
+    statuses: Dict[str, Counter] = {s: Counter() for s in scenarios}
+    dropped = 0
+    in_flight = 0
+    tasks = []
+    headers = {"X-API-Key": args.api_key}
+
+    async def send(scenario: str, path: str, payload: Dict[str, Any]) -> None:
+        nonlocal in_flight
+        try:
+            await _send(scenario, path, payload)
+        finally:
+            in_flight -= 1
+
+    async def _send(scenario: str, path: str, payload: Dict[str, Any]) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(args.url + path, json=payload, headers={**headers, "X-Trace-Id": uuid.uuid4().hex}) as resp:
+                    await resp.read()
+                    statuses[scenario][resp.status] += 1
+            except Exception as e:
+                statuses[scenario][type(e).__name__] += 1
+            latencies[scenario].append((time.perf_counter() - start) * 1000)
+
+    step_start = time.perf_counter()
+    next_at = step_start
+    while next_at - step_start < args.step_seconds:
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        if in_flight >= args.concurrency * 4:
+            # Client-side backlog is full: count the arrival as dropped rather than queueing forever
+            dropped += 1
+        else:
+            scenario = source.rng.choices(scenarios, weights)[0]
+            path, payload = source.request(scenario)
+            in_flight += 1
+            tasks.append(asyncio.create_task(send(scenario, path, payload)))
+        next_at += source.next_gap() / rate
+    sent_elapsed = time.perf_counter() - step_start
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - step_start
+
+    per_scenario = {}
+    total = errors = 0
+    for scenario in scenarios:
+        lat = sorted(latencies[scenario])
+        failed = sum(n for status, n in statuses[scenario].items() if not (isinstance(status, int) and status < 400))
+        total += len(lat)
+        errors += failed
+        per_scenario[scenario] = {
+            "requests": len(lat),
+            "errors": failed,
+            "statuses": {str(k): v for k, v in statuses[scenario].items()},
+            "p50_ms": percentile(lat, 50),
+            "p95_ms": percentile(lat, 95),
+            "p99_ms": percentile(lat, 99),
+        }
+    all_latencies = sorted(itertools.chain.from_iterable(latencies.values()))
+    return {
+        "offered_rps": rate,
+        "achieved_rps": total / elapsed if elapsed else 0.0,
+        "send_seconds": sent_elapsed,
+        "drain_seconds": elapsed - sent_elapsed,
+        "requests": total,
+        "dropped": dropped,
+        "error_rate": (errors + dropped) / (total + dropped) if total + dropped else 0.0,
+        "p50_ms": percentile(all_latencies, 50),
+        "p95_ms": percentile(all_latencies, 95),
+        "p99_ms": percentile(all_latencies, 99),
+        "queue_depth": await queue_depth(session, args.url),
+        "scenarios": per_scenario,
+    }
+
+
+def saturated(step: Dict[str, Any], args) -> List[str]:
+    reasons = []
+    if step["achieved_rps"] < args.min_throughput_ratio * step["offered_rps"]:
+        reasons.append(f"achieved {step['achieved_rps']:.1f}/{step['offered_rps']:.1f} rps")
+    if step["error_rate"] > args.max_error_rate:
+        reasons.append(f"error rate {step['error_rate']:.1%}")
+    if args.max_p95_ms and step["p95_ms"] > args.max_p95_ms:
+        reasons.append(f"p95 {step['p95_ms']:.0f} ms")
+    return reasons
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    history = load_history(args.history) if args.history else None
+    gaps: List[float] = []
+    if history:
+        stamps = []
+        for m in history:
+            try:
+                stamps.append(int(datetime.datetime.fromisoformat(m["timestamp"].replace("Z", "+00:00")).timestamp() * 1000))
+            except (KeyError, ValueError):
+                continue
+        gaps = normalized_gaps(stamps)
+    elif args.seed_ids:
+        with open(args.seed_ids) as f:
+            # Skip IDs that are not Discord snowflakes (e.g. test messages)
+            gaps = normalized_gaps([snowflake_ms(i) for i in json.load(f) if str(i).isdigit()])
+    source = TrafficSource(
+        rng, history=history, gaps=gaps, reuse_ids=args.reuse_ids, channels=args.channels,
+        thread_length=args.thread_length, attachment_urls=args.attachment_urls,
+        attachment_ratio=args.attachment_ratio, burst_size=args.burst_size,
+    )
+    steps = []
+    saturation = None
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+        for rate in args.rates:
+            step = await run_step(session, args, source, args.mix, rate)
+            reasons = saturated(step, args)
+            step["saturated"] = reasons
+            steps.append(step)
+            depth = "n/a" if step["queue_depth"] is None else f"{step['queue_depth']:.0f}"
+            print(
+                f"{rate:>8.1f} rps offered | {step['achieved_rps']:>8.1f} achieved | p50 {step['p50_ms']:>7.1f} "
+                f"p95 {step['p95_ms']:>7.1f} p99 {step['p99_ms']:>7.1f} ms | errors {step['error_rate']:>6.1%} "
+                f"| queue {depth}" + (f" | SATURATED: {'; '.join(reasons)}" if reasons else "")
+            )
+            if reasons and saturation is None:
+                saturation = {"rate": rate, "last_good_rate": steps[-2]["offered_rps"] if len(steps) > 1 else None, "reasons": reasons}
+                if not args.keep_going:
+                    break
+    if saturation:
+        print(f"Saturation at {saturation['rate']} rps (last good: {saturation['last_good_rate']})")
+    else:
+        print("No saturation within the tested rates.")
+    return {
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("api_key", "output")},
+        "steps": steps,
+        "saturation": saturation,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("BACKEND_URL", "http://localhost:8000"))
+    parser.add_argument("--api-key", default=os.getenv("BACKEND_API_KEY", "your_secret_api_key_here"))
+    parser.add_argument("--rates", type=float, nargs="+", default=[5, 10, 20, 40, 80], help="Arrival rates (requests/s) per step")
+    parser.add_argument("--step-seconds", type=float, default=30)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("ingest=0.6,query=0.3,ingest_thread=0.1"))
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum in-flight requests")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--history", help="Exported message payloads (JSON list or JSONL) to replay")
+    parser.add_argument("--seed-ids", help="JSON list of message IDs (e.g. processed_messages.json) whose timestamps shape arrivals")
+    parser.add_argument("--reuse-ids", action="store_true", help="Replay history with its original message IDs")
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--thread-length", type=int, default=40, help="Mean messages per /ingest_thread payload")
+    parser.add_argument("--attachment-urls", nargs="*", default=[], help="URLs attached to a share of messages")
+    parser.add_argument("--attachment-ratio", type=float, default=0.1)
+    parser.add_argument("--burst-size", type=float, default=1.0, help="Mean requests per burst for synthetic arrivals")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--max-p95-ms", type=float, default=0, help="p95 budget in ms (0 = no budget)")
+    parser.add_argument("--min-throughput-ratio", type=float, default=0.9)
+    parser.add_argument("--keep-going", action="store_true", help="Run every rate even after saturation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="loadgen_report.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
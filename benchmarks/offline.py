@@ -0,0 +1,230 @@
+"""Local stand-ins for OpenAI and Pinecone so the backend can be benchmarked offline.
+
+`offline_backend()` patches the client constructors, moves the working directory to a scratch
+directory (the backend keeps its shared state and window databases relative to it) and
+imports `src.backend.api` against the stand-ins. It has to run before anything else imports the
+backend in the process.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+from contextlib import ExitStack, contextmanager
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+import numpy as np
+
+from src.backend.quantization import QuantizedMatrix, search
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def hashed_embedding(text: str, dim: int) -> List[float]:
+    """Deterministic bag-of-words vector: texts sharing words get similar embeddings."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    if not norm:
+        vec[0] = 1.0
+        norm = 1.0
+    return (vec / norm).tolist()
+
+
+class Latency:
+    """Simulated service latency: base + per_item seconds per call."""
+
+    def __init__(self, base: float = 0.0, per_item: float = 0.0):
+        self.base = base
+        self.per_item = per_item
+
+    async def wait(self, items: int = 1) -> None:
+        delay = self.base + self.per_item * items
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class FakeEmbeddings:
+    def __init__(self, dim: int, latency: Latency):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+        self.texts = 0
+
+    async def create(self, input: List[str], model: str = "", dimensions: Optional[int] = None, **kwargs: Any):
+        self.calls += 1
+        self.texts += len(input)
+        await self.latency.wait(len(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=hashed_embedding(t, dimensions or self.dim)) for t in input])
+
+
+class FakeChatCompletions:
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, messages: List[Dict[str, Any]], **kwargs: Any):
+        self.calls += 1
+        await self.latency.wait()
+        prompt = messages[-1]["content"]
+        answer = f"Stand-in answer based on {len(prompt)} characters of context."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+
+class FakeOpenAI:
+    """Mimics the parts of AsyncOpenAI the backend uses."""
+
+    def __init__(self, dim: int = 1536, embed_latency: Optional[Latency] = None, chat_latency: Optional[Latency] = None, **kwargs: Any):
+        self.embeddings = FakeEmbeddings(dim, embed_latency or Latency())
+        self.chat = SimpleNamespace(completions=FakeChatCompletions(chat_latency or Latency()))
+
+
+class InMemoryIndex:
+    """Brute-force cosine index with the Pinecone Index methods the backend calls, namespaces included.
+
+    The search matrix is kept at `storage` precision (see src/backend/quantization.py); with
+    float16/int8 the shortlist is rescored against the full-precision vectors.
+    """
+
+    def __init__(self, dim: int = 1536, storage: str = "float32"):
+        self.dim = dim
+        self.storage = storage
+        self._namespaces: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # Per namespace: (row IDs, search matrix), rebuilt on the first query after a write
+        self._matrices: Dict[str, Tuple[List[str], QuantizedMatrix]] = {}
+        self.upserted = 0
+        # The backend calls the index from a thread pool, like the real client
+        self._lock = threading.Lock()
+
+    def namespace(self, namespace: str = "") -> Dict[str, Dict[str, Any]]:
+        """Vectors of one namespace by ID ({"values", "metadata"})."""
+        return self._namespaces.setdefault(namespace, {})
+
+    @property
+    def _vectors(self) -> Dict[str, Dict[str, Any]]:
+        return self.namespace()
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str = "", **kwargs: Any) -> None:
+        with self._lock:
+            stored = self.namespace(namespace)
+            for v in vectors:
+                stored[v["id"]] = {"values": v["values"], "metadata": dict(v.get("metadata") or {})}
+            self.upserted += len(vectors)
+            self._matrices.pop(namespace, None)
+
+    def update(self, id: str, set_metadata: Optional[Dict[str, Any]] = None, namespace: str = "", **kwargs: Any) -> None:
+        with self._lock:
+            stored = self.namespace(namespace)
+            if id in stored and set_metadata:
+                stored[id]["metadata"].update(set_metadata)
+
+    def delete(self, ids: List[str], namespace: str = "", **kwargs: Any) -> None:
+        with self._lock:
+            stored = self.namespace(namespace)
+            for vector_id in ids:
+                stored.pop(vector_id, None)
+            self._matrices.pop(namespace, None)
+
+    def fetch(self, ids: List[str], namespace: str = "", **kwargs: Any):
+        stored = self.namespace(namespace)
+        found = {
+            i: SimpleNamespace(id=i, values=stored[i]["values"], metadata=dict(stored[i]["metadata"]))
+            for i in ids if i in stored
+        }
+        return SimpleNamespace(vectors=found)
+
+    def list(self, prefix: str = "", limit: int = 100, namespace: str = "", **kwargs: Any) -> Iterator[List[str]]:
+        ids = sorted(i for i in self.namespace(namespace) if i.startswith(prefix))
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    def list_paginated(self, prefix: str = "", limit: int = 100, pagination_token: Optional[str] = None,
+                       namespace: str = "", **kwargs: Any):
+        ids = sorted(i for i in self.namespace(namespace) if i.startswith(prefix))
+        start = int(pagination_token or 0)
+        end = start + limit
+        return SimpleNamespace(
+            vectors=[SimpleNamespace(id=i) for i in ids[start:end]],
+            pagination=SimpleNamespace(next=str(end)) if end < len(ids) else None,
+        )
+
+    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = False, include_values: bool = False,
+              namespace: str = "", **kwargs: Any):
+        with self._lock:
+            stored = self.namespace(namespace)
+            if not stored:
+                return SimpleNamespace(matches=[])
+            if namespace not in self._matrices:
+                ids = list(stored)
+                self._matrices[namespace] = (ids, QuantizedMatrix([stored[i]["values"] for i in ids], self.storage))
+            ids, matrix = self._matrices[namespace]
+            full_rows = lambda rows: np.asarray([stored[ids[i]]["values"] for i in rows], dtype=np.float32)
+            top, scores = search(matrix, vector, top_k, full_rows)
+            matches = [
+                SimpleNamespace(
+                    id=ids[i],
+                    score=float(score),
+                    metadata=dict(stored[ids[i]]["metadata"]) if include_metadata else {},
+                    values=list(stored[ids[i]]["values"]) if include_values else [],
+                )
+                for i, score in zip(top, scores)
+            ]
+            return SimpleNamespace(matches=matches)
+
+    @property
+    def matrix_bytes(self) -> int:
+        """Memory held by the search matrices (0 until the first query builds one)."""
+        return sum(matrix.nbytes for _, matrix in self._matrices.values())
+
+    def describe_index_stats(self, **kwargs: Any) -> Dict[str, Any]:
+        namespaces = {ns: {"vector_count": len(vectors)} for ns, vectors in self._namespaces.items() if vectors}
+        return {
+            "dimension": self.dim,
+            "total_vector_count": sum(n["vector_count"] for n in namespaces.values()),
+            "namespaces": namespaces,
+        }
+
+
+def _blank_spacy(*args: Any, **kwargs: Any):
+    import spacy
+    return spacy.blank("en")
+
+
+@contextmanager
+def offline_backend(
+    dim: int = 1536,
+    embed_latency: Optional[Latency] = None,
+    chat_latency: Optional[Latency] = None,
+    workdir: Optional[str] = None,
+    storage: str = "float32",
+):
+    """Import the backend against local stand-ins. Yields (api module, fake OpenAI client, index)."""
+    index = InMemoryIndex(dim, storage)
+    client = FakeOpenAI(dim, embed_latency, chat_latency)
+    previous_cwd = os.getcwd()
+    with ExitStack() as stack:
+        workdir = workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix="vita-bench-"))
+        stack.enter_context(mock.patch.dict(os.environ, {
+            "PINECONE_API_KEY": os.environ.get("PINECONE_API_KEY") or "offline",
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "offline",
+            "WINDOW_STATE_PATH": os.path.join(workdir, "conversation_windows.db"),
+        }))
+        stack.enter_context(mock.patch("pinecone.Pinecone.Index", lambda self, *a, **kw: index))
+        stack.enter_context(mock.patch("openai.AsyncOpenAI", lambda *a, **kw: client))
+        stack.enter_context(mock.patch("spacy.load", _blank_spacy))
+        if REPO_ROOT not in sys.path:
+            sys.path.insert(0, REPO_ROOT)
+        os.chdir(workdir)
+        try:
+            from src.backend import api
+            yield api, client, index
+        finally:
+            os.chdir(previous_cwd)
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Optional
+from src.backend.llm_client import BULK, INTERACTIVE
+from src.backend.logger import get_logger
+from src.backend.metrics import (
+    ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_SHED, ADMISSION_WAIT_SECONDS, BULK_DEFERRED_SECONDS,
+    INTERACTIVE_PRESSURE,
+)
+from src.backend.shared_state import get_shared_state
+
+logger = get_logger(__name__)
+
+# Per API process. /query beyond these limits waits for a slot, up to QUERY_QUEUE_TIMEOUT_SECONDS
+QUERY_MAX_CONCURRENCY = int(os.getenv("QUERY_MAX_CONCURRENCY", "16"))
+QUERY_MAX_PER_GUILD = int(os.getenv("QUERY_MAX_PER_GUILD", "8"))
+QUERY_MAX_PER_USER = int(os.getenv("QUERY_MAX_PER_USER", "2"))
+# Queries already waiting beyond which new ones are rejected straight away
+QUERY_MAX_QUEUED = int(os.getenv("QUERY_MAX_QUEUED", "64"))
+QUERY_QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUERY_QUEUE_TIMEOUT_SECONDS", "10"))
+# Interactive latency objective (p95 of /query). Bulk work backs off once recent latency reaches
+# QUERY_SLO_HEADROOM of it, or whenever queries queue on QUERY_MAX_CONCURRENCY.
+QUERY_LATENCY_SLO_SECONDS = float(os.getenv("QUERY_LATENCY_SLO_SECONDS", "8"))
+QUERY_SLO_HEADROOM = float(os.getenv("QUERY_SLO_HEADROOM", "0.8"))
+QUERY_LATENCY_WINDOW = int(os.getenv("QUERY_LATENCY_WINDOW", "50"))
+# In-process bulk tasks (inline ingestion mode): how many run at once, and how many may wait
+# before new bulk requests are shed with 503
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "2"))
+BULK_MAX_QUEUED = int(os.getenv("BULK_MAX_QUEUED", "20"))
+# Longest single back-off, so that job leases and bulk requests do not time out while deferred
+BULK_MAX_DEFER_SECONDS = float(os.getenv("BULK_MAX_DEFER_SECONDS", "10"))
+BULK_RETRY_AFTER_SECONDS = 5
+
+# Pressure is published in shared state so ingestion workers in other processes see it
+PRESSURE_KEY = "admission:pressure"
+PRESSURE_TTL_SECONDS = 2.0
+_PRESSURE_CHECK_SECONDS = 0.5
+_POLL_SECONDS = 0.25
+
+
+class AdmissionRejected(Exception):
+    """The request was shed; the client should retry after retry_after seconds."""
+
+    def __init__(self, priority: str, reason: str, retry_after: float):
+        super().__init__(f"{priority} request rejected ({reason})")
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Admission for the two priority classes sharing a process: interactive queries and bulk ingestion.
+
+    Queries are limited globally, per guild and per user, and queue briefly for a slot. Recent
+    query latency is compared with the SLO; while it is at risk, or queries queue on the process
+    limit, bulk work is held back and new bulk requests are shed before any query is.
+    """
+
+    def __init__(self, max_concurrency: int = QUERY_MAX_CONCURRENCY, max_per_guild: int = QUERY_MAX_PER_GUILD,
+                 max_per_user: int = QUERY_MAX_PER_USER, max_queued: int = QUERY_MAX_QUEUED,
+                 queue_timeout: float = QUERY_QUEUE_TIMEOUT_SECONDS, bulk_concurrency: int = BULK_MAX_CONCURRENCY,
+                 bulk_max_queued: int = BULK_MAX_QUEUED):
+        self.max_concurrency = max_concurrency
+        self.max_per_guild = max_per_guild
+        self.max_per_user = max_per_user
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.bulk_concurrency = bulk_concurrency
+        self.bulk_max_queued = bulk_max_queued
+        self.in_flight = {INTERACTIVE: 0, BULK: 0}
+        self.queued = {INTERACTIVE: 0, BULK: 0}
+        self.per_guild: Counter = Counter()
+        self.per_user: Counter = Counter()
+        self.latencies: Deque[float] = deque(maxlen=QUERY_LATENCY_WINDOW)
+        self._changed: Optional[asyncio.Condition] = None
+        self._pressure = False
+        self._published_at = 0.0
+        self._shared_checked_at = 0.0
+        self._shared_pressure = False
+
+    @property
+    def _condition(self) -> asyncio.Condition:
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def _report(self) -> None:
+        for priority in (INTERACTIVE, BULK):
+            ADMISSION_QUEUED.set(self.queued[priority], priority=priority)
+            ADMISSION_IN_FLIGHT.set(self.in_flight[priority], priority=priority)
+
+    def _shed(self, priority: str, reason: str, retry_after: float) -> AdmissionRejected:
+        ADMISSION_SHED.inc(priority=priority, reason=reason)
+        logger.warning(f"Shed {priority} request: {reason}")
+        return AdmissionRejected(priority, reason, retry_after)
+
+    def _query_fits(self, guild_id: str, user_id: str) -> bool:
+        return (self.in_flight[INTERACTIVE] < self.max_concurrency
+                and self.per_guild[guild_id] < self.max_per_guild
+                and self.per_user[user_id] < self.max_per_user)
+
+    @asynccontextmanager
+    async def query(self, guild_id: str, user_id: str):
+        """Hold an interactive slot for one query; raises AdmissionRejected when it cannot get one in time."""
+        start = time.perf_counter()
+        if not self._query_fits(guild_id, user_id):
+            if self.queued[INTERACTIVE] >= self.max_queued:
+                raise self._shed(INTERACTIVE, "queue_full", 1.0)
+            self.queued[INTERACTIVE] += 1
+            if self.in_flight[INTERACTIVE] >= self.max_concurrency:
+                # Queueing on the process-wide limit (not on one guild's or user's) means the process is saturated
+                self._set_pressure(True)
+            self._report()
+            try:
+                async with self._condition:
+                    await asyncio.wait_for(self._condition.wait_for(lambda: self._query_fits(guild_id, user_id)),
+                                           self.queue_timeout)
+            except asyncio.TimeoutError:
+                limited = "user_limit" if self.per_user[user_id] >= self.max_per_user else (
+                    "guild_limit" if self.per_guild[guild_id] >= self.max_per_guild else "timeout")
+                raise self._shed(INTERACTIVE, limited, 1.0)
+            finally:
+                self.queued[INTERACTIVE] -= 1
+        admitted = time.perf_counter()
+        ADMISSION_WAIT_SECONDS.observe(admitted - start, priority=INTERACTIVE)
+        self.in_flight[INTERACTIVE] += 1
+        self.per_guild[guild_id] += 1
+        self.per_user[user_id] += 1
+        self._report()
+        try:
+            yield
+        finally:
+            self.in_flight[INTERACTIVE] -= 1
+            self.per_guild[guild_id] -= 1
+            self.per_user[user_id] -= 1
+            # Drop zero counts so the counters only hold guilds and users with queries in flight
+            self.per_guild += Counter()
+            self.per_user += Counter()
+            self.record_latency(time.perf_counter() - admitted)
+            self._report()
+            async with self._condition:
+                self._condition.notify_all()
+
+    def record_latency(self, seconds: float) -> None:
+        """Record how long an admitted query took and re-evaluate whether the SLO is at risk."""
+        self.latencies.append(seconds)
+        self._set_pressure(self.latency_p95() >= QUERY_LATENCY_SLO_SECONDS * QUERY_SLO_HEADROOM)
+
+    def latency_p95(self) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def _set_pressure(self, pressure: bool) -> None:
+        if pressure != self._pressure:
+            logger.info("Interactive latency at risk; holding back bulk work" if pressure else "Interactive pressure cleared")
+        self._pressure = pressure
+        INTERACTIVE_PRESSURE.set(1 if pressure else 0)
+        now = time.monotonic()
+        if pressure and now - self._published_at >= PRESSURE_TTL_SECONDS / 2:
+            # Refreshed while pressure lasts; expires on its own once it is gone
+            get_shared_state().cache_set(PRESSURE_KEY, True, PRESSURE_TTL_SECONDS)
+            self._published_at = now
+
+    def under_pressure(self) -> bool:
+        """True while interactive latency in this or another API process is at risk."""
+        if self._pressure:
+            return True
+        now = time.monotonic()
+        if now - self._shared_checked_at >= _PRESSURE_CHECK_SECONDS:
+            self._shared_pressure = bool(get_shared_state().cache_get(PRESSURE_KEY))
+            self._shared_checked_at = now
+        return self._shared_pressure
+
+    def admit_bulk(self) -> None:
+        """Shed a new in-process bulk request when the bulk backlog is full, or is non-empty under pressure."""
+        backlog = self.queued[BULK] + self.in_flight[BULK]
+        if backlog >= self.bulk_max_queued + self.bulk_concurrency:
+            raise self._shed(BULK, "queue_full", BULK_RETRY_AFTER_SECONDS)
+        if backlog and self.under_pressure():
+            raise self._shed(BULK, "interactive_pressure", BULK_RETRY_AFTER_SECONDS)
+
+    @asynccontextmanager
+    async def bulk(self):
+        """Hold one of the in-process bulk slots, waiting first while interactive traffic is under pressure."""
+        start = time.perf_counter()
+        self.queued[BULK] += 1
+        self._report()
+        try:
+            while True:
+                await self.yield_to_interactive()
+                if self.in_flight[BULK] < self.bulk_concurrency:
+                    break
+                async with self._condition:
+                    await self._condition.wait_for(lambda: self.in_flight[BULK] < self.bulk_concurrency)
+        finally:
+            self.queued[BULK] -= 1
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - start, priority=BULK)
+        self.in_flight[BULK] += 1
+        self._report()
+        try:
+            yield
+        finally:
+            self.in_flight[BULK] -= 1
+            self._report()
+            async with self._condition:
+                self._condition.notify_all()
+
+    async def yield_to_interactive(self, max_wait: float = BULK_MAX_DEFER_SECONDS) -> float:
+        """Back off (up to max_wait) while interactive traffic is under pressure; returns the time waited.
+
+        Bulk loops call this between units of work, so a running backfill makes room within one message.
+        """
+        start = time.perf_counter()
+        while self.under_pressure() and time.perf_counter() - start < max_wait:
+            await asyncio.sleep(_POLL_SECONDS)
+        waited = time.perf_counter() - start
+        if waited >= _POLL_SECONDS:
+            BULK_DEFERRED_SECONDS.inc(waited)
+        return waited
+
+
+admission = AdmissionController()
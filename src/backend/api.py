@@ -1,37 +1,62 @@
 # FastAPI backend logic will be implemented here 
 
+import time
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException, Request, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 import os
-from src.backend.embedding import index, embed_chunks, store_embeddings, sanitize_metadata
-from src.backend.llm_client import openai_client
+from src.backend.embedding import (
+    get_index, active_target, embed_chunks, embed_query, store_embeddings, sanitize_metadata,
+    load_embedding_model, check_index_compatibility, index_namespaces,
+)
+from src.backend.llm_client import chat_completion, QUERY_LLM_MODEL, INTERACTIVE, BULK
+from src.backend.admission import admission, AdmissionRejected
 from src.backend.permissions import filter_by_permissions
 from src.backend.feedback import log_feedback, log_to_dlq
 from dotenv import load_dotenv
-from src.backend.utils import clean_text, redact_pii, chunk_messages, split_text_for_embedding
-from src.backend.ingestion import is_processed, mark_processed, LOCKS_DIR
+from src.backend.utils import clean_text, redact_pii
+from src.backend.chunking import TextChunker, iter_text_chunks, count_tokens, get_encoding
+from src.backend.windowing import (
+    WINDOW_MESSAGE_MAX_TOKENS, conversation_key, get_window_store, pack_messages, render_window, apply_message_changes,
+    window_message_key, window_message_of,
+)
+from src.backend.preprocess import preprocess_text, preprocess_texts
+from src.backend.ingestion import is_processed, mark_processed, claim, release
+from src.backend.shared_state import OWNER_ID, get_shared_state
 import aiohttp
-from unstructured.partition.auto import partition
-import io
+import asyncio
 import traceback
-import pytesseract
-from PIL import Image
-import tempfile
-import mimetypes
+import uuid
 import json
 import shutil
 from src.backend.security import get_api_key
-import pinecone
-import openai
+from src.backend.vector_store import (
+    message_vector_id, thread_vector_id, thread_vector_prefix,
+    list_vector_ids, message_vector_ids, delete_vectors, index_call,
+)
 from src.backend.logger import get_logger
-import spacy
-from sentence_transformers import CrossEncoder
 from src.backend import feedback as feedback_module
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import datetime
-from src.backend.file_processor import process_attachments
+from collections import defaultdict
+from contextlib import AsyncExitStack
+from src.backend.file_processor import iter_attachment_text, load_partitioners
+from src.backend import startup
+from functools import lru_cache
+from src.backend.metrics import (
+    INGESTED_MESSAGES, NEAR_DUPLICATES, BACKGROUND_TASKS, JOB_QUEUE_DEPTH, QUERY_CONTEXT_TOKENS, QUERY_CONTEXT_TOKENS_SAVED, render_all_processes, publish_snapshots,
+    GUILD_QUERY_SECONDS, GUILD_VECTORS,
+)
+from src.backend.context_selection import select_context, shortlist, chunk_text
+from src.backend.doc_store import get_doc_store, hydrate
+from src.backend.near_duplicates import duplicate_scope, get_near_duplicates
+from src.backend.index_migration import maybe_shadow_query
+from src.backend.sharding import current_guild, guild_of_namespace, guild_scope, job_shard
+from src.backend.worker import job_attempt
+from src.backend.tracing import TracingMiddleware, span_store, stage, span, continue_trace, current_context
 
 app = FastAPI(title="VITA Discord AI Knowledge Assistant Backend")
 
@@ -43,6 +68,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(TracingMiddleware)
 
 # Dependency check for tesseract and pdftotext
 missing_deps = []
@@ -50,10 +76,28 @@ if shutil.which('tesseract') is None:
     missing_deps.append('tesseract')
 if shutil.which('pdftotext') is None:
     missing_deps.append('pdftotext (poppler-utils)')
-if missing_deps:
-    print(f"[WARNING] Missing system dependencies: {', '.join(missing_deps)}. Some document or image ingestion may fail. Please install them and restart the backend.")
-
 logger = get_logger(__name__)
+if missing_deps:
+    logger.warning(f"Missing system dependencies: {', '.join(missing_deps)}. Some document or image ingestion may fail. Please install them and restart the backend.")
+
+# "queue" hands background work to dedicated ingestion workers through the shared job queue
+INGEST_MODE = os.getenv("INGEST_MODE", "inline")
+# Job priorities in the shared queue: live events ahead of history backfills
+JOB_PRIORITIES = {"ingest": 1, "index_changes": 1, "ingest_thread": 1, "batch_ingest": 0}
+BULK_JOB_PRIORITY = 0
+# Ingestion requests are bulk (deferred and shed first) when they are history backfills or say so
+# with this header (e.g. dead-letter replays)
+PRIORITY_HEADER = "X-Priority"
+BULK_KINDS = {"batch_ingest"}
+# Chunks embedded and upserted per request while a message and its attachments stream in; bounds
+# the memory and the embedding request size of large documents
+INGEST_STREAM_BATCH = int(os.getenv("INGEST_STREAM_BATCH", "64"))
+
+@lru_cache(maxsize=1)
+def get_nlp():
+    """spaCy pipeline for entity extraction, loaded on first use."""
+    import spacy
+    return spacy.load("en_core_web_sm")
 
 class IngestRequest(BaseModel):
     message_id: str
@@ -64,6 +108,7 @@ class IngestRequest(BaseModel):
     attachments: Optional[List[str]] = None
     thread_id: Optional[str] = None
     roles: Optional[List[str]] = None
+    guild_id: Optional[str] = None
 
 class EmbedRequest(BaseModel):
     chunks: List[str]
@@ -72,6 +117,7 @@ class EmbedRequest(BaseModel):
 class QueryRequest(BaseModel):
     user_id: str
     channel_id: str
+    guild_id: Optional[str] = None
     roles: List[str]
     question: str
     top_k: int = 5
@@ -92,127 +138,351 @@ class ThreadIngestRequest(BaseModel):
     thread_id: str
     parent_message_id: Optional[str] = None
     messages: List[IngestRequest]
+    guild_id: Optional[str] = None
 
-async def process_attachments(attachment_urls: List[str]) -> str:
-    """Downloads, parses, and extracts text from file attachments. Supports more types and logs failures."""
-    all_docs_text = []
-    # Expanded supported types
-    supported_mime_types = [
-        "application/pdf",
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        "text/plain",
-        "text/csv",
-        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        "application/vnd.oasis.opendocument.text",
-        "application/rtf",
-        "text/html",
-        "application/msword",
-        "application/vnd.ms-excel",
-        "application/vnd.ms-powerpoint"
-    ]
-    image_mime_types = ["image/jpeg", "image/png", "image/gif", "image/bmp", "image/tiff"]
-    for url in attachment_urls:
+class MessageChange(BaseModel):
+    action: str  # "edit", "delete" or "delete_thread"
+    message_ids: List[str] = []
+    message: Optional[IngestRequest] = None
+    thread_id: Optional[str] = None
+
+class IndexChangesRequest(BaseModel):
+    changes: List[MessageChange]
+    guild_id: Optional[str] = None
+
+def message_metadata(req: IngestRequest, chunk_text: str, chunk_index: int, entities: List[str]) -> Dict[str, Any]:
+    """Vector metadata of one chunk of a single message."""
+    return sanitize_metadata({
+        "message_id": req.message_id,
+        "thread_id": req.thread_id if req.thread_id is not None else "",
+        "user_id": req.user_id if req.user_id is not None else "",
+        "channel_id": req.channel_id if req.channel_id is not None else "",
+        "guild_id": req.guild_id or "",
+        "chunk_text": chunk_text,
+        "chunk_index": chunk_index,
+        "roles": req.roles or [],
+        "timestamp": req.timestamp,
+        "entities": entities,
+    })
+
+def request_guild(req: BaseModel) -> Optional[str]:
+    """Guild a request's content belongs to; the bot sends batches, threads and changes per guild."""
+    guild_id = getattr(req, "guild_id", None)
+    messages = getattr(req, "messages", None)
+    return guild_id or (messages[0].guild_id if messages else None)
+
+async def iter_message_chunks(text: str, attachments: Optional[List[str]] = None) -> AsyncIterator[str]:
+    """Chunks of a message's text followed by its attachments' text, chunked as the attachments are extracted."""
+    chunker = TextChunker()
+    for chunk in chunker.feed(text):
+        yield chunk
+    if attachments:
+        async for piece in iter_attachment_text(attachments):
+            for chunk in chunker.feed(piece):
+                yield chunk
+    for chunk in chunker.close():
+        yield chunk
+
+async def iter_message_batches(req: IngestRequest, redacted: Optional[str] = None,
+                               batch_size: int = INGEST_STREAM_BATCH) -> AsyncIterator[Tuple[List[str], List[Dict[str, Any]], List[str]]]:
+    """Clean, redact and chunk a message plus its attachments, yielding (chunk_texts, metadatas, vector_ids) batches.
+
+    `redacted` may carry the already preprocessed content when the caller batch-preprocessed it.
+    Attachments are extracted, chunked and batched as they stream in, so a large document is
+    embedded and upserted a batch at a time instead of being held whole. Chunk metadata carries
+    the chunk index, so chunk vectors are stored under deterministic IDs and can be replaced or
+    deleted per message. Nothing is yielded for a message without text.
+    """
+    if redacted is None:
+        with stage("ingest", "preprocess"):
+            redacted = preprocess_text(req.content)
+
+    # Extract NER entities (from the message itself) and add to metadata
+    entities: List[str] = []
+    if redacted.strip():
+        with stage("ingest", "entities"):
+            doc = get_nlp()(redacted)
+            entities = [ent.text for ent in doc.ents if ent.label_ in ("PERSON", "ORG", "PRODUCT", "DATE")]
+
+    def batch(text_chunks: List[str], first_index: int) -> Tuple[List[str], List[Dict[str, Any]], List[str]]:
+        metadatas = [message_metadata(req, chunk_text, i, entities) for i, chunk_text in enumerate(text_chunks, first_index)]
+        ids = [message_vector_id(req.message_id, i) for i in range(first_index, first_index + len(text_chunks))]
+        return text_chunks, metadatas, ids
+
+    pending: List[str] = []
+    first_index = 0
+    async for chunk in iter_message_chunks(redacted, req.attachments):
+        pending.append(chunk)
+        if len(pending) >= batch_size:
+            yield batch(pending, first_index)
+            first_index += len(pending)
+            pending = []
+    if pending:
+        yield batch(pending, first_index)
+
+async def link_near_duplicates(req: IngestRequest, text_chunks: List[str], metadatas: List[Dict[str, Any]],
+                         ids: List[str]) -> Tuple[List[str], List[Dict[str, Any]], List[str]]:
+    """Link chunks that nearly duplicate an indexed vector to it (as an extra cited source) instead of storing them.
+
+    Returns the chunks, metadata and vector IDs that still need to be embedded.
+    """
+    duplicates = get_near_duplicates()
+    scope = duplicate_scope(req.roles, req.guild_id)
+    kept: Tuple[List[str], List[Dict[str, Any]], List[str]] = ([], [], [])
+    for text, meta, vector_id in zip(text_chunks, metadatas, ids):
+        match = None
+        if duplicates.enabled_for(text):
+            match = duplicates.find(text, scope)
+            NEAR_DUPLICATES.inc(result="duplicate" if match else "unique")
+        if match is None:
+            for part, value in zip(kept, (text, meta, vector_id)):
+                part.append(value)
+            continue
+        await update_duplicate_sources({match: duplicates.link(match, req.message_id, req.channel_id or "", vector_id, meta)})
+    return kept
+
+def window_duplicate_sources(window: Dict[str, Any]) -> List[str]:
+    """Duplicate sources linked to any message of a conversation window."""
+    return get_near_duplicates().sources(*(window_message_key(m["message_id"]) for m in window["messages"]))
+
+async def update_duplicate_sources(sources: Dict[str, List[str]]) -> None:
+    """Write each vector's linked duplicate sources ("channel_id:message_id") into its metadata.
+
+    Keys of windowed messages update their window, with the sources of all its messages.
+    """
+    updates = {key: linked for key, linked in sources.items() if window_message_of(key) is None}
+    windowed = [window_message_of(key) for key in sources if window_message_of(key) is not None]
+    for window in get_window_store().windows_for_messages(windowed):
+        updates[window["window_id"]] = window_duplicate_sources(window)
+    await asyncio.gather(*(index_call("update", id=vector_id, set_metadata={"duplicate_sources": linked})
+                           for vector_id, linked in updates.items()))
+
+async def reindex_duplicates(linked: Dict[str, Tuple[str, List[Tuple[str, Dict[str, Any]]]]]) -> None:
+    """Index the duplicates linked to vectors that are going away (see NearDuplicateIndex.linked_chunks).
+
+    For each vector, its oldest linked duplicate chunk is embedded as the new canonical vector and
+    the remaining duplicates are linked to it.
+    """
+    promoted = [(scope, chunks[0], chunks[1:]) for scope, chunks in linked.values() if chunks]
+    if not promoted:
+        return
+    duplicates = get_near_duplicates()
+    ids, texts, metadatas = [], [], []
+    for scope, (chunk_id, meta), rest in promoted:
+        sources = [duplicates.link(chunk_id, m["message_id"], m.get("channel_id", ""), rest_id, m) for rest_id, m in rest]
+        ids.append(chunk_id)
+        texts.append(meta["chunk_text"])
+        metadatas.append({**meta, "duplicate_sources": sources[-1]} if sources else meta)
+    with stage("ingest", "embed"):
+        embeddings = await embed_chunks(texts)
+    with stage("ingest", "upsert"):
+        await store_embeddings(embeddings, metadatas, ids=ids)
+    for (scope, _, _), chunk_id, text in zip(promoted, ids, texts):
+        duplicates.add([(chunk_id, text)], scope)
+    logger.info(f"Re-indexed {len(ids)} near-duplicates of removed vectors")
+
+async def forget_vectors(vector_ids: List[str], message_ids: List[str]) -> None:
+    """Drop near-duplicate state for vectors about to be deleted or replaced, and for edited/deleted messages linked as duplicates.
+
+    Duplicates still linked to those vectors are indexed on their own first, so deleting or
+    editing the message they duplicate never takes them out of the index.
+    """
+    duplicates = get_near_duplicates()
+    changed = duplicates.unlink(message_ids)
+    await reindex_duplicates(duplicates.linked_chunks(vector_ids))
+    duplicates.forget(vector_ids)
+    removed = set(vector_ids)
+    await update_duplicate_sources({v: linked for v, linked in changed.items() if v not in removed})
+
+def window_lock(conversation: str):
+    """Cross-process lock on a conversation's windows (workers share the window store)."""
+    return get_shared_state().lock(f"window:{conversation}")
+
+def is_windowable(req: IngestRequest, redacted: str) -> bool:
+    """Short plain-text messages are packed into conversation windows instead of getting their own vector.
+
+    Repeats of an indexed message are linked to it rather than packed (see _ingest_conversation_windows).
+    """
+    return not req.attachments and bool(redacted.strip()) and count_tokens(redacted) <= WINDOW_MESSAGE_MAX_TOKENS
+
+def build_window_metadata(window: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Render a conversation window and build its vector metadata, including per-message offsets for citations."""
+    text, offsets = render_window(window)
+    messages = window["messages"]
+    roles = sorted({role for m in messages for role in m.get("roles", [])})
+    meta = {
+        "message_id": messages[0]["message_id"],
+        "message_ids": [m["message_id"] for m in messages],
+        "message_offsets": offsets,
+        "user_ids": list(dict.fromkeys(m["user_id"] for m in messages)),
+        "thread_id": window["thread_id"],
+        "channel_id": window["channel_id"],
+        "guild_id": current_guild() or "",
+        "chunk_text": text,
+        "roles": roles,
+        "timestamp": messages[-1]["timestamp"],
+        "start_timestamp": messages[0]["timestamp"],
+        "is_window": True,
+        "duplicate_sources": window_duplicate_sources(window),
+    }
+    return text, sanitize_metadata(meta)
+
+async def upsert_windows(windows: List[Dict[str, Any]]) -> None:
+    """Embed and upsert conversation windows in one batch, keyed by window ID."""
+    if not windows:
+        return
+    rendered = [build_window_metadata(w) for w in windows]
+    with stage("ingest", "embed"):
+        embeddings = await embed_chunks([text for text, _ in rendered])
+    with stage("ingest", "upsert"):
+        await store_embeddings(embeddings, [meta for _, meta in rendered], ids=[w["window_id"] for w in windows])
+
+async def run_window_ingestion_task(items: List[Tuple[IngestRequest, str]]):
+    """Pack preprocessed messages into their conversations' windows and upsert the changed windows.
+
+    Only the conversation's open (last) window is reopened; earlier windows are left untouched.
+    """
+    groups: Dict[str, List[Tuple[IngestRequest, str]]] = defaultdict(list)
+    for req, redacted in items:
+        groups[conversation_key(req.channel_id, req.thread_id)].append((req, redacted))
+    for conversation, group in groups.items():
+        with guild_scope(group[0][0].guild_id):
+            await _ingest_conversation_windows(conversation, group)
+
+async def _ingest_conversation_windows(conversation: str, group: List[Tuple[IngestRequest, str]]) -> None:
+    async with window_lock(conversation):
+        pending = [(req, redacted) for req, redacted in group if not is_processed(req.message_id)]
+        if not pending:
+            return
+        first = pending[0][0]
+        duplicates = get_near_duplicates()
+        registered: List[str] = []
+        linked: Dict[str, List[str]] = {}
+        messages = []
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        content_type = resp.headers.get("Content-Type", "")
-                        file_content = await resp.read()
-                        file_name = url.split("/")[-1]
-                        # Document types
-                        if content_type in supported_mime_types:
-                            try:
-                                elements = partition(file=io.BytesIO(file_content), file_filename=file_name, content_type=content_type)
-                                doc_text = "\n\n".join([str(el) for el in elements])
-                                all_docs_text.append(f"\n\n--- Document Content: {file_name} ---\n\n{doc_text}")
-                            except Exception as e:
-                                log_to_dlq({"url": url, "file_name": file_name, "error": str(e), "type": "doc_parse"})
-                                all_docs_text.append(f"\n\n--- Document Content: {file_name} ---\n\n[Failed to parse document: {e}]")
-                        # Image types
-                        elif content_type in image_mime_types:
-                            try:
-                                with tempfile.NamedTemporaryFile(delete=False, suffix=file_name) as tmp:
-                                    tmp.write(file_content)
-                                    tmp.flush()
-                                    img = Image.open(tmp.name)
-                                    text = pytesseract.image_to_string(img)
-                                    all_docs_text.append(f"\n\n--- Image OCR Content: {file_name} ---\n\n{text}")
-                            except Exception as e:
-                                log_to_dlq({"url": url, "file_name": file_name, "error": str(e), "type": "image_ocr"})
-                                all_docs_text.append(f"\n\n--- Image OCR Content: {file_name} ---\n\n[Failed to OCR image: {e}]")
-                        else:
-                            # Unknown/unsupported type
-                            log_to_dlq({"url": url, "file_name": file_name, "error": f"Unsupported content type: {content_type}", "type": "unsupported"})
-                            all_docs_text.append(f"\n\n--- Attachment: {file_name} ---\n\n[Unsupported file type: {content_type}]")
-                    else:
-                        log_to_dlq({"url": url, "error": f"HTTP status {resp.status}", "type": "download"})
+            # Repeated announcements and bot messages are linked to the message they repeat instead of
+            # being packed again
+            with stage("ingest", "dedupe"):
+                for req, redacted in pending:
+                    key = window_message_key(req.message_id)
+                    scope = duplicate_scope(req.roles, req.guild_id)
+                    match = None
+                    if duplicates.enabled_for(redacted):
+                        match = duplicates.find(redacted, scope)
+                        # A retry after a crash finds the message's own signature
+                        match = None if match == key else match
+                        NEAR_DUPLICATES.inc(result="duplicate" if match else "unique")
+                    if match is not None:
+                        linked[match] = duplicates.link(match, req.message_id, req.channel_id or "",
+                                                        message_vector_id(req.message_id, 0), message_metadata(req, redacted, 0, []))
+                        continue
+                    # Registered before packing so that repeats later in the batch match it
+                    duplicates.add([(key, redacted)], scope)
+                    registered.append(key)
+                    messages.append({"message_id": req.message_id, "user_id": req.user_id, "timestamp": req.timestamp,
+                                     "text": redacted, "roles": req.roles or []})
+            if messages:
+                window_store = get_window_store()
+                with stage("ingest", "window_pack"):
+                    touched = pack_messages(window_store.open_window(conversation), messages, first.channel_id, first.thread_id)
+                await upsert_windows(touched)
+                window_store.save(touched, open_window=touched[-1])
+            await update_duplicate_sources(linked)
+            for req, _ in pending:
+                mark_processed(req.message_id)
+            INGESTED_MESSAGES.inc(len(pending), path="window")
         except Exception as e:
-            log_to_dlq({"url": url, "error": str(e), "type": "download_exception"})
-            print(f"Failed to process attachment {url}: {e}")
-    return "".join(all_docs_text)
-
-async def run_ingestion_task(req: IngestRequest):
+            duplicates.forget(registered)
+            duplicates.unlink([req.message_id for req, _ in pending])
+            if job_attempt():
+                raise
+            for req, _ in pending:
+                log_to_dlq({
+                    "original_request": req.dict(),
+                    "error_message": str(e),
+                    "failed_at_step": "window_ingestion",
+                    "timestamp": datetime.datetime.utcnow().isoformat()
+                })
+
+async def apply_window_changes(edited: Dict[str, str], deleted: set) -> set:
+    """Apply edited (already preprocessed) texts and deletions to stored windows.
+
+    Re-embeds the affected windows, deletes windows left empty, and returns the IDs of the
+    messages that were found in windows.
+    """
+    message_ids = list(edited) + list(deleted)
+    window_store = get_window_store()
+    windows = window_store.windows_for_messages(message_ids)
+    if not windows:
+        return set()
+    async with AsyncExitStack() as stack:
+        for conversation in sorted({w["conversation"] for w in windows}):
+            await stack.enter_async_context(window_lock(conversation))
+        # Re-read under the locks so a concurrent ingestion into the open window is not lost
+        windows = window_store.windows_for_messages(message_ids)
+        windowed = {m["message_id"] for w in windows for m in w["messages"]}
+        touched = windowed & (set(edited) | deleted)
+        # Repeats linked to the changed messages are indexed on their own before the messages change
+        await forget_vectors([window_message_key(m) for m in sorted(touched)], [])
+        changed, emptied = apply_message_changes(windows, edited, deleted & windowed)
+        duplicates = get_near_duplicates()
+        for window in changed:
+            for m in window["messages"]:
+                if m["message_id"] in edited:
+                    duplicates.add([(window_message_key(m["message_id"]), m["text"])], duplicate_scope(m.get("roles"), current_guild()))
+        await upsert_windows(changed)
+        await delete_vectors([w["window_id"] for w in emptied])
+        window_store.save(changed)
+        window_store.remove_messages(deleted & windowed)
+        window_store.delete_windows([w["window_id"] for w in emptied])
+    return touched
+
+async def run_ingestion_task(req: IngestRequest, redacted: Optional[str] = None):
+    if not claim(req.message_id):
+        return
     try:
-        lock_path = os.path.join(LOCKS_DIR, f"{req.message_id}.lock")
-        if os.path.exists(lock_path):
-            return
-        with open(lock_path, "w") as f:
-            f.write("")
         if is_processed(req.message_id):
             return
-        
-        # Process attachments
-        attachment_text = ""
-        if req.attachments:
-            attachment_text = await process_attachments(req.attachments)
-
-        # Clean and redact message content
-        cleaned = clean_text(req.content)
-        redacted = redact_pii(cleaned)
-        
-        # Combine message content with attachment text
-        full_content = redacted + attachment_text
-        
-        if not full_content.strip():
+
+        if redacted is None:
+            with stage("ingest", "preprocess"):
+                redacted = preprocess_text(req.content)
+        if is_windowable(req, redacted):
+            await run_window_ingestion_task([(req, redacted)])
             return
 
-        # Extract NER entities and add to metadata
-        nlp = spacy.load("en_core_web_sm")
-        doc = nlp(redacted)
-        entities = [ent.text for ent in doc.ents if ent.label_ in ("PERSON", "ORG", "PRODUCT", "DATE")]
-        
-        # Split into chunks for embedding
-        text_chunks = split_text_for_embedding(full_content, max_length=4000, overlap=200)
-        metadatas = []
-        for chunk_text in text_chunks:
-            meta = {
-                "message_id": req.message_id,
-                "thread_id": req.thread_id if req.thread_id is not None else "",
-                "user_id": req.user_id if req.user_id is not None else "",
-                "channel_id": req.channel_id if req.channel_id is not None else "",
-                "chunk_text": chunk_text,
-                "roles": req.roles or [],
-                "timestamp": req.timestamp,
-                "entities": entities,
-            }
-            sanitized_meta = sanitize_metadata(meta)
-            print(f"[DEBUG] Metadata before upsert: {sanitized_meta}")
-            metadatas.append(sanitized_meta)
+        chunk_count = 0
+        metadatas: List[Dict[str, Any]] = []
         try:
-            embeddings = await embed_chunks(text_chunks)
-            await store_embeddings(embeddings, metadatas)
+            # Embedded and upserted a batch at a time as the message's attachments are extracted
+            async for text_chunks, metadatas, ids in iter_message_batches(req, redacted):
+                chunk_count += len(text_chunks)
+                with stage("ingest", "dedupe"):
+                    text_chunks, metadatas, ids = await link_near_duplicates(req, text_chunks, metadatas, ids)
+                if text_chunks:
+                    with stage("ingest", "embed"):
+                        embeddings = await embed_chunks(text_chunks)
+                    with stage("ingest", "upsert"):
+                        await store_embeddings(embeddings, metadatas, ids=ids)
+                    get_near_duplicates().add(zip(ids, text_chunks), duplicate_scope(req.roles, req.guild_id))
+            if not chunk_count:
+                return
             mark_processed(req.message_id)
+            INGESTED_MESSAGES.inc(path="message")
             return
         except Exception as e:
+            if job_attempt():
+                raise
             log_to_dlq({
                 "message_id": req.message_id,
                 "error": str(e),
-                "content_preview": full_content[:200],
+                "content_preview": redacted[:200],
                 "type": "embedding_or_storage",
                 "metadata": metadatas
             })
     except Exception as e:
+        if job_attempt():
+            raise
         log_to_dlq({
             "original_request": req.dict(),
             "error_message": str(e),
@@ -220,14 +490,54 @@ async def run_ingestion_task(req: IngestRequest):
             "timestamp": datetime.datetime.utcnow().isoformat()
         })
     finally:
-        if os.path.exists(lock_path):
-            os.remove(lock_path)
+        release(req.message_id)
+
+def is_bulk(request: Request, kind: str) -> bool:
+    return kind in BULK_KINDS or request.headers.get(PRIORITY_HEADER, "").lower() == BULK
+
+def queue_task(background_tasks: BackgroundTasks, kind: str, func, *args, bulk: bool = False) -> None:
+    """Schedule a background task in the current trace and count it in the queue-depth gauge until it finishes.
+
+    In queue mode the task is stored in the shared job queue instead and run by an ingestion worker.
+    Bulk tasks are queued at the lowest priority; run inline, they are admitted by the admission
+    controller (which raises AdmissionRejected to shed them) and wait for a bulk slot.
+    """
+    if INGEST_MODE == "queue" and kind in JOB_HANDLERS:
+        (req,) = args
+        priority = BULK_JOB_PRIORITY if bulk else JOB_PRIORITIES.get(kind, 0)
+        get_shared_state().enqueue_job(kind, req.dict(), list(current_context()), priority, job_shard(request_guild(req)))
+        return
+    if bulk:
+        admission.admit_bulk()
+    BACKGROUND_TASKS.inc(kind=kind)
+    background_tasks.add_task(_run_queued_task, current_context(), kind, func, *args, bulk=bulk)
+
+async def _run_queued_task(context: Tuple[Optional[str], Optional[str]], kind: str, func, *args, bulk: bool = False) -> None:
+    try:
+        with continue_trace(*context), span(f"task.{kind}"), guild_scope(request_guild(args[0])):
+            if bulk:
+                async with admission.bulk():
+                    await func(*args)
+            else:
+                await func(*args)
+    finally:
+        BACKGROUND_TASKS.dec(kind=kind)
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    """Shed queries get 429 (slow down), shed bulk work 503 (come back later); both carry Retry-After."""
+    status = 429 if exc.priority == INTERACTIVE else 503
+    return JSONResponse(
+        status_code=status,
+        content={"detail": f"Server busy ({exc.reason}), retry later."},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
 
 @app.post("/ingest", dependencies=[Depends(get_api_key)])
-async def ingest_message(req: IngestRequest, background_tasks: BackgroundTasks):
+async def ingest_message(req: IngestRequest, background_tasks: BackgroundTasks, request: Request):
     if is_processed(req.message_id):
         return {"status": "already_processed", "message_id": req.message_id}
-    background_tasks.add_task(run_ingestion_task, req)
+    queue_task(background_tasks, "ingest", run_ingestion_task, req, bulk=is_bulk(request, "ingest"))
     return {"status": "accepted", "detail": "Ingestion task has been queued."}
 
 @app.post("/embed")
@@ -236,33 +546,48 @@ async def embed_chunks_endpoint(request: EmbedRequest) -> Dict[str, str]:
     # TODO: Call embedding logic
     return {"status": "embedding started", "num_chunks": str(len(request.chunks))}
 
-cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-
-def rerank_chunks(query: str, chunks: list) -> list:
-    pairs = [(query, chunk['chunk_text']) for chunk in chunks]
-    scores = cross_encoder.predict(pairs)
-    reranked = sorted(zip(chunks, scores), key=lambda x: x[1], reverse=True)
-    return [c for c, s in reranked]
+def build_citations(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """One citation per source message of the chunks: every message of a conversation window, plus linked near-duplicates."""
+    sources = []
+    for c in chunks:
+        message_ids = c.get("message_ids") or [c.get("message_id")]
+        sources.extend((c.get("channel_id"), message_id) for message_id in message_ids)
+        sources.extend(tuple(s.split(":", 1)) for s in c.get("duplicate_sources") or [] if ":" in s)
+    return [
+        {
+            "message_id": message_id,
+            "channel_id": channel_id,
+            "url": f"https://discord.com/channels/{{server_id}}/{channel_id}/{message_id}"
+        }
+        for channel_id, message_id in dict.fromkeys(sources)
+    ]
 
 @app.post("/query", response_model=QueryResponse)
 async def query_knowledge(req: QueryRequest) -> QueryResponse:
-    """Query the knowledge base (RAG pipeline)."""
+    """Query the knowledge base (RAG pipeline), searching only the asking guild's partition."""
+    async with admission.query(req.guild_id or "", req.user_id):
+        with stage("query", "total"), GUILD_QUERY_SECONDS.time(guild=req.guild_id or ""), guild_scope(req.guild_id):
+            return await _query_knowledge(req)
+
+async def _query_knowledge(req: QueryRequest) -> QueryResponse:
     # 1. Embed the question
-    embed_resp = await openai_client.embeddings.create(
-        input=[req.question],
-        model="text-embedding-ada-002"
-    )
-    question_emb = embed_resp.data[0].embedding
+    with stage("query", "embed"):
+        question_emb = await embed_query(req.question)
     # 2. Query Pinecone for top-k
-    pinecone_results = index.query(
-        vector=question_emb,
-        top_k=25,  # fetch more for permission filtering
-        include_metadata=True
-    )
+    with stage("query", "vector_query"):
+        pinecone_results = await index_call(
+            "query",
+            vector=question_emb,
+            top_k=25,  # fetch more for permission filtering
+            include_metadata=True,
+            include_values=True  # candidate vectors for MMR selection
+        )
+    maybe_shadow_query(req.question, pinecone_results.matches, 25)
     # 3. Filter by permissions
-    chunks = [m.metadata | {"score": m.score} for m in pinecone_results.matches]
-    filtered = filter_by_permissions(chunks, req.roles, req.channel_id)
-    filtered = sorted(filtered, key=lambda x: -x.get("score", 0))[:25]
+    with stage("query", "permission_filter"):
+        chunks = [m.metadata | {"score": m.score, "vector_id": m.id} for m in pinecone_results.matches]
+        filtered = filter_by_permissions(chunks, req.roles, req.channel_id)
+        filtered = sorted(filtered, key=lambda x: -x.get("score", 0))[:25]
     # 4. Guard clause for empty context
     if not filtered:
         return QueryResponse(
@@ -270,37 +595,34 @@ async def query_knowledge(req: QueryRequest) -> QueryResponse:
             citations=[],
             confidence=0.0
         )
-    # 5. Compose context
-    context_parts = []
-    for c in filtered:
-        text = c.get("chunk_text") or c.get("text")
-        if text:
-            context_parts.append(text)
-    context = "\n".join(context_parts)
+    # 5. Load the text of the most promising candidates only; vector metadata carries no text
+    values = {m.id: m.values or None for m in pinecone_results.matches}
+    with stage("query", "hydrate"):
+        candidates = shortlist(question_emb, filtered, [values.get(c["vector_id"]) for c in filtered])
+        candidates = hydrate(candidates, active_target()["index"])
+    # 6. Select and compose context: trim chunk overlap, drop duplicates, diversify with MMR
+    with stage("query", "context_selection"):
+        selected, token_stats = select_context(question_emb, candidates, [values.get(c["vector_id"]) for c in candidates])
+        QUERY_CONTEXT_TOKENS.observe(token_stats["candidate_tokens"], kind="candidates")
+        QUERY_CONTEXT_TOKENS.observe(token_stats["selected_tokens"], kind="selected")
+        QUERY_CONTEXT_TOKENS_SAVED.inc(token_stats["tokens_saved"])
+        logger.debug("Context selection kept %d/%d chunks, saved %d tokens", len(selected), len(filtered), token_stats["tokens_saved"])
+    context = "\n".join(chunk_text(c) for c in selected)
     
-    # 6. Generate answer
+    # 7. Generate answer
     prompt = f"Answer the user's question using only the context below. Cite sources by message ID.\n\nContext:\n{context}\n\nQuestion: {req.question}\nAnswer:"
-    completion = await openai_client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "system", "content": prompt}],
-        max_tokens=512,
-        temperature=0.2
-    )
+    with stage("query", "completion"):
+        completion = await chat_completion(
+            [{"role": "system", "content": prompt}],
+            model=QUERY_LLM_MODEL,
+            priority=INTERACTIVE,
+            max_tokens=512,
+            temperature=0.2
+        )
     answer = completion.choices[0].message.content.strip()
-    # 7. Prepare citations
-    citations = [
-        {
-            "message_id": c.get("message_id"),
-            "channel_id": c.get("channel_id"),
-            "url": f"https://discord.com/channels/{{server_id}}/{c.get('channel_id')}/{c.get('message_id')}"
-        }
-        for c in filtered
-    ]
+    # 8. Prepare citations for the chunks the answer was generated from, plus their linked near-duplicates
+    citations = build_citations(selected)
     confidence = float(filtered[0]["score"]) if filtered else 0.0
-
-    reranked = rerank_chunks(req.question, filtered)
-    top_chunks = reranked[:5]
-
     return QueryResponse(answer=answer, citations=citations, confidence=confidence)
 
 @app.post("/feedback", dependencies=[Depends(get_api_key)])
@@ -319,8 +641,16 @@ async def delete_message(req: Dict[str, Any]) -> Dict[str, str]:
     user_id = req.get("user_id")
     if not message_id or not user_id:
         raise HTTPException(status_code=400, detail="Missing message_id or user_id.")
-    # Remove from Pinecone
-    index.delete(ids=[message_id])
+    with guild_scope(req.get("guild_id")):
+        return await _delete_message(message_id)
+
+async def _delete_message(message_id: str) -> Dict[str, str]:
+    # Remove the message from its conversation window, or every chunk vector of the message
+    if await apply_window_changes({}, {message_id}):
+        return {"status": "deleted", "message_id": message_id}
+    ids = await message_vector_ids([message_id]) or [message_id]
+    await forget_vectors(ids, [message_id])
+    await delete_vectors(ids)
     return {"status": "deleted", "message_id": message_id}
 
 @app.post("/redact")
@@ -330,39 +660,164 @@ async def redact_message(req: Dict[str, Any]) -> Dict[str, str]:
     user_id = req.get("user_id")
     if not message_id or not user_id:
         raise HTTPException(status_code=400, detail="Missing message_id or user_id.")
-    # Redact in Pinecone (replace text with [REDACTED])
-    # Fetch, update, and upsert
-    fetch = index.fetch(ids=[message_id])
-    vectors = fetch.vectors
-    if message_id in vectors:
-        meta = vectors[message_id].metadata
-        values = vectors[message_id].values
-        meta["chunk_text"] = "[REDACTED]"
-        index.upsert(vectors=[{"id": message_id, "values": values, "metadata": meta}])
+    with guild_scope(req.get("guild_id")):
+        return await _redact_message(message_id)
+
+async def _redact_message(message_id: str) -> Dict[str, str]:
+    # Replace the text of every chunk of the message with [REDACTED]
+    if await apply_window_changes({message_id: "[REDACTED]"}, set()):
         return {"status": "redacted", "message_id": message_id}
-    else:
+    ids = await message_vector_ids([message_id]) or [message_id]
+    stored = get_doc_store().update(active_target()["index"], ids, chunk_text="[REDACTED]", entities=[])
+    # Vectors written before text moved to the doc store still carry it in their metadata
+    legacy = [i for i in ids if i not in stored]
+    vectors = (await index_call("fetch", ids=legacy)).vectors if legacy else {}
+    # A message linked as a near-duplicate is unlinked, which drops its kept text
+    unlinked = get_near_duplicates().unlink([message_id])
+    await update_duplicate_sources(unlinked)
+    if not stored and not vectors and not unlinked:
         raise HTTPException(status_code=404, detail="Message not found.")
+    await asyncio.gather(*(index_call("update", id=vector_id, set_metadata={"chunk_text": "[REDACTED]"})
+                           for vector_id in vectors))
+    return {"status": "redacted", "message_id": message_id}
+
+async def run_index_changes_task(req: IndexChangesRequest):
+    """Apply message edits and deletes to the index without touching unaffected vectors.
+
+    Edited messages are re-chunked and embedded together in batches of up to INGEST_STREAM_BATCH
+    chunks and upserted over their deterministic chunk IDs; only the chunk vectors that no longer
+    exist are deleted. Deleted threads have their thread document removed.
+    """
+    deleted: set = set()
+    edited: Dict[str, IngestRequest] = {}
+    threads: List[str] = []
+    for change in req.changes:
+        if change.action == "delete":
+            deleted.update(change.message_ids)
+            for message_id in change.message_ids:
+                edited.pop(message_id, None)
+        elif change.action == "edit" and change.message is not None:
+            edited[change.message.message_id] = change.message
+            deleted.discard(change.message.message_id)
+        elif change.action == "delete_thread" and change.thread_id:
+            threads.append(change.thread_id)
+    try:
+        windowed = await apply_window_changes(
+            {message_id: preprocess_text(msg.content) for message_id, msg in edited.items()}, deleted
+        )
+        edited = {message_id: msg for message_id, msg in edited.items() if message_id not in windowed}
+        deleted = deleted - windowed
+        stale = set(await message_vector_ids(list(deleted) + list(edited)))
+        # Duplicates linked to the old chunks are indexed on their own before those chunks change
+        await forget_vectors(sorted(stale), list(deleted) + list(edited))
+        all_ids: List[str] = []
+        pending: Tuple[List[str], List[Dict[str, Any]], List[str], List[str]] = ([], [], [], [])
+
+        async def flush() -> None:
+            chunks, metadatas, ids, scopes = pending
+            if chunks:
+                with stage("ingest", "embed"):
+                    embeddings = await embed_chunks(chunks)
+                with stage("ingest", "upsert"):
+                    await store_embeddings(embeddings, metadatas, ids=ids)
+                for vector_id, text, scope in zip(ids, chunks, scopes):
+                    get_near_duplicates().add([(vector_id, text)], scope)
+            for part in pending:
+                part.clear()
+
+        # Small edits share embedding requests; a large edited document is flushed as it streams in
+        for msg in edited.values():
+            scope = duplicate_scope(msg.roles, msg.guild_id)
+            async for text_chunks, metadatas, ids in iter_message_batches(msg):
+                for part, values in zip(pending, (text_chunks, metadatas, ids, [scope] * len(ids))):
+                    part.extend(values)
+                all_ids.extend(ids)
+                if len(pending[0]) >= INGEST_STREAM_BATCH:
+                    await flush()
+        await flush()
+        removed = sorted(stale - set(all_ids))
+        await delete_vectors(removed)
+        for message_id in edited:
+            mark_processed(message_id)
+        # Queued behind any ingestion of the thread still running, like its edits
+        for thread_id in threads:
+            await run_thread_ingestion_task(ThreadIngestRequest(thread_id=thread_id, messages=[], guild_id=req.guild_id))
+        logger.info(f"Index changes applied: {len(edited)} edited, {len(deleted)} deleted, {len(threads)} threads deleted, "
+                    f"{len(all_ids)} chunks upserted")
+    except Exception as e:
+        if job_attempt():
+            raise
+        log_to_dlq({
+            "original_request": req.dict(),
+            "error_message": str(e),
+            "failed_at_step": "index_changes",
+            "timestamp": datetime.datetime.utcnow().isoformat()
+        })
+
+@app.post("/index_changes", dependencies=[Depends(get_api_key)])
+async def index_changes(req: IndexChangesRequest, background_tasks: BackgroundTasks, request: Request):
+    queue_task(background_tasks, "index_changes", run_index_changes_task, req, bulk=is_bulk(request, "index_changes"))
+    return {"status": "accepted", "detail": f"{len(req.changes)} index changes have been queued."}
 
 class BatchIngestRequest(BaseModel):
     messages: List[IngestRequest]
+    guild_id: Optional[str] = None
 
 async def run_batch_ingestion_task(req: BatchIngestRequest):
-    # Move all batch ingestion logic here (process each message, call run_ingestion_task for each)
-    for msg in req.messages:
-        await run_ingestion_task(msg)
+    # Preprocess the whole batch in one go, then process each message
+    loop = asyncio.get_running_loop()
+    redacted = await loop.run_in_executor(None, preprocess_texts, [msg.content for msg in req.messages])
+    window_items = []
+    for msg, text in zip(req.messages, redacted):
+        # A backfill makes room for interactive queries between messages
+        await admission.yield_to_interactive()
+        if is_windowable(msg, text):
+            window_items.append((msg, text))
+        else:
+            await run_ingestion_task(msg, text)
+    if window_items:
+        await run_window_ingestion_task(window_items)
 
 @app.post("/batch_ingest", dependencies=[Depends(get_api_key)])
-async def batch_ingest_messages(req: BatchIngestRequest, background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_batch_ingestion_task, req)
+async def batch_ingest_messages(req: BatchIngestRequest, background_tasks: BackgroundTasks, request: Request):
+    queue_task(background_tasks, "batch_ingest", run_batch_ingestion_task, req, bulk=is_bulk(request, "batch_ingest"))
     return {"status": "accepted", "detail": "Batch ingestion task has been queued."}
 
+def thread_pending_key(thread_id: str) -> str:
+    return f"thread_pending:{thread_id}"
+
 async def run_thread_ingestion_task(req: ThreadIngestRequest):
+    """Re-ingest a thread from its full message list, coalescing requests that arrive while it is being ingested.
+
+    Each request replaces the thread's pending one. Whoever holds the thread's claim keeps
+    ingesting the latest pending request until none is left, so an edit or delete made while
+    the thread is being ingested is applied right after instead of being dropped.
+    """
+    key = f"thread:{req.thread_id}"
+    # Per task: concurrent requests for the thread in this process must not share the claim
+    owner = f"{OWNER_ID}-{uuid.uuid4().hex[:8]}"
+    state = get_shared_state()
+    pending = thread_pending_key(req.thread_id)
+    # A retried job only runs what is pending: its own request may have been superseded since
+    if job_attempt() <= 1:
+        state.cache_set(pending, req.dict())
+    # Checked again after releasing: a request queued just before the release is ours to run
+    while state.cache_get(pending) is not None and claim(key, owner=owner):
+        try:
+            latest = state.cache_pop(pending)
+            if latest is not None:
+                await _ingest_thread(ThreadIngestRequest(**latest))
+        except Exception:
+            # Left pending for the job's retry, unless a newer request replaced it meanwhile
+            if state.cache_get(pending) is None:
+                state.cache_set(pending, latest)
+            raise
+        finally:
+            release(key, owner)
+
+async def _ingest_thread(req: ThreadIngestRequest):
+    """Replace a thread's document vectors; a thread without messages (deleted) is removed from the index."""
     try:
-        lock_path = os.path.join(LOCKS_DIR, f"{req.thread_id}.lock")
-        if os.path.exists(lock_path):
-            return
-        with open(lock_path, "w") as f:
-            f.write("")
         # Combine all messages into a single document, preserving author and timestamp
         doc_lines = []
         for m in req.messages:
@@ -372,41 +827,57 @@ async def run_thread_ingestion_task(req: ThreadIngestRequest):
             doc_lines.append(f"{author} ({ts}): {content}")
         full_content = "\n".join(doc_lines)
         # Clean, redact, and chunk as usual
-        cleaned = clean_text(full_content)
-        redacted = redact_pii(cleaned)
-        doc = spacy.load("en_core_web_sm")
+        redacted = preprocess_text(full_content)
+        nlp = get_nlp()
+        doc = nlp(redacted)
         entities = [ent.text for ent in doc.ents if ent.label_ in ("PERSON", "ORG", "PRODUCT", "DATE")]
-        chunks = split_text_for_embedding(redacted)
+        chunks = list(iter_text_chunks(redacted))
         # Build metadata for each chunk
         metadatas = []
         for i, chunk in enumerate(chunks):
             metadatas.append({
                 "thread_id": req.thread_id,
+                "guild_id": request_guild(req) or "",
                 "parent_message_id": req.parent_message_id or "",
                 "is_thread": True,
+                "chunk_text": chunk,
                 "chunk_index": i,
                 "total_chunks": len(chunks),
                 "entities": entities,
             })
-        embeddings = await embed_chunks(chunks)
-        await store_embeddings(embeddings, metadatas)
-        return
+        ids = [thread_vector_id(req.thread_id, i) for i in range(len(chunks))]
+        if chunks:
+            with stage("ingest", "embed"):
+                embeddings = await embed_chunks(chunks)
+            with stage("ingest", "upsert"):
+                await store_embeddings(embeddings, metadatas, ids=ids)
+        # Re-ingesting a thread overwrites its chunks in place; drop chunks past the new end
+        stale = set(await list_vector_ids(thread_vector_prefix(req.thread_id))) - set(ids)
+        await delete_vectors(sorted(stale))
+        INGESTED_MESSAGES.inc(len(req.messages), path="thread")
     except Exception as e:
+        if job_attempt():
+            raise
         log_to_dlq({
             "original_request": req.dict(),
             "error_message": str(e),
             "failed_at_step": "thread_ingestion",
             "timestamp": datetime.datetime.utcnow().isoformat()
         })
-    finally:
-        if os.path.exists(lock_path):
-            os.remove(lock_path)
 
 @app.post("/ingest_thread", dependencies=[Depends(get_api_key)])
-async def ingest_thread(req: ThreadIngestRequest, background_tasks: BackgroundTasks):
-    background_tasks.add_task(run_thread_ingestion_task, req)
+async def ingest_thread(req: ThreadIngestRequest, background_tasks: BackgroundTasks, request: Request):
+    queue_task(background_tasks, "ingest_thread", run_thread_ingestion_task, req, bulk=is_bulk(request, "ingest_thread"))
     return JSONResponse(status_code=202, content={"message": "Thread ingestion task has been accepted and is being processed in the background."})
 
+# Job kind -> (task, request model), for ingestion workers running queued jobs
+JOB_HANDLERS = {
+    "ingest": (run_ingestion_task, IngestRequest),
+    "index_changes": (run_index_changes_task, IndexChangesRequest),
+    "batch_ingest": (run_batch_ingestion_task, BatchIngestRequest),
+    "ingest_thread": (run_thread_ingestion_task, ThreadIngestRequest),
+}
+
 @app.post("/summarize", dependencies=[Depends(get_api_key)])
 async def summarize_thread(req: ThreadIngestRequest) -> Dict[str, str]:
     try:
@@ -425,14 +896,87 @@ async def summarize_thread(req: ThreadIngestRequest) -> Dict[str, str]:
         logger.exception(f"Summarize error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error.")
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape endpoint, covering every API and ingestion worker process on the host."""
+    if INGEST_MODE == "queue":
+        depth = await asyncio.to_thread(get_shared_state().queue_depth)
+        for kind in JOB_HANDLERS:
+            JOB_QUEUE_DEPTH.set(depth.get(kind, 0), kind=kind)
+    return PlainTextResponse(await asyncio.to_thread(render_all_processes), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/guilds", dependencies=[Depends(get_api_key)])
+async def guild_stats():
+    """Per-guild index size (vectors in each guild's namespace) and /query latency seen by this API process."""
+    vectors = {guild_of_namespace(ns) or "": count for ns, count in (await asyncio.to_thread(index_namespaces)).items()}
+    for guild, count in vectors.items():
+        GUILD_VECTORS.set(count, guild=guild)
+    queried = {labels["guild"] for labels in GUILD_QUERY_SECONDS.label_sets()}
+    guilds = {}
+    for guild in sorted(set(vectors) | queried):
+        snapshot = GUILD_QUERY_SECONDS.snapshot(guild=guild)
+        _, total, count = snapshot or ([], 0.0, 0)
+        guilds[guild or "default"] = {
+            "vectors": vectors.get(guild, 0),
+            "queries": count,
+            "query_mean_seconds": total / count if count else None,
+            "query_p95_seconds": GUILD_QUERY_SECONDS.quantile(0.95, guild=guild),
+        }
+    return {"namespaced": active_target().get("namespaced", False), "guilds": guilds}
+
+@app.get("/debug/traces", dependencies=[Depends(get_api_key)])
+async def debug_traces(limit: int = 10, trace_id: Optional[str] = None):
+    """Slowest recent traces with their per-stage breakdown, or a single trace by ID."""
+    if trace_id:
+        trace = await asyncio.to_thread(span_store.get, trace_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail="Trace not found.")
+        return trace
+    return {"traces": await asyncio.to_thread(span_store.slowest, limit)}
+
+startup.register_component("pinecone_index", get_index)
+startup.register_component("embedding_model", load_embedding_model)
+startup.register_component("embedding_index_check", check_index_compatibility)
+startup.register_component("tokenizer", get_encoding)
+startup.register_component("spacy", get_nlp)
+startup.register_component("partitioners", load_partitioners, required=False)
+pinecone_probe = startup.ProbeCache(lambda: get_index().describe_index_stats())
+
+@app.on_event("startup")
+async def start_warmup():
+    """Load heavy components in the background so the worker accepts requests (and liveness probes) immediately.
+
+    Also starts sharing this worker's metrics with whichever worker answers the next /metrics scrape.
+    """
+    if startup.STARTUP_WARMUP:
+        app.state.warmup_task = asyncio.create_task(startup.warmup())
+    app.state.metrics_task = asyncio.create_task(publish_snapshots())
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up and its event loop is serving requests."""
+    return {"status": "alive", "uptime_seconds": time.time() - startup.STARTED_AT}
+
+@app.get("/health/ready")
+async def readiness():
+    """Ready once required components are loaded and Pinecone answers (probe result cached)."""
+    pinecone_ok, detail, checked_at = await pinecone_probe.check()
+    # With warmup disabled, components load on first use and do not gate readiness
+    ready = (startup.components_ready() or not startup.STARTUP_WARMUP) and pinecone_ok
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "components": startup.components_summary(),
+        "pinecone": {"ok": pinecone_ok, "detail": detail, "checked_at": checked_at},
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+@app.get("/debug/startup", dependencies=[Depends(get_api_key)])
+async def debug_startup():
+    """Startup-time breakdown: module import and per-component warmup times."""
+    return startup.startup_report()
+
 @app.get("/health")
 async def health_check():
-    try:
-        # Try to get Pinecone index stats
-        from pinecone import Index
-        idx = Index(PINECONE_INDEX)
-        _ = idx.describe_index_stats()
-        return {"status": "ok"}
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        raise HTTPException(status_code=503, detail="Service unavailable.") 
\ No newline at end of file
+    return await readiness()
+
+startup.record_phase("import_api", time.perf_counter() - _import_started)
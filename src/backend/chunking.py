@@ -0,0 +1,211 @@
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from src.backend.logger import get_logger
+
+logger = get_logger(__name__)
+
+EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "1000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+# A unit ends after sentence punctuation followed by whitespace, or at a line/paragraph break.
+# Delimiters stay attached to their unit so that joining units reproduces the text exactly.
+UNIT_PATTERN = re.compile(r".*?(?:[.!?]+[\"')\]]*[ \t]+|\n[ \t]*\n\s*|\n)", re.S)
+PARAGRAPH_END_PATTERN = re.compile(r"\n[ \t]*\n\s*$")
+# Only cut at a paragraph break if the chunk is at least this full; otherwise cut at a sentence.
+PARAGRAPH_MIN_FILL = 0.5
+# Text without any unit boundary is force-flushed once the stream buffer grows past this size.
+MAX_BUFFER_CHARS = 1 << 20
+# After tiktoken fails to load (e.g. its BPE files cannot be downloaded), approximate counts are used
+# for this long before loading is tried again.
+ENCODING_RETRY_SECONDS = float(os.getenv("ENCODING_RETRY_SECONDS", "300"))
+
+
+class ApproxEncoding:
+    """Tokenizer stand-in used when tiktoken (or its BPE files) is unavailable.
+
+    Splits text into pieces of at most four non-space characters, which tracks BPE token
+    counts for English text closely enough for chunk sizing.
+    """
+
+    name = "approx"
+    _pattern = re.compile(r"\s*\S{1,4}|\s+")
+
+    def encode(self, text: str) -> List[str]:
+        return self._pattern.findall(text)
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+_APPROX_ENCODING = ApproxEncoding()
+_encodings: Dict[str, Any] = {}
+_retry_at: Dict[str, float] = {}
+
+
+def get_encoding(model: Optional[str] = None):
+    """Return the tokenizer for an embedding model, falling back to ApproxEncoding.
+
+    Only real encodings are cached; while tiktoken is unavailable, loading is retried every ENCODING_RETRY_SECONDS.
+    """
+    model = model or EMBEDDING_MODEL
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    if time.monotonic() < _retry_at.get(model, 0.0):
+        return _APPROX_ENCODING
+    encoding = _load_encoding(model)
+    if encoding is None:
+        _retry_at[model] = time.monotonic() + ENCODING_RETRY_SECONDS
+        return _APPROX_ENCODING
+    _encodings[model] = encoding
+    return encoding
+
+
+def _load_encoding(model: str):
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable for {model} ({e}); using approximate token counts")
+        return None
+
+
+def count_tokens(text: str, encoding=None) -> int:
+    """Count tokens in text for the configured embedding model."""
+    encoding = encoding or get_encoding()
+    return len(encoding.encode(text))
+
+
+def _sized_units(unit: str, encoding, max_tokens: int) -> Iterator[Tuple[str, int, bool]]:
+    tokens = encoding.encode(unit)
+    ends_paragraph = bool(PARAGRAPH_END_PATTERN.search(unit))
+    if len(tokens) <= max_tokens:
+        yield unit, len(tokens), ends_paragraph
+        return
+    start = pos = 0
+    while start < len(tokens):
+        end = min(start + max_tokens, len(tokens))
+        # A token slice can end inside a multibyte character: back off to the last token that decodes cleanly,
+        # or, if even one token is only part of a character, take tokens until the character is complete
+        while end > start + 1 and not unit.startswith(encoding.decode(tokens[start:end]), pos):
+            end -= 1
+        while end < len(tokens) and not unit.startswith(encoding.decode(tokens[start:end]), pos):
+            end += 1
+        part = encoding.decode(tokens[start:end])
+        yield part, end - start, ends_paragraph and end >= len(tokens)
+        start = end
+        pos += len(part)
+
+
+def _cut_index(window: List[Tuple[str, int, bool]], max_tokens: int, min_cut: int) -> int:
+    """Number of window units to emit: up to the last paragraph break if the chunk is full enough."""
+    total = 0
+    best = len(window)
+    for i, (_, n, ends_paragraph) in enumerate(window):
+        total += n
+        if ends_paragraph and i + 1 >= min_cut and total >= max_tokens * PARAGRAPH_MIN_FILL and i + 1 < len(window):
+            best = i + 1
+    return best
+
+
+def _overlap_units(emitted: List[Tuple[str, int, bool]], overlap_tokens: int) -> List[Tuple[str, int, bool]]:
+    """Trailing whole units of the emitted chunk that fit in the overlap budget."""
+    carried: List[Tuple[str, int, bool]] = []
+    total = 0
+    for unit in reversed(emitted):
+        if total + unit[1] > overlap_tokens:
+            break
+        carried.insert(0, unit)
+        total += unit[1]
+    return carried
+
+
+class TextChunker:
+    """Incremental form of iter_text_chunks: feed text pieces as they arrive, collect chunks as they complete.
+
+    Only the trailing unit (which the next piece may still extend, e.g. into a paragraph break) and
+    the chunk being filled are held, so memory stays flat however much text is fed. Feeding pieces and then calling close() yields exactly the
+    chunks iter_text_chunks would for their concatenation.
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, overlap_tokens: Optional[int] = None,
+                 model: Optional[str] = None):
+        self.max_tokens = max_tokens or CHUNK_MAX_TOKENS
+        self.overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        self.encoding = get_encoding(model)
+        self._buffer = ""
+        self._window: List[Tuple[str, int, bool]] = []
+        self._window_tokens = 0
+        self._fresh = 0  # units in the window not yet emitted as part of an earlier chunk
+
+    def feed(self, piece: str) -> Iterator[str]:
+        """Chunks completed by piece. Only the trailing unit, which later text may still extend, is buffered."""
+        self._buffer += piece
+        pos = 0
+        for m in UNIT_PATTERN.finditer(self._buffer):
+            if not m.group() or m.end() == len(self._buffer):
+                # A boundary at the end of the buffer may grow with the next piece ("\n" + "\n" is a paragraph break)
+                break
+            pos = m.end()
+            for unit in _sized_units(m.group(), self.encoding, self.max_tokens):
+                yield from self._add(unit)
+        self._buffer = self._buffer[pos:]
+        if len(self._buffer) > MAX_BUFFER_CHARS:
+            # Text without any unit boundary is force-flushed
+            buffer, self._buffer = self._buffer, ""
+            for unit in _sized_units(buffer, self.encoding, self.max_tokens):
+                yield from self._add(unit)
+
+    def close(self) -> Iterator[str]:
+        """The remaining chunks once all text has been fed."""
+        buffer, self._buffer = self._buffer, ""
+        if buffer:
+            for unit in _sized_units(buffer, self.encoding, self.max_tokens):
+                yield from self._add(unit)
+        if self._fresh:
+            chunk = "".join(u[0] for u in self._window).strip()
+            if chunk:
+                yield chunk
+        self._window, self._window_tokens, self._fresh = [], 0, 0
+
+    def _add(self, unit: Tuple[str, int, bool]) -> Iterator[str]:
+        while self._window and self._window_tokens + unit[1] > self.max_tokens:
+            if not self._fresh:
+                # Only overlap is left and it does not fit alongside the next unit
+                self._window, self._window_tokens = [], 0
+                break
+            cut = _cut_index(self._window, self.max_tokens, min_cut=len(self._window) - self._fresh + 1)
+            emitted, rest = self._window[:cut], self._window[cut:]
+            chunk = "".join(u[0] for u in emitted).strip()
+            if chunk:
+                yield chunk
+            self._window = _overlap_units(emitted, self.overlap_tokens) + rest
+            self._window_tokens = sum(u[1] for u in self._window)
+            self._fresh = len(rest)
+        self._window.append(unit)
+        self._window_tokens += unit[1]
+        self._fresh += 1
+
+
+def iter_text_chunks(
+    text: Union[str, Iterable[str]],
+    max_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+    model: Optional[str] = None,
+) -> Iterator[str]:
+    """Lazily split text into chunks of at most max_tokens tokens for the embedding model.
+
+    `text` may be a string or an iterable of text pieces (e.g. pages of an attachment), which
+    are consumed incrementally. Chunks end on paragraph or sentence boundaries where possible
+    and the next chunk repeats whole trailing sentences worth up to overlap_tokens tokens.
+    """
+    chunker = TextChunker(max_tokens, overlap_tokens, model)
+    for piece in [text] if isinstance(text, str) else text:
+        yield from chunker.feed(piece)
+    yield from chunker.close()
@@ -5,7 +5,7 @@ from pinecone import Pinecone, PodSpec
 
 def clear_and_recreate_pinecone_index():
     """
-    Deletes and then re-creates the Pinecone index to ensure it's empty and fresh, unless it already exists with the correct dimension (1536) and is empty.
+    Deletes and then re-creates the Pinecone index to ensure it's empty and fresh, unless it already exists with the embedding provider's dimension and is empty.
     """
     load_dotenv()
 
@@ -14,7 +14,10 @@ def clear_and_recreate_pinecone_index():
     # This environment variable may be needed for legacy pod-based indexes
     pinecone_env = os.getenv("PINECONE_ENVIRONMENT") 
 
-    embedding_dimension = 1536  # For OpenAI ada-002
+    from src.backend.embedding import get_embedding_provider
+    provider = get_embedding_provider()
+    embedding_dimension = provider.dimension
+    print(f"Embedding model {provider.model_id} produces {embedding_dimension}-dimensional vectors.")
 
     if not api_key or not index_name:
         print("Error: PINECONE_API_KEY and PINECONE_INDEX_NAME must be set in your .env file.")
@@ -61,6 +64,10 @@ def clear_and_recreate_pinecone_index():
                 print("Waiting for index to be deleted...")
                 time.sleep(5)
             print(f"Index '{index_name}' deleted successfully.")
+            from src.backend.shared_state import get_shared_state
+            from src.backend.doc_store import get_doc_store
+            get_shared_state().cache_delete(f"embedding_model:{index_name}")
+            get_doc_store().drop(index_name)
         except Exception as e:
             print(f"Could not delete index: {e}")
             print("Please try deleting the index manually from the Pinecone console.")
@@ -0,0 +1,150 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from src.backend.chunking import count_tokens
+
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "10"))
+# Relevance vs. diversity trade-off for maximal marginal relevance (1.0 = relevance only)
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Candidates at least this similar to an already selected chunk are treated as duplicates
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.97"))
+# Candidates whose text is loaded (from the doc store) before trimming, deduplication and MMR
+CONTEXT_SHORTLIST = int(os.getenv("CONTEXT_SHORTLIST", str(2 * CONTEXT_MAX_CHUNKS)))
+# Longest overlap looked for between consecutive chunks of one source (chunkers overlap by far less)
+MAX_OVERLAP_CHARS = 2000
+# Shortest shared prefix/suffix counted as chunk overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def chunk_text(chunk: Dict[str, Any]) -> str:
+    return chunk.get("chunk_text") or chunk.get("text") or ""
+
+
+def _source_key(chunk: Dict[str, Any]) -> Optional[str]:
+    source = chunk.get("message_id") or chunk.get("thread_id")
+    return str(source) if source else None
+
+
+def _overlap(previous: str, current: str) -> int:
+    """Length of the longest suffix of previous that is also a prefix of current."""
+    for size in range(min(len(previous), len(current), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:size]):
+            return size
+    return 0
+
+
+def trim_overlaps(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Cut the text a chunk repeats from the preceding chunk of the same message or thread.
+
+    Only consecutive chunks (chunk_index n and n+1) that were both retrieved are trimmed;
+    the returned chunks are copies, the input is not modified.
+    """
+    by_position = {(_source_key(c), c.get("chunk_index")): c for c in chunks if _source_key(c)}
+    trimmed = []
+    for chunk in chunks:
+        source, position = _source_key(chunk), chunk.get("chunk_index")
+        previous = by_position.get((source, int(position) - 1)) if source and isinstance(position, (int, float)) else None
+        if previous is not None:
+            text = chunk_text(chunk)
+            size = _overlap(chunk_text(previous), text)
+            if size:
+                chunk = dict(chunk, chunk_text=text[size:])
+        trimmed.append(chunk)
+    return trimmed
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def drop_duplicates(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop empty chunks and chunks whose normalized text is identical to or contained in a higher-ranked one.
+
+    Catches identical channel posts and repeated re-ingestions of the same thread.
+    """
+    kept: List[Dict[str, Any]] = []
+    kept_texts: List[str] = []
+    for chunk in chunks:
+        text = _normalize(chunk_text(chunk))
+        if not text or any(text in other for other in kept_texts):
+            continue
+        kept.append(chunk)
+        kept_texts.append(text)
+    return kept
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(query: Sequence[float], candidates: Sequence[Sequence[float]], k: int = CONTEXT_MAX_CHUNKS,
+               lambda_: float = MMR_LAMBDA, duplicate_similarity: float = DUPLICATE_SIMILARITY) -> List[int]:
+    """Indices of up to k candidates picked by maximal marginal relevance, in selection order.
+
+    Each step picks argmax(lambda * sim(query, c) - (1 - lambda) * max sim(c, selected)). The
+    candidate-to-selected maxima are kept as one vector and updated with a single matrix row
+    per step, so the whole selection is O(k * n) after one n x n similarity matrix. Candidates
+    at least duplicate_similarity to a selected one are never picked.
+    """
+    if not len(candidates):
+        return []
+    vectors = _unit_rows(np.asarray(candidates, dtype=np.float32))
+    relevance = vectors @ _unit_rows(np.asarray(query, dtype=np.float32))
+    similarity = vectors @ vectors.T
+    max_similarity = np.full(len(vectors), -np.inf, dtype=np.float32)
+    available = np.ones(len(vectors), dtype=bool)
+    selected: List[int] = []
+    while len(selected) < k and available.any():
+        redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+        scores = np.where(available, lambda_ * relevance - (1 - lambda_) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+        available &= max_similarity < duplicate_similarity
+    return selected
+
+
+def shortlist(query_embedding: Sequence[float], chunks: List[Dict[str, Any]],
+              embeddings: Optional[List[Optional[Sequence[float]]]] = None,
+              n: int = CONTEXT_SHORTLIST) -> List[Dict[str, Any]]:
+    """Up to n candidates worth loading text for, picked by MMR on their vectors alone, in rank order.
+
+    Without a vector for every candidate the top n are kept.
+    """
+    if embeddings and len(embeddings) == len(chunks) and all(v is not None for v in embeddings):
+        return [chunks[i] for i in sorted(mmr_select(query_embedding, embeddings, n))]
+    return chunks[:n]
+
+
+def select_context(query_embedding: Sequence[float], chunks: List[Dict[str, Any]],
+                   embeddings: Optional[List[Optional[Sequence[float]]]] = None,
+                   k: int = CONTEXT_MAX_CHUNKS) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Pick the prompt context from ranked candidates: trim chunk overlap, drop duplicates, then MMR.
+
+    embeddings are the candidates' vectors (same order as chunks); without them the top k
+    deduplicated chunks are kept in rank order. Returns (selected_chunks, stats) where stats has
+    the candidate and selected context sizes in tokens and the tokens saved.
+    """
+    vectors = {id(c): v for c, v in zip(chunks, embeddings or []) if v is not None}
+    trimmed = trim_overlaps(chunks)
+    for original, chunk in zip(chunks, trimmed):
+        if id(original) in vectors:
+            vectors[id(chunk)] = vectors[id(original)]
+    unique = drop_duplicates(trimmed)
+    if unique and all(id(c) in vectors for c in unique):
+        order = mmr_select(query_embedding, [vectors[id(c)] for c in unique], k)
+        selected = [unique[i] for i in order]
+    else:
+        selected = unique[:k]
+    candidate_tokens = sum(count_tokens(chunk_text(c)) for c in chunks)
+    selected_tokens = sum(count_tokens(chunk_text(c)) for c in selected)
+    return selected, {
+        "candidate_tokens": candidate_tokens,
+        "selected_tokens": selected_tokens,
+        "tokens_saved": candidate_tokens - selected_tokens,
+    }
@@ -3,7 +3,9 @@
 from typing import List, Dict, Any
 import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
+from src.backend.logger import get_logger
 
+logger = get_logger(__name__)
 scheduler = BackgroundScheduler()
 
 def should_archive(chunk: Dict[str, Any], days_threshold: int = 30) -> bool:
@@ -31,7 +33,7 @@ def cleanup_deleted_or_edited(chunks: List[Dict[str, Any]], deleted_ids: List[st
 def run_decay_job() -> None:
     """Scheduled job to run archival/decay logic. Should be called daily/weekly."""
     # TODO: Load all chunks from Pinecone, archive/summarize as needed, and update DB
-    print("Running decay/archival job...")
+    logger.info("Running decay/archival job...")
     # Example: chunks = load_all_chunks_from_pinecone()
     # updated = archive_chunks(chunks)
     # save_updated_chunks_to_pinecone(updated)
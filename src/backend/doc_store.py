@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import zstandard
+from src.backend.logger import get_logger
+
+logger = get_logger(__name__)
+
+DOC_STORE_PATH = os.getenv("DOC_STORE_PATH", "doc_store.db")
+DOC_STORE_COMPRESSION_LEVEL = int(os.getenv("DOC_STORE_COMPRESSION_LEVEL", "3"))
+
+# Chunk fields that are read only when a chunk goes into a prompt or a citation. They are kept
+# here, keyed by vector ID, instead of in vector metadata, which every query returns for every
+# candidate. Everything else (IDs, roles, timestamps, flags) stays in metadata for filtering.
+BULKY_FIELDS = ("chunk_text", "entities", "message_ids", "message_offsets", "user_ids")
+
+# IN (...) lists are kept below SQLite's default variable limit
+_MAX_VARIABLES = 500
+
+
+def split_metadata(meta: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Split chunk metadata into (filterable vector metadata, bulky document fields)."""
+    slim = {k: v for k, v in meta.items() if k not in BULKY_FIELDS}
+    doc = {k: v for k, v in meta.items() if k in BULKY_FIELDS}
+    return slim, doc
+
+
+class DocStore:
+    """SQLite store of zstd-compressed chunk documents, keyed by (index name, vector ID).
+
+    Keys include the index so that a re-index into a new index (possibly re-chunked, with the same
+    vector IDs holding different text) never overwrites the documents the live index serves.
+    """
+
+    def __init__(self, path: str = DOC_STORE_PATH, level: int = DOC_STORE_COMPRESSION_LEVEL):
+        self.path = path
+        self._lock = Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs (index_name TEXT, vector_id TEXT, data BLOB, PRIMARY KEY (index_name, vector_id))"
+            )
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per process: worker processes share the database file but never a connection
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._db
+
+    def _encode(self, doc: Dict[str, Any]) -> bytes:
+        return self._compressor.compress(json.dumps(doc, separators=(",", ":")).encode())
+
+    def _decode(self, blob: bytes) -> Dict[str, Any]:
+        return json.loads(self._decompressor.decompress(blob))
+
+    def put(self, index_name: str, docs: Dict[str, Dict[str, Any]]) -> None:
+        if not docs:
+            return
+        rows = [(index_name, vector_id, self._encode(doc)) for vector_id, doc in docs.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO docs (index_name, vector_id, data) VALUES (?, ?, ?)", rows)
+
+    def get(self, index_name: str, vector_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        found: Dict[str, Dict[str, Any]] = {}
+        for batch in _batches(list(vector_ids)):
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT vector_id, data FROM docs WHERE index_name = ? AND vector_id IN ({','.join('?' * len(batch))})",
+                    [index_name, *batch],
+                ).fetchall()
+            found.update((vector_id, self._decode(blob)) for vector_id, blob in rows)
+        return found
+
+    def update(self, index_name: str, vector_ids: Sequence[str], **fields: Any) -> List[str]:
+        """Set fields on the stored documents of vector_ids; returns the IDs that had a document."""
+        docs = self.get(index_name, vector_ids)
+        self.put(index_name, {vector_id: dict(doc, **fields) for vector_id, doc in docs.items()})
+        return list(docs)
+
+    def delete(self, index_name: str, vector_ids: Iterable[str]) -> None:
+        for batch in _batches(list(vector_ids)):
+            with self._lock, self._conn:
+                self._conn.execute(
+                    f"DELETE FROM docs WHERE index_name = ? AND vector_id IN ({','.join('?' * len(batch))})",
+                    [index_name, *batch],
+                )
+
+    def drop(self, index_name: str) -> int:
+        """Remove every document of an index (after clearing or retiring it)."""
+        with self._lock, self._conn:
+            removed = self._conn.execute("DELETE FROM docs WHERE index_name = ?", (index_name,)).rowcount
+        logger.info(f"Dropped {removed} stored documents of index {index_name}")
+        return removed
+
+
+def _batches(ids: List[str]) -> Iterable[List[str]]:
+    for start in range(0, len(ids), _MAX_VARIABLES):
+        yield ids[start:start + _MAX_VARIABLES]
+
+
+_store: Optional[DocStore] = None
+
+
+def get_doc_store() -> DocStore:
+    global _store
+    if _store is None:
+        _store = DocStore()
+    return _store
+
+
+def hydrate(chunks: List[Dict[str, Any]], index_name: str) -> List[Dict[str, Any]]:
+    """Copies of chunks (carrying "vector_id") with their stored document fields filled in.
+
+    Vectors written before documents moved out of metadata still carry their text inline and
+    are returned unchanged.
+    """
+    docs = get_doc_store().get(index_name, [c["vector_id"] for c in chunks if c.get("vector_id")])
+    return [dict(c, **docs.get(c.get("vector_id"), {})) for c in chunks]
@@ -1,13 +1,19 @@
 # Embedding logic will be implemented here 
 
+import asyncio
 import os
-from typing import List, Dict, Any
-from pinecone import Pinecone, ServerlessSpec
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import List, Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
 import json
 import uuid
+from threading import Lock
 from src.backend.logger import get_logger
+from src.backend.metrics import EMBEDDING_BATCH, EMBEDDING_SECONDS
+from src.backend.quantization import shorten
+from src.backend.sharding import GUILD_NAMESPACES, current_guild, namespace_for
 
 load_dotenv()
 
@@ -15,39 +21,350 @@ PINECONE_API_KEY = os.getenv("PINECONE_API_KEY", "")
 PINECONE_INDEX = os.getenv("PINECONE_INDEX_NAME", "vita-knowledge-base")
 PINECONE_CLOUD = os.getenv("PINECONE_CLOUD", "aws")
 PINECONE_REGION = os.getenv("PINECONE_REGION", "us-east-1")
+# HTTP connections kept open per index; every vector store pool thread (VECTOR_STORE_THREADS) needs one
+PINECONE_POOL_SIZE = int(os.getenv("PINECONE_POOL_SIZE", "16"))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+# "openai" or "local" (sentence-transformers on CPU)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai").lower()
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", "32"))
+# Threads running model inference; torch already parallelises each batch across cores
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "1"))
+# BGE English models expect this instruction in front of queries (not passages)
+BGE_QUERY_INSTRUCTION = "Represent this sentence for searching relevant passages: "
+LOCAL_EMBEDDING_QUERY_PREFIX = os.getenv(
+    "LOCAL_EMBEDDING_QUERY_PREFIX", BGE_QUERY_INSTRUCTION if LOCAL_EMBEDDING_MODEL.startswith("BAAI/bge") else ""
+)
+
+# Shortened vector size for models trained to be truncated (text-embedding-3-*, Matryoshka local
+# models); 0 keeps the model's native size. Smaller vectors cut index storage and upsert/fetch payloads.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))
+
+OPENAI_EMBEDDING_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+# Models that accept the `dimensions` request parameter
+OPENAI_SHORTENABLE_MODELS = ("text-embedding-3-small", "text-embedding-3-large")
+# Inputs per embeddings request. The API takes at most 2048 inputs and 300k tokens per request;
+# 256 chunks of CHUNK_MAX_TOKENS (1000) stay within both.
+OPENAI_EMBEDDING_MAX_BATCH = int(os.getenv("OPENAI_EMBEDDING_MAX_BATCH", "256"))
 
 # Ensure we have the required API keys
 if not PINECONE_API_KEY:
     raise ValueError("PINECONE_API_KEY environment variable is required")
-if not OPENAI_API_KEY:
+if EMBEDDING_PROVIDER == "openai" and not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
 logger = get_logger(__name__)
 
-print(f"DEBUG: Using Pinecone index: {PINECONE_INDEX}")
-print(f"DEBUG: Pinecone cloud: {PINECONE_CLOUD}")
-print(f"DEBUG: Pinecone region: {PINECONE_REGION}")
+logger.debug("Using Pinecone index %s (%s/%s)", PINECONE_INDEX, PINECONE_CLOUD, PINECONE_REGION)
+
+# Which index (and embedding model) is live is kept in shared state so that a re-index can cut over
+# every worker with one write; without an entry the environment configuration is used.
+ACTIVE_INDEX_KEY = "index:active"
+PREVIOUS_INDEX_KEY = "index:previous"
+MIGRATION_KEY = "index:migration"
+# How long a process keeps using its cached copy of the active index / migration state
+INDEX_CONFIG_TTL_SECONDS = float(os.getenv("INDEX_CONFIG_TTL_SECONDS", "5"))
+
+# Index methods that take a namespace; the active index's are scoped to the current guild (see sharding.py)
+_NAMESPACED_METHODS = {"upsert", "delete", "update", "fetch", "query", "list", "list_paginated"}
+
+_indexes: Dict[str, Any] = {}
+_index_lock = Lock()
+_config_cache: Dict[str, Any] = {}
+
+def default_target() -> Dict[str, Any]:
+    """Index target from the environment: index name, embedding provider, model, dimensions and per-guild namespacing."""
+    model = OPENAI_EMBEDDING_MODEL if EMBEDDING_PROVIDER == "openai" else LOCAL_EMBEDDING_MODEL
+    return {"index": PINECONE_INDEX, "provider": EMBEDDING_PROVIDER, "model": model, "dimensions": EMBEDDING_DIMENSIONS,
+            "namespaced": GUILD_NAMESPACES}
+
+def _shared_config(key: str) -> Optional[Dict[str, Any]]:
+    now = time.monotonic()
+    cached = _config_cache.get(key)
+    if cached is None or now - cached[1] > INDEX_CONFIG_TTL_SECONDS:
+        from src.backend.shared_state import get_shared_state
+        cached = _config_cache[key] = (get_shared_state().cache_get(key), now)
+    return cached[0]
+
+def reset_index_config_cache() -> None:
+    _config_cache.clear()
+
+def active_target() -> Dict[str, Any]:
+    """The index and embedding model queries and ingestion currently use."""
+    return _shared_config(ACTIVE_INDEX_KEY) or default_target()
+
+def current_migration() -> Optional[Dict[str, Any]]:
+    """The re-index in progress, if any (see index_migration.py)."""
+    return _shared_config(MIGRATION_KEY)
+
+def current_namespace(target: Optional[Dict[str, Any]] = None) -> str:
+    """Namespace of the current guild in target (the active index by default)."""
+    return namespace_for(current_guild(), (target or active_target()).get("namespaced", False))
+
+def get_index(name: Optional[str] = None):
+    """Return the Pinecone index handle (the active index by default), connecting on first use.
+
+    Resolving the index host is a network call, so handles are created lazily and cached per name.
+    """
+    name = name or active_target()["index"]
+    if name not in _indexes:
+        with _index_lock:
+            if name not in _indexes:
+                from pinecone import Pinecone
+                _indexes[name] = Pinecone(api_key=PINECONE_API_KEY).Index(name, connection_pool_maxsize=PINECONE_POOL_SIZE)
+    return _indexes[name]
+
+class _LazyIndex:
+    """Forwards to the active index handle, resolved on every use so a cutover takes effect.
+
+    Calls are scoped to the current guild's namespace when the active index is namespaced.
+    While a re-index is running, the IDs of vectors written here are logged in shared state so
+    that the migration can replay them into the new index.
+    """
+
+    def __getattr__(self, name: str):
+        attr = getattr(get_index(), name)
+        namespace = current_namespace()
+        if namespace and name in _NAMESPACED_METHODS:
+            return partial(attr, namespace=namespace)
+        return attr
+
+    def _scoped(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        namespace = current_namespace()
+        return dict(kwargs, namespace=namespace) if namespace and "namespace" not in kwargs else kwargs
+
+    def _log_changes(self, ids: List[str]) -> None:
+        migration = current_migration()
+        if migration and ids:
+            from src.backend.shared_state import get_shared_state
+            direct = active_target()["index"] == migration["target"]["index"]
+            get_shared_state().record_vector_changes(ids, direct, current_guild())
+
+    def upsert(self, vectors: List[Dict[str, Any]], **kwargs: Any):
+        result = get_index().upsert(vectors=vectors, **self._scoped(kwargs))
+        self._log_changes([v["id"] for v in vectors])
+        return result
+
+    def delete(self, ids: List[str], **kwargs: Any):
+        result = get_index().delete(ids=ids, **self._scoped(kwargs))
+        self._log_changes(list(ids))
+        return result
+
+    def update(self, id: str, **kwargs: Any):
+        result = get_index().update(id=id, **self._scoped(kwargs))
+        self._log_changes([id])
+        return result
+
+index = _LazyIndex()
+
+class EmbeddingConfigError(ValueError):
+    """The configured embedding model does not match the vectors already in the index."""
+
+
+class EmbeddingProvider:
+    """Turns text into vectors. Ingestion and query both go through the configured provider."""
+
+    name = "base"
+
+    def __init__(self, model: str, dimensions: int = 0):
+        self.model = model
+        self.dimensions = dimensions
+
+    @property
+    def model_id(self) -> str:
+        # Shortened vectors are not comparable with full-size ones, so the size is part of the identity
+        suffix = f"@{self.dimensions}" if self.dimensions else ""
+        return f"{self.name}:{self.model}{suffix}"
+
+    @property
+    def dimension(self) -> int:
+        raise NotImplementedError
+
+    def load(self) -> None:
+        """Load model weights or clients ahead of the first request (startup warmup)."""
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    async def embed_query(self, text: str) -> List[float]:
+        return (await self.embed([text]))[0]
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+
+    def __init__(self, model: str = OPENAI_EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS):
+        super().__init__(model, dimensions)
+        if dimensions and model not in OPENAI_SHORTENABLE_MODELS:
+            raise EmbeddingConfigError(f"{model} does not support shortened embeddings; unset EMBEDDING_DIMENSIONS")
+
+    @property
+    def dimension(self) -> int:
+        if self.model not in OPENAI_EMBEDDING_DIMENSIONS:
+            raise EmbeddingConfigError(f"Unknown dimension for OpenAI embedding model {self.model}")
+        native = OPENAI_EMBEDDING_DIMENSIONS[self.model]
+        if self.dimensions > native:
+            raise EmbeddingConfigError(f"EMBEDDING_DIMENSIONS={self.dimensions} exceeds {self.model}'s size ({native})")
+        return self.dimensions or native
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        from src.backend.llm_client import create_embeddings, BULK
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), OPENAI_EMBEDDING_MAX_BATCH):
+            batch = texts[start:start + OPENAI_EMBEDDING_MAX_BATCH]
+            vectors.extend(await create_embeddings(batch, self.model, BULK, self.dimensions or None))
+        return vectors
 
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    async def embed_query(self, text: str) -> List[float]:
+        from src.backend.llm_client import create_embeddings, INTERACTIVE
+        return (await create_embeddings([text], self.model, INTERACTIVE, self.dimensions or None))[0]
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """sentence-transformers model (e.g. BAAI/bge) on CPU; batches run in a thread pool off the event loop."""
+
+    name = "local"
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL, batch_size: int = LOCAL_EMBEDDING_BATCH_SIZE,
+                 threads: int = LOCAL_EMBEDDING_THREADS, query_prefix: str = LOCAL_EMBEDDING_QUERY_PREFIX,
+                 dimensions: int = EMBEDDING_DIMENSIONS):
+        super().__init__(model, dimensions)
+        self.batch_size = batch_size
+        self.query_prefix = query_prefix
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="embed")
+        self._model = None
+        self._lock = Lock()
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    from src.backend.chunking import CHUNK_MAX_TOKENS
+                    model = SentenceTransformer(self.model, device="cpu")
+                    if model.max_seq_length and CHUNK_MAX_TOKENS > model.max_seq_length:
+                        logger.warning(
+                            f"CHUNK_MAX_TOKENS={CHUNK_MAX_TOKENS} exceeds {self.model}'s max sequence length "
+                            f"({model.max_seq_length}); longer chunks are truncated when embedded"
+                        )
+                    self._model = model
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        native = self.load().get_sentence_embedding_dimension()
+        if self.dimensions > native:
+            raise EmbeddingConfigError(f"EMBEDDING_DIMENSIONS={self.dimensions} exceeds {self.model}'s size ({native})")
+        return self.dimensions or native
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.load().encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        )
+        if self.dimensions:
+            vectors = shorten(vectors, self.dimensions)
+        return vectors.tolist()
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(loop.run_in_executor(self._executor, self._encode, b) for b in batches))
+        return [vector for batch in results for vector in batch]
+
+    async def embed_query(self, text: str) -> List[float]:
+        return (await self.embed([self.query_prefix + text]))[0]
+
+
+EMBEDDING_PROVIDERS = {
+    "openai": OpenAIEmbeddingProvider,
+    "local": LocalEmbeddingProvider,
+}
+
+
+@lru_cache(maxsize=4)
+def provider_for(provider: str, model: str, dimensions: int = 0) -> EmbeddingProvider:
+    if provider not in EMBEDDING_PROVIDERS:
+        raise EmbeddingConfigError(f"Unknown embedding provider {provider!r}; expected one of {sorted(EMBEDDING_PROVIDERS)}")
+    return EMBEDDING_PROVIDERS[provider](model, dimensions=dimensions)
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Provider of the active index target."""
+    target = active_target()
+    return provider_for(target["provider"], target["model"], target.get("dimensions", 0))
+
+
+def load_embedding_model() -> None:
+    get_embedding_provider().load()
+
+
+def _stat(stats: Any, key: str) -> Any:
+    return stats.get(key) if hasattr(stats, "get") else getattr(stats, key, None)
+
+
+def index_dimension(name: Optional[str] = None) -> Optional[int]:
+    return _stat(get_index(name).describe_index_stats(), "dimension")
+
+
+def index_namespaces(name: Optional[str] = None) -> Dict[str, int]:
+    """Vector count per namespace of an index (the active one by default)."""
+    namespaces = _stat(get_index(name).describe_index_stats(), "namespaces") or {}
+    return {namespace: int(_stat(summary, "vector_count") or 0) for namespace, summary in namespaces.items()}
+
+
+def record_index_model(index_name: str, provider: EmbeddingProvider) -> None:
+    """Fail if index_name was built with another model; record provider's model if it is new."""
+    from src.backend.shared_state import get_shared_state
+    state = get_shared_state()
+    key = f"embedding_model:{index_name}"
+    recorded = state.cache_get(key)
+    if recorded is None:
+        state.cache_set(key, provider.model_id)
+    elif recorded != provider.model_id:
+        raise EmbeddingConfigError(
+            f"Index {index_name} was built with {recorded} but the configured embedding model is {provider.model_id}; "
+            "re-index or switch back"
+        )
+
+
+def check_index_compatibility() -> None:
+    """Fail if the provider's vectors cannot be compared with those already in the index.
+
+    The dimension is checked against the index itself. The model is checked against the one
+    recorded (in shared state) when this index was first used, because two models of the same
+    dimension produce vectors that fit the index but live in unrelated spaces.
+    """
+    name = active_target()["index"]
+    provider = get_embedding_provider()
+    dimension = index_dimension(name)
+    if dimension and dimension != provider.dimension:
+        raise EmbeddingConfigError(
+            f"Index {name} has dimension {dimension} but {provider.model_id} produces {provider.dimension}"
+        )
+    record_index_model(name, provider)
 
-# Pinecone index setup (1536 dimensions for OpenAI ada-002)
-pinecone = Pinecone(api_key=PINECONE_API_KEY)
-index = pinecone.Index(PINECONE_INDEX)
 
 async def embed_chunks(chunks: List[str]) -> List[List[float]]:
-    """Generate embeddings for a list of text chunks using OpenAI."""
+    """Generate embeddings for a list of text chunks with the configured provider."""
+    EMBEDDING_BATCH.observe(len(chunks))
     try:
-        response = await openai_client.embeddings.create(
-            input=chunks,
-            model=OPENAI_EMBEDDING_MODEL
-        )
-        return [d.embedding for d in response.data]
+        with EMBEDDING_SECONDS.time():
+            return await get_embedding_provider().embed(chunks)
     except Exception as e:
         logger.error(f"Embedding error: {e}")
         raise e
 
+
+async def embed_query(text: str) -> List[float]:
+    """Embed a search query with the same provider (and model) used for ingestion."""
+    with EMBEDDING_SECONDS.time():
+        return await get_embedding_provider().embed_query(text)
+
 def sanitize_metadata(meta: Dict[str, Any]) -> Dict[str, Any]:
     """Ensure all metadata values are valid for Pinecone (no None/nulls)."""
     sanitized = {}
@@ -62,14 +379,27 @@ def sanitize_metadata(meta: Dict[str, Any]) -> Dict[str, Any]:
             sanitized[k] = str(v)
     return sanitized
 
-async def store_embeddings(embeddings: List[List[float]], metadatas: List[Dict[str, Any]]) -> None:
-    """Store embeddings and metadata in Pinecone."""
+def build_vectors(ids: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Pinecone vectors carrying only filterable metadata, and the bulky fields to keep in the doc store."""
+    from src.backend.doc_store import split_metadata
     vectors = []
-    for emb, meta in zip(embeddings, metadatas):
-        sanitized_meta = sanitize_metadata(meta)
-        vectors.append({
-            "id": str(uuid.uuid4()),
-            "values": emb,
-            "metadata": sanitized_meta
-        })
-    index.upsert(vectors=vectors) 
\ No newline at end of file
+    docs = {}
+    for vector_id, emb, meta in zip(ids, embeddings, metadatas):
+        slim, doc = split_metadata(sanitize_metadata(meta))
+        vectors.append({"id": vector_id, "values": emb, "metadata": slim})
+        docs[vector_id] = doc
+    return vectors, docs
+
+async def store_embeddings(embeddings: List[List[float]], metadatas: List[Dict[str, Any]], ids: Optional[List[str]] = None) -> None:
+    """Store embeddings with slim metadata in Pinecone and their text in the doc store.
+
+    Random IDs are used unless explicit vector IDs are given.
+    """
+    from src.backend.doc_store import get_doc_store
+    from src.backend.vector_store import upsert_vectors
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in embeddings]
+    vectors, docs = build_vectors(ids, embeddings, metadatas)
+    # Documents first, so a query never retrieves a vector whose text is not stored yet
+    get_doc_store().put(active_target()["index"], docs)
+    await upsert_vectors(vectors) 
\ No newline at end of file
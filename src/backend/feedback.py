@@ -5,6 +5,7 @@ import json
 from typing import Dict, Any, List
 from threading import Lock
 from src.backend.logger import get_logger
+from src.backend.metrics import DLQ_ENTRIES
 import aiohttp
 import asyncio
 from dotenv import load_dotenv
@@ -25,39 +26,57 @@ def log_feedback(feedback: Dict[str, Any]) -> None:
     try:
         with open(FEEDBACK_LOG, "a") as f:
             f.write(json.dumps(feedback) + "\n")
-        logger.info(f"Logged feedback: {feedback}")
+        logger.debug("Logged feedback: %s", feedback)
     except Exception as e:
         logger.error(f"Failed to log feedback: {e}")
 
 def log_to_dlq(item: Dict[str, Any]) -> None:
-    """Log failed ingestion/embedding to dead-letter queue."""
+    """Log failed ingestion/embedding to dead-letter queue (one JSON object per line, appended)."""
+    step = item.get("failed_at_step") or item.get("type") or "unknown"
+    DLQ_ENTRIES.inc(step=step)
     with _dlq_lock:
-        queue = []
-        if os.path.exists(DLQ_PATH):
-            with open(DLQ_PATH, "r") as f:
-                try:
-                    queue = json.load(f)
-                except Exception:
-                    queue = []
-        queue.append(item)
-        with open(DLQ_PATH, "w") as f:
-            json.dump(queue, f)
+        with open(DLQ_PATH, "a") as f:
+            f.write(json.dumps(item, default=str) + "\n")
+    logger.info("Dead-lettered a failed %s", step)
+    logger.debug("DLQ entry: %s", item)
+
+def load_dlq() -> List[Dict[str, Any]]:
+    """Dead-lettered entries, whether appended as JSON lines or written as one JSON array (older files)."""
+    with open(DLQ_PATH, "r") as f:
+        content = f.read()
+    decoder = json.JSONDecoder()
+    entries: List[Dict[str, Any]] = []
+    pos = 0
+    while True:
+        while pos < len(content) and content[pos].isspace():
+            pos += 1
+        if pos >= len(content):
+            return entries
+        value, pos = decoder.raw_decode(content, pos)
+        entries.extend(value if isinstance(value, list) else [value])
 
 async def reprocess_dlq():
-    with open("dlq.json", "r") as f:
-        lines = f.readlines()
+    """Replay dead-lettered requests as bulk work, waiting whenever the backend sheds them."""
+    entries = load_dlq()
+    headers = {"X-API-Key": BACKEND_API_KEY, "X-Priority": "bulk"}
     async with aiohttp.ClientSession() as session:
-        for line in lines:
-            entry = json.loads(line)
+        for entry in entries:
             req = entry.get("original_request")
             if not req:
                 continue
-            if "messages" in req:
+            if "changes" in req:
+                endpoint = "/index_changes"
+            elif "messages" in req:
                 endpoint = "/ingest_thread"
             else:
                 endpoint = "/ingest"
-            async with session.post(BACKEND_URL + endpoint, json=req, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
-                print(f"Reprocessed {endpoint}: {resp.status}")
+            while True:
+                async with session.post(BACKEND_URL + endpoint, json=req, headers=headers) as resp:
+                    if resp.status not in (429, 503):
+                        logger.info(f"Reprocessed {endpoint}: {resp.status}")
+                        break
+                    retry_after = float(resp.headers.get("Retry-After", "5"))
+                await asyncio.sleep(retry_after)
 
 if __name__ == "__main__":
     asyncio.run(reprocess_dlq()) 
\ No newline at end of file
@@ -1,116 +1,170 @@
+import asyncio
+import csv
 import os
+import time
 import aiohttp
-import pytesseract
-from PIL import Image
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 from src.backend.logger import get_logger
 from src.backend.ingestion import log_to_dlq
+from src.backend.metrics import ATTACHMENT_SECONDS, ATTACHMENTS
+from src.backend.ocr import extract_image_text
 import datetime
-import unstructured
-from unstructured.partition.pdf import partition_pdf
-from unstructured.partition.docx import partition_docx
-from unstructured.partition.text import partition_text
-from unstructured.partition.html import partition_html
-from unstructured.partition.pptx import partition_pptx
-from unstructured.partition.xlsx import partition_xlsx
-from unstructured.partition.odt import partition_odt
-from unstructured.partition.rtf import partition_rtf
-from unstructured.partition.csv import partition_csv
+import importlib
+from functools import lru_cache
+from typing import AsyncIterator, Iterator, List
 
 load_dotenv()
 logger = get_logger(__name__)
-TESSERACT_LANGUAGES = os.getenv("TESSERACT_LANGUAGES", "eng")
 
-async def process_attachments(attachment_urls: list) -> str:
-    text = ""
+# Extension -> unstructured.partition submodule. Partitioners are imported on first use since
+# importing unstructured and its parsers dominates backend startup time.
+DOCUMENT_PARTITIONERS = {
+    ".pdf": "pdf",
+    ".docx": "docx",
+    ".txt": "text",
+    ".html": "html",
+    ".pptx": "pptx",
+    ".xlsx": "xlsx",
+    ".odt": "odt",
+    ".rtf": "rtf",
+    ".csv": "csv",
+}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')
+# Large documents are partitioned a part at a time, so only one part's elements are held while
+# its text is chunked, embedded and upserted
+ATTACHMENT_PDF_PAGES_PER_PART = int(os.getenv("ATTACHMENT_PDF_PAGES_PER_PART", "10"))
+ATTACHMENT_CSV_ROWS_PER_PART = int(os.getenv("ATTACHMENT_CSV_ROWS_PER_PART", "2000"))
+# Partitioning is CPU-bound; it runs in this many threads, off the event loop
+ATTACHMENT_PARTITION_THREADS = int(os.getenv("ATTACHMENT_PARTITION_THREADS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=ATTACHMENT_PARTITION_THREADS, thread_name_prefix="partition")
+
+@lru_cache(maxsize=None)
+def get_partitioner(extension: str):
+    name = DOCUMENT_PARTITIONERS[extension]
+    return getattr(importlib.import_module(f"unstructured.partition.{name}"), f"partition_{name}")
+
+def load_partitioners() -> None:
+    """Import every document partitioner (used by the startup warmup)."""
+    for extension in DOCUMENT_PARTITIONERS:
+        get_partitioner(extension)
+
+def attachment_filename(url: str) -> str:
+    """Lower-cased file name of an attachment URL, ignoring query strings (Discord CDN URLs are signed)."""
+    return urlparse(url).path.split("/")[-1].lower()
+
+def attachment_format(filename: str) -> str:
+    extension = os.path.splitext(filename)[1]
+    if extension in DOCUMENT_PARTITIONERS or extension in IMAGE_EXTENSIONS:
+        return extension.lstrip(".")
+    return "unsupported"
+
+def _pdf_parts(content: bytes) -> Iterator[bytes]:
+    """The PDF split into documents of ATTACHMENT_PDF_PAGES_PER_PART pages (whole if pypdf is unavailable)."""
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        yield content
+        return
+    reader = PdfReader(BytesIO(content))
+    if len(reader.pages) <= ATTACHMENT_PDF_PAGES_PER_PART:
+        yield content
+        return
+    for start in range(0, len(reader.pages), ATTACHMENT_PDF_PAGES_PER_PART):
+        writer = PdfWriter()
+        for page in reader.pages[start:start + ATTACHMENT_PDF_PAGES_PER_PART]:
+            writer.add_page(page)
+        buffer = BytesIO()
+        writer.write(buffer)
+        yield buffer.getvalue()
+
+def _csv_parts(content: bytes) -> Iterator[bytes]:
+    """The CSV split into blocks of ATTACHMENT_CSV_ROWS_PER_PART rows (quoted line breaks stay within their row)."""
+    rows = csv.reader(StringIO(content.decode("utf-8", errors="replace"), newline=""))
+    while True:
+        block = [row for _, row in zip(range(ATTACHMENT_CSV_ROWS_PER_PART), rows)]
+        if not block:
+            return
+        buffer = StringIO()
+        csv.writer(buffer).writerows(block)
+        yield buffer.getvalue().encode()
+
+# Extension -> splitter into independently partitionable parts; other formats are partitioned whole
+DOCUMENT_SPLITTERS = {
+    ".pdf": _pdf_parts,
+    ".csv": _csv_parts,
+}
+
+def partition_parts(extension: str, content: bytes) -> Iterator[List[str]]:
+    """Element texts of a document, one list per part."""
+    partition = get_partitioner(extension)
+    split = DOCUMENT_SPLITTERS.get(extension)
+    for part in split(content) if split else [content]:
+        elements = partition(file=BytesIO(part))
+        yield [el.text for el in elements if getattr(el, "text", None)]
+
+async def _iter_document_text(extension: str, content: bytes) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    parts = partition_parts(extension, content)
+    while True:
+        texts = await loop.run_in_executor(_executor, next, parts, None)
+        if texts is None:
+            return
+        for text in texts:
+            yield text + "\n"
+
+async def iter_attachment_text(attachment_urls: list) -> AsyncIterator[str]:
+    """Text of the attachments, a document element (or OCR'd image) at a time.
+
+    Failed attachments are logged to the DLQ and skipped. The time the consumer spends between
+    pieces (chunking, embedding) is not counted as attachment extraction time.
+    """
     for url in attachment_urls:
+        filename = attachment_filename(url)
+        fmt = attachment_format(filename)
+        elapsed = 0.0
+        resumed = time.perf_counter()
+        status = "ok"
         try:
             async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
                 async with session.get(url) as resp:
                     if resp.status != 200:
                         raise Exception(f"Failed to download file: {url} (status {resp.status})")
                     content = await resp.read()
-            filename = url.split("/")[-1].lower()
-            if filename.endswith(".pdf"):
-                try:
-                    elements = partition_pdf(file=BytesIO(content))
-                    text += "\n".join([el.text for el in elements if hasattr(el, "text")])
-                except Exception as e:
-                    logger.warning(f"PDF parsing failed for {filename}: {e}")
-                    raise
-            elif filename.endswith(".docx"):
-                try:
-                    elements = partition_docx(file=BytesIO(content))
-                    text += "\n".join([el.text for el in elements if hasattr(el, "text")])
-                except Exception as e:
-                    logger.warning(f"DOCX parsing failed for {filename}: {e}")
-                    raise
-            elif filename.endswith(".txt"):
-                try:
-                    elements = partition_text(file=BytesIO(content))
-                    text += "\n".join([el.text for el in elements if hasattr(el, "text")])
-                except Exception as e:
-                    logger.warning(f"TXT parsing failed for {filename}: {e}")
-                    raise
-            elif filename.endswith(".html"):
-                try:
-                    elements = partition_html(file=BytesIO(content))
-                    text += "\n".join([el.text for el in elements if hasattr(el, "text")])
-                except Exception as e:
-                    logger.warning(f"HTML parsing failed for {filename}: {e}")
-                    raise
-            elif filename.endswith(".pptx"):
-                try:
-                    elements = partition_pptx(file=BytesIO(content))
-                    text += "\n".join([el.text for el in elements if hasattr(el, "text")])
-                except Exception as e:
-                    logger.warning(f"PPTX parsing failed for {filename}: {e}")
-                    raise
-            elif filename.endswith(".xlsx"):
-                try:
-                    elements = partition_xlsx(file=BytesIO(content))
-                    text += "\n".join([el.text for el in elements if hasattr(el, "text")])
-                except Exception as e:
-                    logger.warning(f"XLSX parsing failed for {filename}: {e}")
-                    raise
-            elif filename.endswith(".odt"):
-                try:
-                    elements = partition_odt(file=BytesIO(content))
-                    text += "\n".join([el.text for el in elements if hasattr(el, "text")])
-                except Exception as e:
-                    logger.warning(f"ODT parsing failed for {filename}: {e}")
-                    raise
-            elif filename.endswith(".rtf"):
-                try:
-                    elements = partition_rtf(file=BytesIO(content))
-                    text += "\n".join([el.text for el in elements if hasattr(el, "text")])
-                except Exception as e:
-                    logger.warning(f"RTF parsing failed for {filename}: {e}")
-                    raise
-            elif filename.endswith(".csv"):
+            extension = os.path.splitext(filename)[1]
+            if extension in DOCUMENT_PARTITIONERS:
                 try:
-                    elements = partition_csv(file=BytesIO(content))
-                    text += "\n".join([el.text for el in elements if hasattr(el, "text")])
+                    async for piece in _iter_document_text(extension, content):
+                        elapsed += time.perf_counter() - resumed
+                        yield piece
+                        resumed = time.perf_counter()
                 except Exception as e:
-                    logger.warning(f"CSV parsing failed for {filename}: {e}")
+                    logger.warning(f"{fmt.upper()} parsing failed for {filename}: {e}")
                     raise
-            elif filename.endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff')):
+            elif filename.endswith(IMAGE_EXTENSIONS):
                 try:
-                    image = Image.open(BytesIO(content))
-                    try:
-                        ocr_text = pytesseract.image_to_string(image, lang=TESSERACT_LANGUAGES)
-                        text += ocr_text
-                    except pytesseract.TesseractError as e:
-                        logger.warning(f"OCR failed for {filename}: {e}")
-                        continue
+                    ocr_text, outcome = await extract_image_text(content, filename)
                 except Exception as e:
-                    logger.warning(f"Image processing failed for {filename}: {e}")
+                    status = "failed"
+                    logger.warning(f"OCR failed for {filename}: {e}")
                     continue
+                if outcome.startswith("skipped"):
+                    status = "skipped"
+                elif outcome == "timeout":
+                    status = "failed"
+                if ocr_text:
+                    elapsed += time.perf_counter() - resumed
+                    yield ocr_text + "\n"
+                    resumed = time.perf_counter()
             else:
+                status = "skipped"
                 logger.warning(f"Unsupported file type for {filename}")
                 continue
         except Exception as e:
+            status = "failed"
             logger.warning(f"Attachment processing failed for {url}: {e}")
             log_to_dlq({
                 "original_request": {"attachment_url": url},
@@ -119,4 +173,6 @@ async def process_attachments(attachment_urls: list) -> str:
                 "timestamp": datetime.datetime.utcnow().isoformat()
             })
             continue
-    return text 
\ No newline at end of file
+        finally:
+            ATTACHMENT_SECONDS.observe(elapsed + time.perf_counter() - resumed, format=fmt)
+            ATTACHMENTS.inc(format=fmt, status=status)
@@ -0,0 +1,388 @@
+# Online re-index: build a new Pinecone index (new embedding model, dimension or chunking) from the
+# live one without downtime, then cut every worker over with one shared-state write.
+#
+#   python -m src.backend.index_migration start --index vita-kb-bge --provider local --model BAAI/bge-small-en-v1.5 --create
+#   python -m src.backend.index_migration status
+#   python -m src.backend.index_migration resume      # after an interruption, from the last checkpoint
+#   python -m src.backend.index_migration cutover
+#   python -m src.backend.index_migration rollback    # back to the previous index
+#
+# `start --namespaced` builds the new index with one namespace per guild (see sharding.py): each
+# vector is copied into the namespace of the guild recorded in its metadata.
+#
+# While a migration runs, every vector written to the live index is logged (see embedding._LazyIndex)
+# and replayed into the new index, and a sample of /query requests is shadow-queried against it.
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict, List, Optional, Tuple
+from src.backend.chunking import iter_text_chunks
+from src.backend.context_selection import chunk_text, trim_overlaps
+from src.backend.embedding import (
+    ACTIVE_INDEX_KEY, MIGRATION_KEY, PREVIOUS_INDEX_KEY, INDEX_CONFIG_TTL_SECONDS, PINECONE_API_KEY, PINECONE_CLOUD,
+    PINECONE_REGION, active_target, current_migration, current_namespace, get_index, index_dimension, index_namespaces,
+    provider_for, record_index_model, build_vectors, reset_index_config_cache,
+)
+from src.backend.doc_store import get_doc_store
+from src.backend.logger import get_logger
+from src.backend.metrics import MIGRATION_VECTORS, MIGRATION_SHADOW_OVERLAP
+from src.backend.shared_state import get_shared_state
+from src.backend.sharding import DEFAULT_NAMESPACE, guild_of_namespace, namespace_for
+from src.backend.vector_store import message_vector_id, message_vector_prefix, upsert_batches
+from src.backend.windowing import window_message_of
+
+logger = get_logger(__name__)
+
+MIGRATION_PAGE_SIZE = int(os.getenv("MIGRATION_PAGE_SIZE", "100"))
+MIGRATION_CONCURRENCY = int(os.getenv("MIGRATION_CONCURRENCY", "4"))
+# Share of /query requests repeated against the new index during a migration
+MIGRATION_SHADOW_SAMPLE_RATE = float(os.getenv("MIGRATION_SHADOW_SAMPLE_RATE", "0.1"))
+
+_shadow_tasks: set = set()
+
+
+def _save(key: str, value: Optional[Dict[str, Any]]) -> None:
+    state = get_shared_state()
+    if value is None:
+        state.cache_delete(key)
+    else:
+        state.cache_set(key, value)
+    reset_index_config_cache()
+
+
+def _message_key(vector_id: str) -> Optional[str]:
+    """Message ID of a per-message chunk vector ("{message_id}#{n}"); None for windows and thread documents."""
+    head, sep, tail = vector_id.rpartition("#")
+    return head if sep and tail.isdigit() and head.isdigit() else None
+
+
+class Migrator:
+    """Copies vectors from the source to the target index, re-embedding their stored chunk text.
+
+    With rechunk, the chunks of each message are stitched back together (dropping chunk overlap)
+    and split again with the current chunking settings. Chunk text of messages, windows and thread
+    documents comes from the doc store. Vectors written before their text was stored (thread
+    documents indexed by older versions) cannot be re-embedded and are counted as skipped;
+    re-ingest those threads.
+
+    Vectors are read from their guild's namespace in the source and written to their guild's
+    namespace in the target, so a flat index can be split into per-guild namespaces (and back).
+    """
+
+    def __init__(self, migration: Dict[str, Any]):
+        self.migration = migration
+        self.rechunk = migration.get("rechunk", False)
+        target = migration["target"]
+        self.provider = provider_for(target["provider"], target["model"], target.get("dimensions", 0))
+        self.source = get_index(migration["source"]["index"])
+        self.target = get_index(target["index"])
+        self.source_namespaced = migration["source"].get("namespaced", False)
+        self.target_namespaced = target.get("namespaced", False)
+        self._semaphore = asyncio.Semaphore(MIGRATION_CONCURRENCY)
+
+    def _count(self, result: str, n: int) -> None:
+        if n:
+            stats = self.migration.setdefault("stats", {})
+            stats[result] = stats.get(result, 0) + n
+            MIGRATION_VECTORS.inc(n, result=result)
+
+    def _source_namespace(self, guild_id: Optional[str]) -> str:
+        return namespace_for(guild_id, self.source_namespaced)
+
+    def _target_namespace(self, guild_id: Optional[str]) -> str:
+        return namespace_for(guild_id, self.target_namespaced)
+
+    def _fetch(self, ids: List[str], guild_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        fetched = self.source.fetch(ids=ids, namespace=self._source_namespace(guild_id)).vectors
+        docs = get_doc_store().get(self.migration["source"]["index"], list(fetched))
+        return {vector_id: dict(v.metadata or {}, **docs.get(vector_id, {})) for vector_id, v in fetched.items()}
+
+    def _list(self, index, prefix: str, namespace: str) -> List[str]:
+        return [i for page in index.list(prefix=prefix, namespace=namespace) for i in page]
+
+    def _rechunk_message(self, message_id: str, guild_id: Optional[str]) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[str]]:
+        """New (id, metadata) records for one message, and the target IDs they replace."""
+        records = self._fetch(self._list(self.source, message_vector_prefix(message_id), self._source_namespace(guild_id)), guild_id)
+        stale = self._list(self.target, message_vector_prefix(message_id), self._target_namespace(guild_id))
+        if not records:
+            return [], stale
+        chunks = sorted(records.values(), key=lambda m: int(m.get("chunk_index", 0)))
+        text = "".join(chunk_text(c) for c in trim_overlaps(chunks))
+        base = {k: v for k, v in chunks[0].items() if k not in ("chunk_text", "chunk_index")}
+        new = [(message_vector_id(message_id, i), dict(base, chunk_text=piece, chunk_index=i))
+               for i, piece in enumerate(iter_text_chunks(text))]
+        return new, sorted(set(stale) - {vector_id for vector_id, _ in new})
+
+    async def copy(self, ids: List[str], guild_id: Optional[str] = None, replay: bool = False) -> None:
+        """Re-embed the given source vectors (of guild_id) into the target; IDs gone from the source are deleted there."""
+        async with self._semaphore:
+            records: List[Tuple[str, Dict[str, Any]]] = []
+            stale: List[str] = []
+            plain = [i for i in ids if not (self.rechunk and _message_key(i))]
+            if plain:
+                fetched = await asyncio.to_thread(self._fetch, plain, guild_id)
+                records.extend(fetched.items())
+                stale.extend(i for i in plain if i not in fetched)
+            if self.rechunk:
+                # A message is rebuilt once, from the page holding its first chunk (or whenever it changed)
+                messages = {_message_key(i) for i in ids if _message_key(i) and (replay or i.endswith("#0"))}
+                for message_id in sorted(messages):
+                    new, removed = await asyncio.to_thread(self._rechunk_message, message_id, guild_id)
+                    records.extend(new)
+                    stale.extend(removed)
+            texts = [(vector_id, meta) for vector_id, meta in records if chunk_text(meta)]
+            self._count("skipped", len(records) - len(texts))
+            if texts:
+                embeddings = await self.provider.embed([chunk_text(meta) for _, meta in texts])
+                vectors, docs = build_vectors([vector_id for vector_id, _ in texts], embeddings, [meta for _, meta in texts])
+                await asyncio.to_thread(get_doc_store().put, self.migration["target"]["index"], docs)
+                by_namespace: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+                for vector, (_, meta) in zip(vectors, texts):
+                    by_namespace[self._target_namespace(meta.get("guild_id") or guild_id)].append(vector)
+                for namespace, batch in by_namespace.items():
+                    for part in upsert_batches(batch):
+                        await asyncio.to_thread(self.target.upsert, vectors=part, namespace=namespace)
+            if stale:
+                await asyncio.to_thread(self.target.delete, ids=stale, namespace=self._target_namespace(guild_id))
+                await asyncio.to_thread(get_doc_store().delete, self.migration["target"]["index"], stale)
+            self._count("copied", len(texts))
+            self._count("deleted", len(stale))
+
+    def _checkpoint(self, namespace: str, token: Optional[str]) -> None:
+        self.migration["checkpoint"] = token
+        if token is None:
+            self.migration.setdefault("namespaces_done", []).append(namespace)
+        _save(MIGRATION_KEY, self.migration)
+
+    async def backfill(self) -> None:
+        """Stream each source namespace page by page, copying up to MIGRATION_CONCURRENCY pages at once.
+
+        The checkpoint is the pagination token after the last page whose predecessors have all
+        finished, so a resumed run never skips a page (it may redo a few; upserts are idempotent).
+        """
+        namespaces = sorted(await asyncio.to_thread(index_namespaces, self.migration["source"]["index"])) or [DEFAULT_NAMESPACE]
+        for namespace in namespaces:
+            if namespace not in self.migration.get("namespaces_done", []):
+                await self._backfill_namespace(namespace)
+        self.migration["backfill_done"] = True
+        _save(MIGRATION_KEY, self.migration)
+
+    async def _backfill_namespace(self, namespace: str) -> None:
+        guild_id = guild_of_namespace(namespace)
+        token = self.migration.get("checkpoint")
+        pending: deque = deque()
+        while True:
+            page = await asyncio.to_thread(self.source.list_paginated, limit=MIGRATION_PAGE_SIZE,
+                                           pagination_token=token, namespace=namespace)
+            ids = [v.id for v in page.vectors]
+            token = page.pagination.next if page.pagination else None
+            pending.append((asyncio.create_task(self.copy(ids, guild_id)), token))
+            while pending and (pending[0][0].done() or len(pending) > MIGRATION_CONCURRENCY):
+                task, done_token = pending.popleft()
+                await task
+                self._checkpoint(namespace, done_token)
+            if token is None:
+                break
+        while pending:
+            task, done_token = pending.popleft()
+            await task
+            self._checkpoint(namespace, done_token)
+
+    async def replay(self) -> int:
+        """Copy the vectors written to the live index since the migration started."""
+        state = get_shared_state()
+        total = 0
+        while True:
+            changes = state.take_vector_changes(MIGRATION_PAGE_SIZE)
+            if not changes:
+                return total
+            by_guild: Dict[Optional[str], List[str]] = defaultdict(list)
+            for vector_id, guild_id in changes:
+                by_guild[guild_id].append(vector_id)
+            for guild_id, ids in by_guild.items():
+                await self.copy(ids, guild_id, replay=True)
+            total += len(changes)
+            _save(MIGRATION_KEY, self.migration)
+
+
+def _create_index(name: str, dimension: int) -> None:
+    from pinecone import Pinecone, ServerlessSpec
+    pc = Pinecone(api_key=PINECONE_API_KEY)
+    if name in pc.list_indexes().names():
+        return
+    logger.info(f"Creating index {name} with dimension {dimension}")
+    pc.create_index(name=name, dimension=dimension, metric="cosine", spec=ServerlessSpec(cloud=PINECONE_CLOUD, region=PINECONE_REGION))
+    while not pc.describe_index(name).status["ready"]:
+        time.sleep(5)
+
+
+async def start(index_name: str, provider: str, model: str, rechunk: bool = False, create: bool = False,
+                dimensions: int = 0, namespaced: bool = False) -> Dict[str, Any]:
+    if current_migration():
+        raise RuntimeError("A migration is already in progress; use resume, cutover or abort")
+    source = active_target()
+    if index_name == source["index"]:
+        raise RuntimeError(f"{index_name} is the live index; migrate into a new index")
+    target = {"index": index_name, "provider": provider, "model": model, "dimensions": dimensions, "namespaced": namespaced}
+    embedder = provider_for(provider, model, dimensions)
+    if create:
+        await asyncio.to_thread(_create_index, index_name, embedder.dimension)
+    dimension = await asyncio.to_thread(index_dimension, index_name)
+    if dimension and dimension != embedder.dimension:
+        raise RuntimeError(f"Index {index_name} has dimension {dimension} but {embedder.model_id} produces {embedder.dimension}")
+    record_index_model(index_name, embedder)
+    get_shared_state().clear_vector_changes()
+    migration = {"source": source, "target": target, "rechunk": rechunk, "checkpoint": None,
+                 "backfill_done": False, "stats": {}, "started_at": time.time()}
+    _save(MIGRATION_KEY, migration)
+    # Let every worker notice the migration (and start logging its writes) before copying
+    await asyncio.sleep(INDEX_CONFIG_TTL_SECONDS)
+    return await resume()
+
+
+async def resume() -> Dict[str, Any]:
+    migration = current_migration()
+    if not migration:
+        raise RuntimeError("No migration in progress")
+    migrator = Migrator(migration)
+    if not migration.get("backfill_done"):
+        await migrator.backfill()
+    await migrator.replay()
+    return migration
+
+
+async def cutover() -> Dict[str, Any]:
+    """Switch every worker to the new index: one write of the active target, then a final replay."""
+    migration = current_migration()
+    if not migration or not migration.get("backfill_done"):
+        raise RuntimeError("Backfill has not finished; run resume first")
+    migrator = Migrator(migration)
+    await migrator.replay()
+    _save(PREVIOUS_INDEX_KEY, migration["source"])
+    _save(ACTIVE_INDEX_KEY, migration["target"])
+    # Workers that had not switched yet may still have written to the old index
+    await asyncio.sleep(2 * INDEX_CONFIG_TTL_SECONDS)
+    await migrator.replay()
+    _save(MIGRATION_KEY, None)
+    get_shared_state().clear_vector_changes()
+    if migration.get("rechunk"):
+        await asyncio.to_thread(_prune_near_duplicates, migration["target"]["index"])
+    logger.info(f"Cut over from {migration['source']['index']} to {migration['target']['index']}")
+    return migration
+
+
+def _prune_near_duplicates(index_name: str) -> None:
+    """Re-chunking changes chunk IDs; forget near-duplicate signatures of chunks the new index does not have."""
+    from src.backend.near_duplicates import get_near_duplicates
+    duplicates = get_near_duplicates()
+    target = get_index(index_name)
+    namespaces = list(index_namespaces(index_name)) or [DEFAULT_NAMESPACE]
+    # Windowed messages are keyed by message, and windows are copied unchanged
+    ids = [i for i in duplicates.vector_ids() if window_message_of(i) is None]
+    for start in range(0, len(ids), MIGRATION_PAGE_SIZE):
+        batch = ids[start:start + MIGRATION_PAGE_SIZE]
+        found = {i for namespace in namespaces for i in target.fetch(ids=batch, namespace=namespace).vectors}
+        duplicates.forget([i for i in batch if i not in found])
+
+
+def rollback() -> Dict[str, Any]:
+    """Make the previous index live again. Writes made to the newer index since cutover are not copied back."""
+    state = get_shared_state()
+    previous = state.cache_get(PREVIOUS_INDEX_KEY)
+    if not previous:
+        raise RuntimeError("No previous index recorded")
+    _save(PREVIOUS_INDEX_KEY, active_target())
+    _save(ACTIVE_INDEX_KEY, previous)
+    return previous
+
+
+def abort() -> None:
+    """Stop the migration and change logging; the partially built index is left in place."""
+    _save(MIGRATION_KEY, None)
+    get_shared_state().clear_vector_changes()
+
+
+def status() -> Dict[str, Any]:
+    return {
+        "active": active_target(),
+        "previous": get_shared_state().cache_get(PREVIOUS_INDEX_KEY),
+        "migration": current_migration(),
+        "pending_changes": get_shared_state().pending_vector_changes(),
+    }
+
+
+def _matched_sources(matches) -> List[str]:
+    # Chunk IDs may differ between indexes (re-chunking), so compare the messages they belong to
+    return [(m.metadata or {}).get("message_id") or m.id for m in matches]
+
+
+async def shadow_query(question: str, live_matches, top_k: int) -> None:
+    """Run the query against the new index and record how much of the live result it reproduces."""
+    migration = current_migration()
+    if not migration:
+        return
+    target = migration["target"]
+    try:
+        vector = await provider_for(target["provider"], target["model"], target.get("dimensions", 0)).embed_query(question)
+        result = await asyncio.to_thread(get_index(target["index"]).query, vector=vector, top_k=top_k, include_metadata=True,
+                                         namespace=current_namespace(target))
+        live = set(_matched_sources(live_matches))
+        shadow = set(_matched_sources(result.matches))
+        overlap = len(live & shadow) / len(live) if live else 1.0
+        MIGRATION_SHADOW_OVERLAP.observe(overlap)
+        logger.debug("Shadow query on %s: overlap %.2f", target["index"], overlap)
+    except Exception as e:
+        logger.warning(f"Shadow query against {target['index']} failed: {e}")
+
+
+def maybe_shadow_query(question: str, live_matches, top_k: int) -> None:
+    """Sample /query requests during a migration for a background shadow comparison."""
+    if not current_migration() or random.random() >= MIGRATION_SHADOW_SAMPLE_RATE:
+        return
+    task = asyncio.create_task(shadow_query(question, list(live_matches), top_k))
+    _shadow_tasks.add(task)
+    task.add_done_callback(_shadow_tasks.discard)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-index into a new Pinecone index without downtime.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    start_parser = sub.add_parser("start", help="start a migration into a new index")
+    start_parser.add_argument("--index", required=True, help="name of the new index")
+    start_parser.add_argument("--provider", default=None, help="embedding provider (default: the live one)")
+    start_parser.add_argument("--model", default=None, help="embedding model (default: the live one)")
+    start_parser.add_argument("--dimensions", type=int, default=None,
+                              help="shortened embedding size (default: the live one; 0 for the model's native size)")
+    start_parser.add_argument("--rechunk", action="store_true", help="re-split message chunks with the current chunking settings")
+    start_parser.add_argument("--namespaced", action=argparse.BooleanOptionalAction, default=None,
+                              help="keep each guild's vectors in its own namespace (default: as the live index)")
+    start_parser.add_argument("--create", action="store_true", help="create the index if it does not exist")
+    for name in ("resume", "cutover", "rollback", "abort", "status"):
+        sub.add_parser(name)
+    args = parser.parse_args()
+
+    if args.command == "start":
+        live = active_target()
+        dimensions = live.get("dimensions", 0) if args.dimensions is None else args.dimensions
+        namespaced = live.get("namespaced", False) if args.namespaced is None else args.namespaced
+        result: Any = asyncio.run(start(args.index, args.provider or live["provider"], args.model or live["model"],
+                                        args.rechunk, args.create, dimensions, namespaced))
+    elif args.command == "resume":
+        result = asyncio.run(resume())
+    elif args.command == "cutover":
+        result = asyncio.run(cutover())
+    elif args.command == "rollback":
+        result = rollback()
+    elif args.command == "abort":
+        result = abort()
+    else:
+        result = status()
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,51 +4,42 @@ import os
 import json
 from typing import Set, Dict, Any, List
 from threading import Lock
-import tempfile
-import logging
-
-PROCESSED_LOG_PATH = "processed_messages.json"
-_log_lock = Lock()
-LOCKS_DIR = "locks"
-os.makedirs(LOCKS_DIR, exist_ok=True)
+from src.backend.logger import get_logger
+from src.backend.metrics import DLQ_ENTRIES
+from src.backend.shared_state import get_shared_state, LEASE_TTL_SECONDS, OWNER_ID
 
 DLQ_PATH = "dlq.json"
 _dlq_lock = Lock()
 
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
 
 def load_processed_ids() -> Set[str]:
-    """Load processed message/file IDs from local log."""
-    if not os.path.exists(PROCESSED_LOG_PATH):
-        return set()
-    with open(PROCESSED_LOG_PATH, "r") as f:
-        try:
-            return set(json.load(f))
-        except Exception:
-            return set()
+    """Load processed message/file IDs from the shared state store."""
+    return get_shared_state().all_processed()
 
 def save_processed_ids(ids: Set[str]) -> None:
-    """Save processed message/file IDs to local log."""
-    with _log_lock:
-        with open(PROCESSED_LOG_PATH, "w") as f:
-            json.dump(list(ids), f)
+    """Record processed message/file IDs in the shared state store."""
+    get_shared_state().mark_processed_many(ids)
 
 def is_processed(message_id: str) -> bool:
-    """Check if a message/file ID has already been processed, using a lock file to prevent race conditions."""
-    lock_path = os.path.join(LOCKS_DIR, f"{message_id}.lock")
-    if os.path.exists(lock_path):
-        return True
-    processed = load_processed_ids()
-    return message_id in processed
+    """Check if a message/file ID has already been processed (by any worker process)."""
+    return get_shared_state().is_processed(message_id)
+
+def claim(key: str, ttl: float = LEASE_TTL_SECONDS, owner: str = OWNER_ID) -> bool:
+    """Take a cross-process lease on a message/thread ID so only one worker ingests it at a time.
+
+    Leases expire after ttl, so an ID claimed by a crashed worker becomes available again.
+    The default owner is the process; pass a per-task owner to exclude other tasks of the same process too.
+    """
+    return get_shared_state().acquire_lease(f"ingest:{key}", ttl, owner)
+
+def release(key: str, owner: str = OWNER_ID) -> None:
+    get_shared_state().release_lease(f"ingest:{key}", owner)
 
 def mark_processed(message_id: str) -> None:
-    """Mark a message/file ID as processed and remove its lock file."""
-    processed = load_processed_ids()
-    processed.add(message_id)
-    save_processed_ids(processed)
-    lock_path = os.path.join(LOCKS_DIR, f"{message_id}.lock")
-    if os.path.exists(lock_path):
-        os.remove(lock_path)
+    """Mark a message/file ID as processed and release its lease."""
+    get_shared_state().mark_processed_many([message_id])
+    release(message_id)
 
 def batch_ingest_historical(messages: List[Dict[str, Any]]) -> List[str]:
     """Batch ingest historical messages, skipping already processed ones."""
@@ -64,10 +55,13 @@ def batch_ingest_historical(messages: List[Dict[str, Any]]) -> List[str]:
     return new_ids 
 
 def log_to_dlq(item: dict) -> None:
+    step = item.get("failed_at_step") or item.get("type") or "unknown"
+    DLQ_ENTRIES.inc(step=step)
     try:
         with _dlq_lock:
             with open(DLQ_PATH, "a") as f:
                 f.write(json.dumps(item) + "\n")
-        logger.info(f"DLQ entry: {item}")
+        logger.info("Dead-lettered a failed %s", step)
+        logger.debug("DLQ entry: %s", item)
     except Exception as e:
         logger.error(f"Failed to log to DLQ: {e}") 
\ No newline at end of file
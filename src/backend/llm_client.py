@@ -1,32 +1,290 @@
+import asyncio
 import os
-from openai import AsyncOpenAI
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
 from dotenv import load_dotenv
 from src.backend.logger import get_logger
+from src.backend.metrics import LLM_REQUESTS, LLM_TOKENS, LLM_WAIT_SECONDS, LLM_IN_FLIGHT, LLM_UTILISATION
+from src.backend.shared_state import OWNER_ID, get_shared_state
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-chat")
+QUERY_LLM_MODEL = os.getenv("QUERY_LLM_MODEL", "gpt-3.5-turbo")
+# Cheaper chat model to switch to when the primary one is rate limited ("" disables fallback)
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+# Account limits for each model; every API and ingestion process draws on them through shared state
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+# Calls in flight per process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_BULK_MAX_CONCURRENCY = int(os.getenv("LLM_BULK_MAX_CONCURRENCY", "8"))
+# Share of each bucket that bulk work may not use, kept free for interactive requests
+LLM_BULK_RESERVE = float(os.getenv("LLM_BULK_RESERVE", "0.2"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+
+# Priority classes: interactive (/ask, /summarize) is served before bulk (ingestion, backfills)
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+_POLL_SECONDS = 0.05
+_MAX_SLEEP_SECONDS = 1.0
+# A waiting interactive caller renews its claim every poll; bulk callers in every process yield while it is fresh
+_INTERACTIVE_CLAIM_SECONDS = 2 * _MAX_SLEEP_SECONDS
+
 logger = get_logger(__name__)
 
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
-print(f"DEBUG: OpenAI API key configured: {OPENAI_API_KEY[:10]}...")
+# Retries are done by the governor (priority-aware, shared backoff), not by the SDK
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+
+class TokenBucket:
+    """Refills at rate_per_minute up to capacity (one minute's worth by default).
+
+    The level is kept in shared state under key, so every process on the host draws on the same budget.
+    """
+
+    def __init__(self, key: str, rate_per_minute: float, capacity: Optional[float] = None):
+        self.key = key
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+
+    def request(self, amount: float) -> Tuple[str, float, float, float]:
+        """This bucket's entry for SharedState.take_tokens."""
+        return self.key, min(amount, self.capacity), self.rate, self.capacity
+
+    @property
+    def level(self) -> float:
+        return get_shared_state().bucket_level(self.key, self.rate, self.capacity)
+
+    def take(self, amount: float, reserve: float = 0.0) -> float:
+        """Take amount if that leaves reserve (a fraction of capacity) untouched; returns 0, or the seconds to wait."""
+        return get_shared_state().take_tokens([self.request(amount)], reserve)
+
+    def charge(self, amount: float) -> None:
+        """Take amount unconditionally (negative gives it back), e.g. to correct an estimate."""
+        get_shared_state().take_tokens([(self.key, amount, self.rate, self.capacity)], force=True)
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the provider returned 429, so every caller backs off."""
+        get_shared_state().drain_tokens([(self.key, self.rate, self.capacity)])
+
+    def utilisation(self) -> float:
+        return 1.0 - max(self.level, 0.0) / self.capacity
+
+
+class LLMGovernor:
+    """Per-model request/token buckets and concurrency caps with interactive-over-bulk priority.
+
+    Interactive callers may use the whole budget; bulk callers wait while interactive ones are
+    queued (in any process), are capped at bulk_concurrency and leave `reserve` of each bucket untouched.
+    The buckets are shared by all processes; the concurrency caps apply per process. Shared state is
+    only touched from worker threads, never on the event loop.
+    """
+
+    def __init__(self, model: str, requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = LLM_TOKENS_PER_MINUTE, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 bulk_concurrency: int = LLM_BULK_MAX_CONCURRENCY, reserve: float = LLM_BULK_RESERVE):
+        self.model = model
+        self.requests = TokenBucket(f"llm:{model}:requests", requests_per_minute)
+        self.tokens = TokenBucket(f"llm:{model}:tokens", tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.bulk_concurrency = bulk_concurrency
+        self.reserve = reserve
+        self.in_flight = {INTERACTIVE: 0, BULK: 0}
+        self.interactive_waiting = 0
+        self._interactive_claim_key = f"llm:{model}:interactive-waiting"
+
+    async def _try_acquire(self, priority: str, tokens: float) -> float:
+        """Take a slot, a request and tokens if priority may go now; returns 0, or the seconds to wait."""
+        if sum(self.in_flight.values()) >= self.max_concurrency:
+            return _POLL_SECONDS
+        if priority == BULK and (self.interactive_waiting or self.in_flight[BULK] >= self.bulk_concurrency):
+            return _POLL_SECONDS
+        # Hold the slot while the shared buckets are checked, so concurrent callers see it taken
+        self.in_flight[priority] += 1
+        try:
+            wait = await asyncio.to_thread(self._take_from_buckets, priority, tokens)
+        except BaseException:
+            self.in_flight[priority] -= 1
+            raise
+        if wait > 0:
+            self.in_flight[priority] -= 1
+        return wait
+
+    def _take_from_buckets(self, priority: str, tokens: float) -> float:
+        state = get_shared_state()
+        if priority == BULK and state.cache_get(self._interactive_claim_key) is not None:
+            return _POLL_SECONDS
+        reserve = self.reserve if priority == BULK else 0.0
+        wait = state.take_tokens([self.requests.request(1), self.tokens.request(tokens)], reserve)
+        if wait > 0 and priority == INTERACTIVE:
+            state.cache_set(self._interactive_claim_key, OWNER_ID, ttl=_INTERACTIVE_CLAIM_SECONDS)
+        return wait
+
+    async def acquire(self, priority: str, tokens: float) -> None:
+        start = time.perf_counter()
+        if priority == INTERACTIVE:
+            self.interactive_waiting += 1
+        try:
+            while True:
+                wait = await self._try_acquire(priority, tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(min(wait, _MAX_SLEEP_SECONDS))
+        finally:
+            if priority == INTERACTIVE:
+                self.interactive_waiting -= 1
+        LLM_WAIT_SECONDS.observe(time.perf_counter() - start, priority=priority)
+        await asyncio.to_thread(self._report)
+
+    async def release(self, priority: str, estimated_tokens: float, used_tokens: Optional[float] = None) -> None:
+        self.in_flight[priority] -= 1
+        await asyncio.to_thread(self._settle, estimated_tokens, used_tokens)
+
+    def _settle(self, estimated_tokens: float, used_tokens: Optional[float]) -> None:
+        if used_tokens is not None:
+            # Charge what the call actually used instead of the estimate
+            self.tokens.charge(used_tokens - min(estimated_tokens, self.tokens.capacity))
+        self._report()
+
+    @asynccontextmanager
+    async def slot(self, priority: str, tokens: float):
+        """Hold a request slot; the yielded dict's "used_tokens" (if set) reconciles the token estimate."""
+        await self.acquire(priority, tokens)
+        usage: Dict[str, Optional[float]] = {"used_tokens": None}
+        try:
+            yield usage
+        finally:
+            await self.release(priority, tokens, usage["used_tokens"])
+
+    def throttle(self) -> None:
+        self.requests.drain()
+        self.tokens.drain()
+        self._report()
+
+    def _report(self) -> None:
+        for priority, count in self.in_flight.items():
+            LLM_IN_FLIGHT.set(count, model=self.model, priority=priority)
+        LLM_UTILISATION.set(self.requests.utilisation(), model=self.model, limit="requests")
+        LLM_UTILISATION.set(self.tokens.utilisation(), model=self.model, limit="tokens")
+        LLM_UTILISATION.set(sum(self.in_flight.values()) / self.max_concurrency, model=self.model, limit="concurrency")
+
+
+_governors: Dict[str, LLMGovernor] = {}
+
+
+def get_governor(model: str) -> LLMGovernor:
+    if model not in _governors:
+        _governors[model] = LLMGovernor(model)
+    return _governors[model]
+
+
+def estimate_tokens(texts: List[str], max_tokens: int = 0) -> int:
+    from src.backend.chunking import count_tokens
+    return sum(count_tokens(t) for t in texts) + max_tokens
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait (Retry-After / retry-after-ms headers), if any."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def backoff_delay(attempt: int, error: Optional[Exception] = None) -> float:
+    """Full-jitter exponential backoff, never shorter than the provider's Retry-After."""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+    hinted = retry_after(error) if error is not None else None
+    return max(delay, hinted) if hinted is not None else delay
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+async def call_with_governor(model: str, priority: str, estimated_tokens: int, call, fallback_model: str = ""):
+    """Run call(model) under the model's governor, retrying transient errors with jittered backoff.
+
+    When the model is rate limited and a fallback model is given, the next attempt uses the fallback.
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        governor = get_governor(model)
+        try:
+            async with governor.slot(priority, estimated_tokens) as usage:
+                response = await call(model)
+                total = getattr(getattr(response, "usage", None), "total_tokens", None)
+                usage["used_tokens"] = total
+            LLM_REQUESTS.inc(model=model, priority=priority, outcome="ok")
+            if total is not None:
+                LLM_TOKENS.inc(total, model=model, priority=priority)
+            return response
+        except Exception as e:
+            if not is_retryable(e) or attempt == LLM_MAX_RETRIES:
+                LLM_REQUESTS.inc(model=model, priority=priority, outcome="error")
+                raise
+            if isinstance(e, RateLimitError):
+                LLM_REQUESTS.inc(model=model, priority=priority, outcome="rate_limited")
+                await asyncio.to_thread(governor.throttle)
+                if fallback_model and fallback_model != model:
+                    logger.warning(f"{model} rate limited; falling back to {fallback_model}")
+                    model = fallback_model
+                    continue
+            else:
+                LLM_REQUESTS.inc(model=model, priority=priority, outcome="retry")
+            delay = backoff_delay(attempt, e)
+            logger.warning(f"LLM call to {model} failed ({type(e).__name__}); retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def chat_completion(messages: List[Dict[str, str]], model: str = LLM_MODEL, priority: str = INTERACTIVE,
+                          max_tokens: int = 512, fallback_model: str = LLM_FALLBACK_MODEL, **kwargs: Any):
+    """Chat completion through the shared governor (rate limits, priority, retries, fallback)."""
+    estimated = estimate_tokens([m["content"] for m in messages], max_tokens)
+    return await call_with_governor(
+        model, priority, estimated,
+        lambda m: openai_client.chat.completions.create(model=m, messages=messages, max_tokens=max_tokens, **kwargs),
+        fallback_model,
+    )
+
+
+async def create_embeddings(texts: List[str], model: str, priority: str = BULK,
+                            dimensions: Optional[int] = None) -> List[List[float]]:
+    """Embeddings through the shared governor. Embedding models have no fallback: vectors must match the index.
+
+    `dimensions` asks text-embedding-3-* models for shortened vectors.
+    """
+    extra = {"dimensions": dimensions} if dimensions else {}
+    response = await call_with_governor(
+        model, priority, estimate_tokens(texts),
+        lambda m: openai_client.embeddings.create(input=texts, model=m, **extra),
+    )
+    return [d.embedding for d in response.data]
 
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
-async def get_llm_summary(text: str) -> str:
-    """Generate a summary of the given text using the LLM."""
+async def get_llm_summary(text: str, priority: str = INTERACTIVE) -> str:
+    """Generate a summary of the given text using the LLM (map-reduce over segments, see summarization.py)."""
+    from src.backend.summarization import summarize_lines
     try:
-        prompt = f"Summarize the following conversation in a concise, clear paragraph:\n\n{text}"
-        response = await openai_client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": prompt}],
-            max_tokens=256,
-            temperature=0.5,
-        )
-        return response.choices[0].message.content.strip()
+        return await summarize_lines(text.splitlines(), LLM_MODEL, priority)
     except Exception as e:
         logger.error(f"LLM summary error: {e}")
-        return "Summary could not be generated." 
\ No newline at end of file
+        return "Summary could not be generated."
@@ -1,15 +1,184 @@
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
+import multiprocessing.util
 import os
+import queue
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
+from src.backend.metrics import LOG_RECORDS_DROPPED
 
 load_dotenv()
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json": one JSON object per line; "text": the human-readable format
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Records waiting for the writer thread; beyond this new records are dropped (and counted), so a
+# slow disk or pipe never blocks the event loop
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Records at or below LOG_RATE_LIMIT_LEVEL are limited to LOG_RATE_LIMIT_BURST per call site every
+# LOG_RATE_LIMIT_WINDOW_SECONDS; the next record let through reports how many were suppressed.
+# Warnings and errors are never limited.
+LOG_RATE_LIMIT_LEVEL = os.getenv("LOG_RATE_LIMIT_LEVEL", "INFO").upper()
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "20"))
+LOG_RATE_LIMIT_WINDOW_SECONDS = float(os.getenv("LOG_RATE_LIMIT_WINDOW_SECONDS", "10"))
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(name)s] - %(message)s"
+TEXT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Attributes every LogRecord has; anything else on a record came from `extra=` and is output as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# Callables returning fields (e.g. the trace ID) to attach to every record, called where the record is logged
+_context_providers: List[Callable[[], Dict[str, Any]]] = []
+
+
+def add_context_provider(provider: Callable[[], Dict[str, Any]]) -> None:
+    """Attach provider()'s non-empty fields to every record logged from here on."""
+    _context_providers.append(provider)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg, exception, plus any extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Pass at most `burst` records per call site every `window` seconds at or below `level`."""
+
+    def __init__(self, burst: int = LOG_RATE_LIMIT_BURST, window: float = LOG_RATE_LIMIT_WINDOW_SECONDS,
+                 level: int = logging.getLevelName(LOG_RATE_LIMIT_LEVEL)):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        # (path, line) -> [window start, records passed, records suppressed]
+        self._sites: Dict[Tuple[str, int], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.level:
+            return True
+        site = (record.pathname, record.lineno)
+        with self._lock:
+            state = self._sites.get(site)
+            if state is None or record.created - state[0] >= self.window:
+                if state and state[2]:
+                    record.suppressed = int(state[2])
+                state = self._sites[site] = [record.created, 0, 0]
+            if state[1] >= self.burst:
+                state[2] += 1
+                LOG_RECORDS_DROPPED.inc(reason="rate_limited")
+                return False
+            state[1] += 1
+        return True
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; drops them (counted) instead of blocking when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only the arguments are merged here (they may change once the call returns) and the caller's
+        # context captured; formatting, tracebacks included, happens on the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        for provider in _context_providers:
+            for key, value in provider().items():
+                if value is not None and not hasattr(record, key):
+                    setattr(record, key, value)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc(reason="queue_full")
+
+
+class StderrHandler(logging.StreamHandler):
+    """Writes to the current sys.stderr (test runners and process managers replace it after startup)."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stderr
+
+
+def _formatter() -> logging.Formatter:
+    return JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT, TEXT_DATE_FORMAT)
+
+
+_handler: Optional[AsyncQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _start_writer() -> None:
+    global _listener
+    output = StderrHandler()
+    output.setFormatter(_formatter())
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+
+
+def flush_logs() -> None:
+    """Write out every queued record and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_in_child() -> None:
+    # The writer thread does not survive fork, and the queue or a filter lock may have been held
+    # by another thread at the time
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    for log_filter in _handler.filters:
+        if isinstance(log_filter, RateLimitFilter):
+            log_filter._lock = threading.Lock()
+    _start_writer()
+
+
+def _flush_at_process_exit(handler: AsyncQueueHandler) -> None:
+    # multiprocessing children skip atexit; their finalizers run on exit instead
+    multiprocessing.util.Finalize(None, flush_logs, exitpriority=0)
+
+
+def configure_logging() -> None:
+    """Route all logging through a bounded queue to a background writer thread (idempotent)."""
+    global _handler
+    if _handler is not None:
+        return
+    _handler = AsyncQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(RateLimitFilter())
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_handler)
+    _start_writer()
+    atexit.register(flush_logs)
+    os.register_at_fork(after_in_child=_restart_in_child)
+    multiprocessing.util.register_after_fork(_handler, _flush_at_process_exit)
+
+
+configure_logging()
 
-logging.basicConfig(
-    level=LOG_LEVEL,
-    format="[%(asctime)s] [%(levelname)s] [%(name)s] - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
 
 def get_logger(name: str):
-    return logging.getLogger(name) 
\ No newline at end of file
+    return logging.getLogger(name)
@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond in-process work up to slow LLM calls.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Buckets for item counts such as embedding or upsert batch sizes.
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# Buckets for prompt/context sizes in tokens.
+TOKEN_BUCKETS = (0, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+# The registry is per process. Every process publishes a snapshot of it to shared state this often,
+# and /metrics merges the snapshots of all live processes, so a scrape covers every API and ingestion
+# worker whichever one answers it. Other processes' values lag by up to this interval, and a process
+# that exits drops out of the sums once its snapshot expires (Prometheus sees a counter reset).
+METRICS_PUBLISH_SECONDS = float(os.getenv("METRICS_PUBLISH_SECONDS", "5"))
+_SNAPSHOT_KEY_PREFIX = "metrics:"
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _format_labels(self, key: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.label_names, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+        return "{" + body + "}"
+
+    def values(self) -> Dict[LabelValues, Any]:
+        raise NotImplementedError
+
+    def combine(self, a: Any, b: Any) -> Any:
+        """Merge the values of one label set from two processes."""
+        raise NotImplementedError
+
+    def render(self, values: Optional[Dict[LabelValues, Any]] = None) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def values(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def combine(self, a: float, b: float) -> float:
+        return a + b
+
+    def render(self, values: Optional[Dict[LabelValues, float]] = None) -> List[str]:
+        items = (self.values() if values is None else values).items()
+        return [f"{self.name}{self._format_labels(k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    """merge="sum" adds up the processes' values (in-flight work); "max" suits values every process
+    reads from the same source or ratios (queue depth, utilisation)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), merge: str = "sum"):
+        super().__init__(name, help_text, labels)
+        self.merge = merge
+
+    def combine(self, a: float, b: float) -> float:
+        return max(a, b) if self.merge == "max" else a + b
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        # Per label set: [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels: str) -> Optional[Tuple[List[int], float, int]]:
+        """Return (bucket counts, sum, count) for a label set, or None if nothing was observed."""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (list(state[0]), state[1], state[2]) if state else None
+
+    def quantile(self, q: float, **labels: str) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile for a label set (None if nothing was observed)."""
+        snapshot = self.snapshot(**labels)
+        if snapshot is None:
+            return None
+        counts, _, count = snapshot
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            if cumulative >= q * count:
+                return bound
+        return float("inf")
+
+    def label_sets(self) -> List[Dict[str, str]]:
+        with self._lock:
+            return [dict(zip(self.label_names, key)) for key in self._values]
+
+    def values(self) -> Dict[LabelValues, list]:
+        with self._lock:
+            return {k: [list(v[0]), v[1], v[2]] for k, v in self._values.items()}
+
+    def combine(self, a: list, b: list) -> list:
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def render(self, values: Optional[Dict[LabelValues, list]] = None) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in (self.values() if values is None else values).items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else _num(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_num(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+_registry: Dict[str, _Metric] = {}
+_registry_lock = Lock()
+
+
+def _register(cls, name: str, help_text: str, labels: Sequence[str], **kwargs) -> _Metric:
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help_text, labels, **kwargs)
+        return metric
+
+
+def counter(name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+    return _register(Counter, name, help_text, labels)
+
+
+def gauge(name: str, help_text: str, labels: Sequence[str] = (), merge: str = "sum") -> Gauge:
+    return _register(Gauge, name, help_text, labels, merge=merge)
+
+
+def histogram(name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help_text, labels, buckets=buckets)
+
+
+def render_prometheus(snapshots: Optional[Iterable[Dict[str, list]]] = None) -> str:
+    """Render every registered metric in the Prometheus text exposition format.
+
+    With snapshots (see snapshot()), the values of all of them are merged instead of using this process's.
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    snapshots = None if snapshots is None else list(snapshots)
+    lines: List[str] = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render(None if snapshots is None else _merge(metric, snapshots)))
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> Dict[str, list]:
+    """This process's metric values in JSON-serialisable form, for merging across processes."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: [[list(key), value] for key, value in metric.values().items()] for metric in metrics}
+
+
+def _merge(metric: _Metric, snapshots: List[Dict[str, list]]) -> Dict[LabelValues, Any]:
+    merged: Dict[LabelValues, Any] = {}
+    for values in snapshots:
+        for key, value in values.get(metric.name, []):
+            key = tuple(key)
+            merged[key] = metric.combine(merged[key], value) if key in merged else value
+    return merged
+
+
+def publish_snapshot() -> None:
+    from src.backend.shared_state import get_shared_state
+    get_shared_state().cache_set(f"{_SNAPSHOT_KEY_PREFIX}{os.getpid()}", snapshot(), ttl=3 * METRICS_PUBLISH_SECONDS)
+
+
+async def publish_snapshots() -> None:
+    """Publish this process's snapshot every METRICS_PUBLISH_SECONDS; run as a background task in each worker process."""
+    while True:
+        try:
+            await asyncio.to_thread(publish_snapshot)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Failed to publish metrics: {e}")
+        await asyncio.sleep(METRICS_PUBLISH_SECONDS)
+
+
+def render_all_processes() -> str:
+    """Prometheus text for every live process: this one's current values merged with the others' latest snapshots."""
+    from src.backend.shared_state import get_shared_state
+    publish_snapshot()
+    return render_prometheus(get_shared_state().cache_values(_SNAPSHOT_KEY_PREFIX))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+# Metrics shared across modules
+QUERY_STAGE_SECONDS = histogram("vita_query_stage_seconds", "Latency of each /query pipeline stage.", ["stage"])
+INGEST_STAGE_SECONDS = histogram("vita_ingest_stage_seconds", "Latency of each ingestion stage.", ["stage"])
+INGESTED_MESSAGES = counter("vita_ingested_messages_total", "Messages ingested, by ingestion path.", ["path"])
+NEAR_DUPLICATES = counter("vita_near_duplicate_checks_total", "Ingested chunks checked for near-duplicates, by result (duplicate/unique).", ["result"])
+ATTACHMENT_SECONDS = histogram("vita_attachment_extract_seconds", "Attachment download + text extraction latency by format.", ["format"])
+ATTACHMENTS = counter("vita_attachments_total", "Attachments processed, by format and outcome.", ["format", "status"])
+OCR_IMAGES = counter("vita_ocr_images_total", "Image attachments by OCR outcome (ok/empty/skipped_small/skipped_no_text/timeout/failed).", ["outcome"])
+OCR_SECONDS = histogram("vita_ocr_seconds", "OCR latency per image, by stage (detect/preprocess/tesseract/total).", ["stage"])
+EMBEDDING_BATCH = histogram("vita_embedding_batch_size", "Number of texts per embedding request.", buckets=SIZE_BUCKETS)
+EMBEDDING_SECONDS = histogram("vita_embedding_seconds", "Embedding request latency.")
+UPSERT_BATCH = histogram("vita_upsert_batch_size", "Number of vectors per upsert request.", buckets=SIZE_BUCKETS)
+VECTOR_STORE_SECONDS = histogram("vita_vector_store_seconds", "Vector store call latency, by operation.", ["operation"])
+VECTOR_STORE_ERRORS = counter("vita_vector_store_errors_total", "Failed vector store calls, by operation and reason (timeout/error).", ["operation", "reason"])
+JOB_QUEUE_DEPTH = gauge("vita_job_queue_depth", "Jobs waiting in or claimed from the shared ingestion queue, by kind.", ["kind"], merge="max")
+BACKGROUND_TASKS = gauge("vita_background_tasks", "Background tasks queued or running, by kind.", ["kind"])
+CACHE_REQUESTS = counter("vita_cache_requests_total", "Cache lookups, by cache and result (hit/miss).", ["cache", "result"])
+QUERY_CONTEXT_TOKENS = histogram("vita_query_context_tokens", "Context tokens per /query, before (candidates) and after (selected) context selection.", ["kind"], buckets=TOKEN_BUCKETS)
+QUERY_CONTEXT_TOKENS_SAVED = counter("vita_query_context_tokens_saved_total", "Prompt tokens removed by overlap trimming, deduplication and MMR.")
+MIGRATION_VECTORS = counter("vita_migration_vectors_total", "Vectors handled by the re-index migration, by result (copied/skipped/deleted).", ["result"])
+MIGRATION_SHADOW_OVERLAP = histogram("vita_migration_shadow_overlap_ratio", "Share of live /query results (by message) also returned by the new index during a migration.", buckets=(0.0, 0.2, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0))
+LLM_REQUESTS = counter("vita_llm_requests_total", "LLM/embedding API attempts, by model, priority and outcome.", ["model", "priority", "outcome"])
+LLM_TOKENS = counter("vita_llm_tokens_total", "Tokens used by LLM/embedding API calls, by model and priority.", ["model", "priority"])
+LLM_WAIT_SECONDS = histogram("vita_llm_wait_seconds", "Time spent waiting for rate-limit and concurrency budget.", ["priority"])
+LLM_IN_FLIGHT = gauge("vita_llm_in_flight", "LLM/embedding API calls in flight, by model and priority.", ["model", "priority"])
+LLM_UTILISATION = gauge("vita_llm_utilisation_ratio", "Share of each model's request, token and concurrency budget in use.", ["model", "limit"], merge="max")
+ADMISSION_QUEUED = gauge("vita_admission_queued", "Requests or tasks waiting for admission, by priority class.", ["priority"])
+ADMISSION_IN_FLIGHT = gauge("vita_admission_in_flight", "Admitted requests or tasks running, by priority class.", ["priority"])
+ADMISSION_SHED = counter("vita_admission_shed_total", "Requests rejected by admission control, by priority class and reason.", ["priority", "reason"])
+ADMISSION_WAIT_SECONDS = histogram("vita_admission_wait_seconds", "Time spent waiting for admission, by priority class.", ["priority"])
+BULK_DEFERRED_SECONDS = counter("vita_bulk_deferred_seconds_total", "Time bulk ingestion spent backing off for interactive traffic.")
+INTERACTIVE_PRESSURE = gauge("vita_interactive_pressure", "1 while interactive latency is at risk and bulk work is held back.", merge="max")
+GUILD_QUERY_SECONDS = histogram("vita_guild_query_seconds", "/query latency per guild.", ["guild"])
+GUILD_VECTORS = gauge("vita_guild_vectors", "Vectors in each guild's index namespace (refreshed by /stats/guilds).", ["guild"], merge="max")
+LOG_RECORDS_DROPPED = counter("vita_log_records_dropped_total", "Log records not written, by reason (rate_limited/queue_full).", ["reason"])
+TRACE_SPANS_DROPPED = counter("vita_trace_spans_dropped_total", "Finished spans dropped because the span writer fell behind.")
+DLQ_ENTRIES = counter("vita_dlq_entries_total", "Entries written to the dead-letter queue, by failed step.", ["step"])
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+@contextmanager
+def track_task(kind: str) -> Iterator[None]:
+    """Count a background task as in flight for the duration of the block."""
+    BACKGROUND_TASKS.inc(kind=kind)
+    try:
+        yield
+    finally:
+        BACKGROUND_TASKS.dec(kind=kind)
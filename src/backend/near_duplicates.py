@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from src.backend.logger import get_logger
+
+logger = get_logger(__name__)
+
+NEAR_DUPLICATE_PATH = os.getenv("NEAR_DUPLICATE_PATH", "near_duplicates.db")
+# Maximum SimHash Hamming distance (out of 64 bits) for two chunks to count as near-duplicates; -1 disables
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "3"))
+# Shorter texts are never deduplicated: their signatures are too unstable to compare
+NEAR_DUPLICATE_MIN_CHARS = int(os.getenv("NEAR_DUPLICATE_MIN_CHARS", "80"))
+# Sources linked to one vector are capped so the vector's metadata stays small
+NEAR_DUPLICATE_MAX_LINKS = int(os.getenv("NEAR_DUPLICATE_MAX_LINKS", "50"))
+SHINGLE_WORDS = 3
+
+_WORD = re.compile(r"\w+")
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def _shingles(text: str) -> List[str]:
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word 3-gram shingles; similar texts get signatures a few bits apart."""
+    shingles = _shingles(text)
+    if not shingles:
+        return 0
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64,
+    )
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.int32)
+    votes = 2 * bits.sum(axis=0) - len(shingles)
+    return int(sum(1 << i for i in np.flatnonzero(votes > 0)))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _bands(signature: int, count: int) -> List[int]:
+    """Split the signature into count bit ranges. Two signatures within count - 1 bits share at least one band."""
+    width = 64 // count
+    bands = []
+    for i in range(count):
+        bits = 64 - width * i if i == count - 1 else width
+        bands.append((signature >> (width * i)) & ((1 << bits) - 1))
+    return bands
+
+
+def _signed(value: int) -> int:
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    """SQLite-backed SimHash index of stored chunk vectors, with LSH bands for candidate lookup.
+
+    Signatures are only compared within a scope (the chunk's roles) so that a duplicate is never
+    linked to a vector readable by a different audience. Messages found to duplicate a vector are
+    recorded as links and cited from that vector instead of being embedded again; each link keeps
+    the duplicate chunk (ID and metadata) so it can be indexed on its own if the vector goes away.
+    """
+
+    def __init__(self, path: str = NEAR_DUPLICATE_PATH, max_distance: int = NEAR_DUPLICATE_MAX_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self.band_count = max(max_distance, 0) + 1
+        self._lock = Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS signatures (vector_id TEXT PRIMARY KEY, scope TEXT, signature INTEGER, created_at REAL)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS bands (scope TEXT, band INTEGER, value INTEGER, vector_id TEXT)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS bands_lookup ON bands (scope, band, value)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS bands_vector ON bands (vector_id)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS links (vector_id TEXT, message_id TEXT, channel_id TEXT, PRIMARY KEY (vector_id, message_id))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS links_message ON links (message_id)")
+            # Databases created before links kept the duplicate chunk
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(links)")}
+            for column in ("chunk_id", "metadata"):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE links ADD COLUMN {column} TEXT")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._rebuild_bands_if_needed()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per process: worker processes share the database file but never a connection
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._db
+
+    def _rebuild_bands_if_needed(self) -> None:
+        """The band layout depends on the threshold; re-band the stored signatures when it changes."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'band_count'").fetchone()
+            if row and int(row[0]) == self.band_count:
+                return
+            rows = self._conn.execute("SELECT vector_id, scope, signature FROM signatures").fetchall()
+            self._conn.execute("DELETE FROM bands")
+            self._conn.executemany(
+                "INSERT INTO bands (scope, band, value, vector_id) VALUES (?, ?, ?, ?)",
+                [(scope, i, value, vector_id) for vector_id, scope, signature in rows
+                 for i, value in enumerate(_bands(_unsigned(signature), self.band_count))],
+            )
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('band_count', ?)", (str(self.band_count),))
+        if rows:
+            logger.info(f"Re-banded {len(rows)} near-duplicate signatures for distance {self.max_distance}")
+
+    def enabled_for(self, text: str) -> bool:
+        return self.max_distance >= 0 and len(text) >= NEAR_DUPLICATE_MIN_CHARS
+
+    def find(self, text: str, scope: str) -> Optional[str]:
+        """ID of the closest stored vector within max_distance of text, or None."""
+        if not self.enabled_for(text):
+            return None
+        signature = simhash(text)
+        clauses = " OR ".join("(band = ? AND value = ?)" for _ in range(self.band_count))
+        params: List[object] = [scope]
+        for i, value in enumerate(_bands(signature, self.band_count)):
+            params.extend((i, value))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT s.vector_id, s.signature FROM bands b JOIN signatures s ON s.vector_id = b.vector_id "
+                f"WHERE b.scope = ? AND ({clauses})",
+                params,
+            ).fetchall()
+        best: Optional[Tuple[int, str]] = None
+        for vector_id, stored in rows:
+            distance = hamming_distance(signature, _unsigned(stored))
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, vector_id)
+        return best[1] if best else None
+
+    def add(self, items: Iterable[Tuple[str, str]], scope: str) -> None:
+        """Record (vector_id, text) pairs that were embedded and stored."""
+        rows = [(vector_id, simhash(text)) for vector_id, text in items if self.enabled_for(text)]
+        if not rows:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._delete_signatures([vector_id for vector_id, _ in rows])
+            self._conn.executemany(
+                "INSERT INTO signatures (vector_id, scope, signature, created_at) VALUES (?, ?, ?, ?)",
+                [(vector_id, scope, _signed(signature), now) for vector_id, signature in rows],
+            )
+            self._conn.executemany(
+                "INSERT INTO bands (scope, band, value, vector_id) VALUES (?, ?, ?, ?)",
+                [(scope, i, value, vector_id) for vector_id, signature in rows
+                 for i, value in enumerate(_bands(signature, self.band_count))],
+            )
+
+    def link(self, vector_id: str, message_id: str, channel_id: str, chunk_id: Optional[str] = None,
+             metadata: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Link a duplicate message to vector_id and return the vector's linked sources ("channel_id:message_id").
+
+        chunk_id and metadata (with its chunk_text) describe the duplicate chunk that was not embedded.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO links (vector_id, message_id, channel_id, chunk_id, metadata) VALUES (?, ?, ?, ?, ?)",
+                (vector_id, message_id, channel_id, chunk_id, json.dumps(metadata) if metadata is not None else None),
+            )
+        return self.sources(vector_id)
+
+    def sources(self, *vector_ids: str) -> List[str]:
+        """Linked sources of a vector, or of several keys together (the messages of a conversation window)."""
+        if not vector_ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT channel_id, message_id FROM links WHERE vector_id IN ({','.join('?' * len(vector_ids))}) "
+                f"ORDER BY rowid LIMIT ?",
+                (*vector_ids, NEAR_DUPLICATE_MAX_LINKS),
+            ).fetchall()
+        return [f"{channel_id}:{message_id}" for channel_id, message_id in rows]
+
+    def linked_chunks(self, vector_ids: Sequence[str]) -> Dict[str, Tuple[str, List[Tuple[str, Dict[str, Any]]]]]:
+        """{vector_id: (scope, [(chunk_id, metadata)])} of the duplicate chunks linked to each vector, oldest first.
+
+        Links recorded before duplicate chunks were kept have nothing to re-index and are left out.
+        """
+        ids = list(vector_ids)
+        if not ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT l.vector_id, s.scope, l.chunk_id, l.metadata FROM links l JOIN signatures s ON s.vector_id = l.vector_id "
+                f"WHERE l.vector_id IN ({','.join('?' * len(ids))}) AND l.chunk_id IS NOT NULL ORDER BY l.rowid",
+                ids,
+            ).fetchall()
+        linked: Dict[str, Tuple[str, List[Tuple[str, Dict[str, Any]]]]] = {}
+        for vector_id, scope, chunk_id, metadata in rows:
+            linked.setdefault(vector_id, (scope, []))[1].append((chunk_id, json.loads(metadata)))
+        return linked
+
+    def unlink(self, message_ids: Sequence[str]) -> Dict[str, List[str]]:
+        """Drop the links of (edited or deleted) duplicate messages. Returns {vector_id: remaining sources}."""
+        ids = list(message_ids)
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self._lock, self._conn:
+            vector_ids = [r[0] for r in self._conn.execute(
+                f"SELECT DISTINCT vector_id FROM links WHERE message_id IN ({placeholders})", ids
+            )]
+            self._conn.execute(f"DELETE FROM links WHERE message_id IN ({placeholders})", ids)
+        return {vector_id: self.sources(vector_id) for vector_id in vector_ids}
+
+    def forget(self, vector_ids: Sequence[str]) -> None:
+        """Remove signatures and links of deleted vectors so nothing is linked to them any more."""
+        ids = list(vector_ids)
+        if not ids:
+            return
+        with self._lock, self._conn:
+            self._delete_signatures(ids)
+            self._conn.execute(f"DELETE FROM links WHERE vector_id IN ({','.join('?' * len(ids))})", ids)
+
+    def vector_ids(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT vector_id FROM signatures")]
+
+    def _delete_signatures(self, vector_ids: List[str]) -> None:
+        placeholders = ",".join("?" * len(vector_ids))
+        self._conn.execute(f"DELETE FROM signatures WHERE vector_id IN ({placeholders})", vector_ids)
+        self._conn.execute(f"DELETE FROM bands WHERE vector_id IN ({placeholders})", vector_ids)
+
+
+_index: Optional[NearDuplicateIndex] = None
+
+
+def get_near_duplicates() -> NearDuplicateIndex:
+    global _index
+    if _index is None:
+        _index = NearDuplicateIndex()
+    return _index
+
+
+def duplicate_scope(roles: Optional[Sequence[str]], guild_id: Optional[str] = None) -> str:
+    """Chunks are only deduplicated against chunks of the same guild visible to the same roles."""
+    scope = ",".join(sorted(roles or []))
+    return f"{guild_id}|{scope}" if guild_id else scope
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Tuple
+import numpy as np
+from src.backend.logger import get_logger
+from src.backend.metrics import OCR_IMAGES, OCR_SECONDS
+
+logger = get_logger(__name__)
+
+TESSERACT_LANGUAGES = os.getenv("TESSERACT_LANGUAGES", "eng")
+# LSTM engine; page segmentation 11 (sparse text) finds the scattered blocks of chat and UI
+# screenshots without the layout analysis that makes the default mode slow on them
+OCR_TESSERACT_CONFIG = os.getenv("OCR_TESSERACT_CONFIG", "--oem 1 --psm 11")
+# Tesseract is killed after this long (pathological inputs can take minutes)
+OCR_TIMEOUT_SECONDS = float(os.getenv("OCR_TIMEOUT_SECONDS", "15"))
+# Images OCR'd at once; each runs a tesseract process
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", str(os.cpu_count() or 2)))
+# Images at or below this many pixels (avatars, emoji, icons) are not OCR'd
+OCR_MIN_PIXELS = int(os.getenv("OCR_MIN_PIXELS", str(128 * 128)))
+# Text detection: share of pixels on a strong horizontal edge, and how unevenly those edges are
+# spread over rows (lines of text alternate with blank leading; photos and textures do not)
+OCR_MIN_EDGE_DENSITY = float(os.getenv("OCR_MIN_EDGE_DENSITY", "0.01"))
+OCR_MIN_ROW_VARIATION = float(os.getenv("OCR_MIN_ROW_VARIATION", "0.6"))
+# Tesseract reads best at ~300 DPI; screenshots are ~96 DPI, so small images are upscaled to
+# about this long a side, and huge photos downscaled to at most OCR_MAX_PIXELS
+OCR_TARGET_SIDE = int(os.getenv("OCR_TARGET_SIDE", "2000"))
+OCR_MAX_UPSCALE = float(os.getenv("OCR_MAX_UPSCALE", "3"))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", str(8_000_000)))
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "true").lower() in ("1", "true", "yes")
+
+# Side of the grayscale thumbnail text detection runs on
+_DETECT_SIDE = 512
+# Horizontal intensity step counted as an edge (text strokes are high contrast)
+_EDGE_STEP = 48
+
+_executor = ThreadPoolExecutor(max_workers=OCR_CONCURRENCY, thread_name_prefix="ocr")
+
+
+def _grayscale(image):
+    """Grayscale with transparency flattened onto white (transparent PNGs otherwise turn black)."""
+    from PIL import Image
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    return image.convert("L")
+
+
+def text_likelihood(gray) -> Tuple[float, float]:
+    """(edge density, row variation) of a grayscale image, measured on a small thumbnail."""
+    thumb = gray.copy()
+    thumb.thumbnail((_DETECT_SIDE, _DETECT_SIDE))
+    pixels = np.asarray(thumb, dtype=np.int16)
+    if pixels.shape[1] < 2:
+        return 0.0, 0.0
+    edges = np.abs(np.diff(pixels, axis=1)) >= _EDGE_STEP
+    per_row = edges.mean(axis=1)
+    density = float(per_row.mean())
+    variation = float(per_row.std() / density) if density else 0.0
+    return density, variation
+
+
+def likely_has_text(gray) -> bool:
+    density, variation = text_likelihood(gray)
+    return density >= OCR_MIN_EDGE_DENSITY and variation >= OCR_MIN_ROW_VARIATION
+
+
+def _otsu_threshold(pixels: np.ndarray) -> int:
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    weights = histogram.cumsum()
+    means = (histogram * np.arange(256)).cumsum()
+    total, total_mean = weights[-1], means[-1]
+    background = weights[:-1]
+    foreground = total - background
+    valid = (background > 0) & (foreground > 0)
+    between = np.zeros(255)
+    between[valid] = (total_mean * background[valid] / total - means[:-1][valid]) ** 2 * total / (background[valid] * foreground[valid])
+    return int(np.argmax(between))
+
+
+def preprocess(gray):
+    """Scale toward ~300 DPI, make text dark on light, and binarize (Otsu) for tesseract."""
+    from PIL import Image
+    width, height = gray.size
+    scale = min(OCR_MAX_UPSCALE, OCR_TARGET_SIDE / max(width, height))
+    scale = min(max(scale, 1.0), (OCR_MAX_PIXELS / (width * height)) ** 0.5)
+    if abs(scale - 1.0) > 0.05:
+        gray = gray.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.uint8)
+    # Dark-mode screenshots: tesseract expects dark text on a light background
+    if pixels.mean() < 128:
+        pixels = 255 - pixels
+    if OCR_BINARIZE:
+        pixels = np.where(pixels > _otsu_threshold(pixels), 255, 0).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+
+def ocr_image(content: bytes) -> Tuple[str, str]:
+    """OCR an image unless it is predicted to hold no text. Returns (text, outcome).
+
+    Outcomes: ok, empty, skipped_small, skipped_no_text, timeout.
+    """
+    import pytesseract
+    from PIL import Image
+    start = time.perf_counter()
+    image = Image.open(BytesIO(content))
+    if image.width * image.height <= OCR_MIN_PIXELS:
+        return "", "skipped_small"
+    gray = _grayscale(image)
+    has_text = likely_has_text(gray)
+    OCR_SECONDS.observe(time.perf_counter() - start, stage="detect")
+    if not has_text:
+        return "", "skipped_no_text"
+    with OCR_SECONDS.time(stage="preprocess"):
+        prepared = preprocess(gray)
+    try:
+        with OCR_SECONDS.time(stage="tesseract"):
+            text = pytesseract.image_to_string(prepared, lang=TESSERACT_LANGUAGES, config=OCR_TESSERACT_CONFIG,
+                                               timeout=OCR_TIMEOUT_SECONDS)
+    except RuntimeError as e:
+        # pytesseract signals its timeout with a bare RuntimeError
+        if "timeout" not in str(e).lower():
+            raise
+        return "", "timeout"
+    text = text.strip()
+    return text, "ok" if text else "empty"
+
+
+async def extract_image_text(content: bytes, filename: str = "") -> Tuple[str, str]:
+    """Run ocr_image off the event loop (at most OCR_CONCURRENCY at once) and record its outcome."""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        text, outcome = await loop.run_in_executor(_executor, ocr_image, content)
+    except Exception:
+        OCR_IMAGES.inc(outcome="failed")
+        raise
+    OCR_IMAGES.inc(outcome=outcome)
+    OCR_SECONDS.observe(time.perf_counter() - start, stage="total")
+    if outcome == "timeout":
+        logger.warning(f"OCR timed out after {OCR_TIMEOUT_SECONDS:.0f}s for {filename}")
+    return text, outcome
@@ -0,0 +1,95 @@
+import os
+from typing import Callable, Sequence, Tuple
+import numpy as np
+
+# How vectors are held in memory by local indexes: float32, float16 or int8
+LOCAL_VECTOR_STORAGE = os.getenv("LOCAL_VECTOR_STORAGE", "float32").lower()
+# Candidates scored approximately per requested result before rescoring at full precision
+RESCORE_FACTOR = int(os.getenv("RESCORE_FACTOR", "4"))
+
+STORAGE_TYPES = ("float32", "float16", "int8")
+# Rows converted to float32 at once while scoring, so a query never materialises the whole matrix
+_BLOCK_ROWS = 4096
+
+
+def shorten(vectors, dimensions: int) -> np.ndarray:
+    """Keep the first `dimensions` components and re-normalise (what OpenAI returns for `dimensions`).
+
+    Only meaningful for models trained for it (Matryoshka representation learning); other models
+    lose much more recall when truncated.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if not dimensions or dimensions >= matrix.shape[-1]:
+        return matrix
+    head = matrix[..., :dimensions]
+    norms = np.linalg.norm(head, axis=-1, keepdims=True)
+    return head / np.where(norms == 0, 1.0, norms)
+
+
+class QuantizedMatrix:
+    """Row vectors stored at reduced precision for approximate scoring.
+
+    float16 halves memory; int8 quarters it, using one symmetric scale per row (max |x| / 127)
+    so rows of any norm keep their full code range. Scores against it are approximate: rank a
+    few times more candidates than needed and rescore them at full precision (see `search`).
+    """
+
+    def __init__(self, vectors, storage: str = LOCAL_VECTOR_STORAGE):
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown vector storage {storage!r}; expected one of {STORAGE_TYPES}")
+        self.storage = storage
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(matrix), -1)
+        if storage == "int8":
+            peaks = np.abs(matrix).max(axis=1, keepdims=True) if len(matrix) else np.ones((0, 1), np.float32)
+            self.scales = np.where(peaks == 0, 1.0, peaks / 127.0).astype(np.float32)
+            self.codes = np.round(matrix / self.scales).astype(np.int8)
+        else:
+            self.scales = None
+            self.codes = matrix.astype(np.float16) if storage == "float16" else matrix
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def dequantize(self) -> np.ndarray:
+        if self.scales is not None:
+            return self.codes.astype(np.float32) * self.scales
+        return self.codes.astype(np.float32)
+
+    def scores(self, query) -> np.ndarray:
+        """Approximate dot products of every row with query, converting a block of rows at a time."""
+        q = np.asarray(query, dtype=np.float32)
+        out = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), _BLOCK_ROWS):
+            out[start:start + _BLOCK_ROWS] = np.asarray(self.codes[start:start + _BLOCK_ROWS], dtype=np.float32) @ q
+        if self.scales is not None:
+            out *= self.scales[:, 0]
+        return out
+
+
+def search(matrix: QuantizedMatrix, query, top_k: int,
+           full_rows: Callable[[Sequence[int]], np.ndarray], rescore_factor: int = RESCORE_FACTOR) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k rows by dot product: rank approximately, then rescore the best candidates exactly.
+
+    full_rows(indices) returns the full-precision vectors of those rows (from wherever they are
+    kept: the remote index, a memory-mapped file, ...). Returns (row indices, scores), best first.
+    """
+    n = len(matrix)
+    k = min(top_k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    approximate = matrix.scores(query)
+    if matrix.storage == "float32":
+        candidates, scores = np.arange(n), approximate
+    else:
+        shortlist = min(n, max(k, k * rescore_factor))
+        candidates = np.argpartition(-approximate, shortlist - 1)[:shortlist]
+        scores = np.asarray(full_rows(candidates), dtype=np.float32) @ np.asarray(query, dtype=np.float32)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return np.asarray(candidates)[top], scores[top]
@@ -0,0 +1,61 @@
+import os
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Sequence
+
+# Keep each guild's vectors in its own index namespace so a query searches only its guild's
+# partition. Part of the index target: switching an existing flat index over requires a
+# re-index (`index_migration start --namespaced`).
+GUILD_NAMESPACES = os.getenv("GUILD_NAMESPACES", "false").lower() in ("1", "true", "yes")
+# "guild": each ingestion worker only runs the jobs of the guilds hashed to it (one guild's
+# backlog cannot hold up the others, and a guild's jobs run in order); "any": every worker runs any job
+INGEST_ROUTING = os.getenv("INGEST_ROUTING", "any").lower()
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+
+# Vectors without a guild (DMs, content indexed before guild IDs were recorded) live in the
+# default namespace
+DEFAULT_NAMESPACE = ""
+_NAMESPACE_PREFIX = "guild-"
+
+_guild: ContextVar[Optional[str]] = ContextVar("guild_id", default=None)
+
+
+def current_guild() -> Optional[str]:
+    """Guild whose content the current request or task reads and writes, if any."""
+    return _guild.get()
+
+
+@contextmanager
+def guild_scope(guild_id: Optional[str]) -> Iterator[None]:
+    """Run the block for guild_id: vector store calls inside it go to that guild's namespace."""
+    token = _guild.set(str(guild_id) if guild_id else None)
+    try:
+        yield
+    finally:
+        _guild.reset(token)
+
+
+def namespace_for(guild_id: Optional[str], namespaced: bool) -> str:
+    return f"{_NAMESPACE_PREFIX}{guild_id}" if namespaced and guild_id else DEFAULT_NAMESPACE
+
+
+def guild_of_namespace(namespace: str) -> Optional[str]:
+    return namespace[len(_NAMESPACE_PREFIX):] if namespace.startswith(_NAMESPACE_PREFIX) else None
+
+
+def guild_shard(guild_id: Optional[str], shards: int) -> int:
+    """Stable shard of a guild among `shards` (same on every process and across restarts)."""
+    if shards <= 1 or not guild_id:
+        return 0
+    return zlib.crc32(str(guild_id).encode()) % shards
+
+
+def job_shard(guild_id: Optional[str]) -> int:
+    """Shard (ingestion worker index) a guild's queued jobs are routed to; 0 unless routing by guild."""
+    return guild_shard(guild_id, INGEST_WORKERS) if INGEST_ROUTING == "guild" else 0
+
+
+def pick_for_guild(guild_id: Optional[str], choices: Sequence[str]) -> str:
+    """The member of choices (e.g. backend URLs) that serves guild_id."""
+    return choices[guild_shard(guild_id, len(choices))]
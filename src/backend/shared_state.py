@@ -0,0 +1,430 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from src.backend.logger import get_logger
+
+logger = get_logger(__name__)
+
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "vita_state.db")
+LEGACY_PROCESSED_LOG_PATH = "processed_messages.json"
+LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", "300"))
+LOCK_POLL_SECONDS = 0.05
+# Leases held by running work are renewed this often (as a fraction of their TTL)
+LEASE_RENEW_FRACTION = 1 / 3
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Unique per process; leases and job claims are recorded under it.
+OWNER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class LeaseLost(Exception):
+    """A lease or job claim could not be renewed: it expired and may now be held by another worker."""
+
+
+@asynccontextmanager
+async def keep_renewed(renew: Callable[[], bool], ttl: float, what: str):
+    """Call renew() every LEASE_RENEW_FRACTION of ttl while the block runs.
+
+    Once renew() returns False the lease belongs to someone else: the block is cancelled and LeaseLost raised.
+    """
+    holder = asyncio.current_task()
+    lost = False
+
+    async def beat() -> None:
+        nonlocal lost
+        while True:
+            await asyncio.sleep(ttl * LEASE_RENEW_FRACTION)
+            try:
+                renewed = await asyncio.to_thread(renew)
+            except Exception as e:
+                logger.warning(f"Failed to renew the lease on {what}: {e}")
+                continue
+            if not renewed:
+                lost = True
+                holder.cancel()
+                return
+
+    heartbeat = asyncio.create_task(beat())
+    try:
+        yield
+    except asyncio.CancelledError:
+        if lost and holder.uncancel() == 0:
+            raise LeaseLost(f"Lease on {what} was lost") from None
+        raise
+    finally:
+        heartbeat.cancel()
+
+
+class SharedState:
+    """Cross-process state in one SQLite database (WAL mode): processed IDs, leases, a TTL cache, a job queue,
+    rate-limit token buckets and the spans of recent traces.
+
+    Every API, ingestion and bot process on the host opens the same file, so state that used
+    to live in module globals (or unlocked JSON files) is consistent across workers.
+    Connections are per thread; each process opens its own after fork.
+    """
+
+    def __init__(self, path: str = SHARED_STATE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+        with self._conn() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS processed (message_id TEXT PRIMARY KEY, processed_at REAL);
+                CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, expires_at REAL);
+                CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL);
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, payload TEXT, context TEXT,
+                    priority INTEGER DEFAULT 0, state TEXT DEFAULT 'queued', owner TEXT,
+                    lease_expires REAL, attempts INTEGER DEFAULT 0, error TEXT, created_at REAL, shard INTEGER DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, priority, id);
+                CREATE TABLE IF NOT EXISTS vector_changes (vector_id TEXT PRIMARY KEY, direct INTEGER, changed_at REAL, guild_id TEXT);
+                CREATE TABLE IF NOT EXISTS token_buckets (key TEXT PRIMARY KEY, level REAL, updated_at REAL);
+                CREATE TABLE IF NOT EXISTS traces (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, trace_id TEXT UNIQUE, start_ns INTEGER, end_ns INTEGER, spans INTEGER DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS spans (trace_id TEXT, span TEXT);
+                CREATE INDEX IF NOT EXISTS spans_trace ON spans (trace_id);
+                """
+            )
+            # Databases created before jobs were routed by guild and changes carried their guild
+            self._add_column(conn, "jobs", "shard", "INTEGER DEFAULT 0")
+            self._add_column(conn, "vector_changes", "guild_id", "TEXT")
+        self._import_legacy_processed_log()
+
+    @staticmethod
+    def _add_column(conn: sqlite3.Connection, table: str, column: str, declaration: str) -> None:
+        if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # Forked: never reuse the parent's connections
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy_processed_log(self) -> None:
+        if not os.path.exists(LEGACY_PROCESSED_LOG_PATH):
+            return
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM processed LIMIT 1").fetchone():
+            return
+        try:
+            with open(LEGACY_PROCESSED_LOG_PATH) as f:
+                ids = json.load(f)
+        except Exception:
+            return
+        self.mark_processed_many(ids)
+        logger.info(f"Imported {len(ids)} processed IDs from {LEGACY_PROCESSED_LOG_PATH}")
+
+    # Processed IDs
+
+    def is_processed(self, message_id: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM processed WHERE message_id = ?", (message_id,)).fetchone() is not None
+
+    def processed_subset(self, message_ids: Iterable[str]) -> Set[str]:
+        ids = list(message_ids)
+        found: Set[str] = set()
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            rows = self._conn().execute(
+                f"SELECT message_id FROM processed WHERE message_id IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            found.update(r[0] for r in rows)
+        return found
+
+    def mark_processed_many(self, message_ids: Iterable[str]) -> None:
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO processed (message_id, processed_at) VALUES (?, ?)",
+                [(str(i), now) for i in message_ids],
+            )
+
+    def all_processed(self) -> Set[str]:
+        return {r[0] for r in self._conn().execute("SELECT message_id FROM processed")}
+
+    # Leases
+
+    def acquire_lease(self, key: str, ttl: float = LEASE_TTL_SECONDS, owner: str = OWNER_ID) -> bool:
+        """Take the lease if it is free, expired or already ours. Expiry recovers leases of crashed workers."""
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at < ? OR leases.owner = excluded.owner",
+            (key, owner, now + ttl, now),
+        )
+        return cur.rowcount == 1
+
+    def renew_lease(self, key: str, ttl: float = LEASE_TTL_SECONDS, owner: str = OWNER_ID) -> bool:
+        """Extend a lease we still hold; False if it was released or taken over."""
+        cur = self._conn().execute(
+            "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?", (time.time() + ttl, key, owner)
+        )
+        return cur.rowcount == 1
+
+    def release_lease(self, key: str, owner: str = OWNER_ID) -> None:
+        self._conn().execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    def is_leased(self, key: str) -> bool:
+        row = self._conn().execute("SELECT expires_at FROM leases WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] >= time.time()
+
+    @asynccontextmanager
+    async def lock(self, key: str, ttl: float = LEASE_TTL_SECONDS):
+        """Cross-process mutex: waits (polling) until the lease on key can be taken.
+
+        The lease is renewed while the block runs; if that fails, the block is cancelled with LeaseLost.
+        """
+        owner = f"{OWNER_ID}-{uuid.uuid4().hex[:8]}"
+        while not self.acquire_lease(key, ttl, owner):
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+        try:
+            async with keep_renewed(lambda: self.renew_lease(key, ttl, owner), ttl, key):
+                yield
+        finally:
+            self.release_lease(key, owner)
+
+    # TTL cache
+
+    def cache_get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def cache_set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", (key, json.dumps(value), expires_at)
+        )
+
+    def cache_values(self, prefix: str) -> List[Any]:
+        """Every unexpired cached value whose key starts with prefix."""
+        rows = self._conn().execute(
+            "SELECT value FROM cache WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (len(prefix), prefix, time.time()),
+        ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def cache_pop(self, key: str) -> Optional[Any]:
+        """Remove and return a cached value atomically (None if missing or expired)."""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def cache_delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    # Job queue
+
+    def enqueue_job(self, kind: str, payload: Dict[str, Any], context: Optional[List[Optional[str]]] = None, priority: int = 0,
+                    shard: int = 0) -> int:
+        cur = self._conn().execute(
+            "INSERT INTO jobs (kind, payload, context, priority, created_at, shard) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload), json.dumps(context or []), priority, time.time(), shard),
+        )
+        return cur.lastrowid
+
+    def claim_job(self, ttl: float = LEASE_TTL_SECONDS, owner: str = OWNER_ID,
+                  min_priority: int = 0, shard: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Claim the next queued job, or one whose worker's lease has expired.
+
+        Jobs below min_priority are left queued (how bulk work is deferred under interactive load).
+        With shard, only jobs routed to that shard are claimed.
+        """
+        now = time.time()
+        conn = self._conn()
+        shard_filter = "" if shard is None else " AND shard = ?"
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, kind, payload, context, attempts FROM jobs "
+                f"WHERE (state = 'queued' OR (state = 'running' AND lease_expires < ?)) AND priority >= ?{shard_filter} "
+                "ORDER BY priority DESC, id LIMIT 1",
+                (now, min_priority) + (() if shard is None else (shard,)),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'running', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                (owner, now + ttl, row[0]),
+            )
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "context": json.loads(row[3]), "attempts": row[4] + 1}
+
+    def renew_job(self, job_id: int, owner: str = OWNER_ID, ttl: float = LEASE_TTL_SECONDS) -> bool:
+        """Extend the lease of a job we are running; False if another worker has claimed it since."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? AND state = 'running'",
+            (time.time() + ttl, job_id, owner),
+        )
+        return cur.rowcount == 1
+
+    def complete_job(self, job_id: int) -> None:
+        self._conn().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def fail_job(self, job_id: int, error: str, max_attempts: int = JOB_MAX_ATTEMPTS) -> bool:
+        """Requeue a failed job; returns False (and drops it) once it has used up its attempts."""
+        conn = self._conn()
+        row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row[0] >= max_attempts:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return False
+        conn.execute("UPDATE jobs SET state = 'queued', owner = NULL, error = ? WHERE id = ?", (error, job_id))
+        return True
+
+    def queue_depth(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT kind, COUNT(*) FROM jobs GROUP BY kind").fetchall()
+        return {kind: count for kind, count in rows}
+
+    # Token buckets (rate limits shared by every process)
+
+    @staticmethod
+    def _bucket_level(conn: sqlite3.Connection, key: str, rate: float, capacity: float, now: float) -> float:
+        row = conn.execute("SELECT level, updated_at FROM token_buckets WHERE key = ?", (key,)).fetchone()
+        return capacity if row is None else min(capacity, row[0] + max(now - row[1], 0.0) * rate)
+
+    def bucket_level(self, key: str, rate: float, capacity: float) -> float:
+        """Current level of the bucket under key, refilled at rate per second up to capacity (full if never used)."""
+        return self._bucket_level(self._conn(), key, rate, capacity, time.time())
+
+    def take_tokens(self, buckets: List[Tuple[str, float, float, float]], reserve: float = 0.0, force: bool = False) -> float:
+        """Atomically take from several buckets, each given as (key, amount, rate per second, capacity).
+
+        Nothing is taken while any bucket would drop below reserve (a fraction of its capacity); the result is then
+        the seconds until all of them can be taken from, otherwise 0. force always takes (amounts may be negative,
+        giving tokens back) and lets levels go below zero.
+        """
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            levels = [self._bucket_level(conn, key, rate, capacity, now) for key, _, rate, capacity in buckets]
+            if not force:
+                wait = max(((amount + reserve * capacity - level) / rate
+                            for level, (_, amount, rate, capacity) in zip(levels, buckets)), default=0.0)
+                if wait > 0:
+                    return wait
+            conn.executemany(
+                "INSERT OR REPLACE INTO token_buckets (key, level, updated_at) VALUES (?, ?, ?)",
+                [(key, level - amount, now) for level, (key, amount, _, _) in zip(levels, buckets)],
+            )
+        return 0.0
+
+    def drain_tokens(self, buckets: List[Tuple[str, float, float]]) -> None:
+        """Empty each (key, rate per second, capacity) bucket, keeping any deficit it already has."""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO token_buckets (key, level, updated_at) VALUES (?, ?, ?)",
+                [(key, min(self._bucket_level(conn, key, rate, capacity, now), 0.0), now) for key, rate, capacity in buckets],
+            )
+
+    # Trace spans (so /debug/traces sees the spans of every process)
+
+    def record_spans(self, spans: List[Dict[str, Any]], max_traces: int, max_spans: int) -> None:
+        """Store finished spans, keeping at most max_spans per trace and the max_traces most recently started traces."""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for span in spans:
+                self._record_span(conn, span, max_traces, max_spans)
+
+    @staticmethod
+    def _record_span(conn: sqlite3.Connection, span: Dict[str, Any], max_traces: int, max_spans: int) -> None:
+        trace_id = span["trace_id"]
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO traces (trace_id, start_ns, end_ns) VALUES (?, ?, ?)",
+            (trace_id, span["start_ns"], span["end_ns"]),
+        )
+        if cur.rowcount == 1:
+            oldest = cur.lastrowid - max_traces
+            conn.execute("DELETE FROM spans WHERE trace_id IN (SELECT trace_id FROM traces WHERE id <= ?)", (oldest,))
+            conn.execute("DELETE FROM traces WHERE id <= ?", (oldest,))
+        cur = conn.execute(
+            "UPDATE traces SET start_ns = MIN(start_ns, ?), end_ns = MAX(end_ns, ?), spans = spans + 1 "
+            "WHERE trace_id = ? AND spans < ?",
+            (span["start_ns"], span["end_ns"], trace_id, max_spans),
+        )
+        if cur.rowcount == 1:
+            conn.execute("INSERT INTO spans (trace_id, span) VALUES (?, ?)", (trace_id, json.dumps(span)))
+
+    def trace_spans(self, trace_id: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute("SELECT span FROM spans WHERE trace_id = ?", (trace_id,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def slowest_traces(self, limit: int) -> List[str]:
+        rows = self._conn().execute("SELECT trace_id FROM traces ORDER BY end_ns - start_ns DESC LIMIT ?", (limit,)).fetchall()
+        return [r[0] for r in rows]
+
+    def clear_spans(self) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM spans")
+            conn.execute("DELETE FROM traces")
+
+    # Vector change log (written while a re-index is running)
+
+    def record_vector_changes(self, vector_ids: Iterable[str], direct: bool = False, guild_id: Optional[str] = None) -> None:
+        """Log vectors written to the live index (for guild_id's namespace). direct marks writes that already went to the new index."""
+        now = time.time()
+        self._conn().executemany(
+            "INSERT OR REPLACE INTO vector_changes (vector_id, direct, changed_at, guild_id) VALUES (?, ?, ?, ?)",
+            [(str(i), int(direct), now, guild_id) for i in vector_ids],
+        )
+
+    def take_vector_changes(self, limit: int = 500) -> List[Tuple[str, Optional[str]]]:
+        """Remove and return up to limit logged (vector ID, guild ID) pairs that still have to be copied to the new index."""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            changes = [(r[0], r[1]) for r in conn.execute(
+                "SELECT vector_id, guild_id FROM vector_changes WHERE direct = 0 ORDER BY changed_at LIMIT ?", (limit,)
+            )]
+            conn.executemany("DELETE FROM vector_changes WHERE vector_id = ?", [(i,) for i, _ in changes])
+        return changes
+
+    def pending_vector_changes(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM vector_changes WHERE direct = 0").fetchone()[0]
+
+    def clear_vector_changes(self) -> None:
+        self._conn().execute("DELETE FROM vector_changes")
+
+
+_state: Optional[SharedState] = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state() -> SharedState:
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = SharedState()
+    return _state
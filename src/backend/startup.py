@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from src.backend.logger import get_logger
+
+logger = get_logger(__name__)
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+READINESS_CACHE_SECONDS = float(os.getenv("READINESS_CACHE_SECONDS", "10"))
+PROBE_TIMEOUT_SECONDS = float(os.getenv("PROBE_TIMEOUT_SECONDS", "5"))
+
+STARTED_AT = time.time()
+_phases: Dict[str, float] = {}
+
+
+def record_phase(name: str, seconds: float) -> None:
+    """Record how long a startup phase (e.g. importing the API module) took."""
+    _phases[name] = seconds
+    logger.info(f"Startup phase {name} took {seconds:.2f}s")
+
+
+class Component:
+    """A heavy dependency loaded on first use or by the warmup phase, whichever comes first."""
+
+    def __init__(self, name: str, loader: Callable[[], Any], required: bool = True):
+        self.name = name
+        self.loader = loader
+        self.required = required
+        self.state = "pending"
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def load(self) -> None:
+        self.state = "loading"
+        start = time.perf_counter()
+        try:
+            self.loader()
+            self.state = "ready"
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            logger.error(f"Warmup of {self.name} failed: {e}")
+        finally:
+            self.seconds = time.perf_counter() - start
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"state": self.state, "required": self.required, "seconds": self.seconds, "error": self.error}
+
+
+_components: Dict[str, Component] = {}
+_warmup: Dict[str, Optional[float]] = {"started": None, "finished": None}
+
+
+def register_component(name: str, loader: Callable[[], Any], required: bool = True) -> None:
+    """Register a loader to run during warmup. Loaders must be idempotent (cached)."""
+    _components[name] = Component(name, loader, required)
+
+
+async def warmup() -> None:
+    """Load every registered component, one at a time in a worker thread, so the event loop keeps serving."""
+    _warmup["started"] = time.time()
+    for component in _components.values():
+        if component.state != "ready":
+            await asyncio.to_thread(component.load)
+    _warmup["finished"] = time.time()
+    logger.info(f"Warmup finished in {_warmup['finished'] - _warmup['started']:.2f}s: {components_summary()}")
+
+
+def preload(skip: Tuple[str, ...] = ()) -> None:
+    """Load components synchronously, e.g. in the supervisor before forking workers so they share the memory."""
+    start = time.perf_counter()
+    for component in _components.values():
+        if component.name not in skip and component.state != "ready":
+            component.load()
+    record_phase("preload", time.perf_counter() - start)
+
+
+def components_summary() -> Dict[str, str]:
+    return {name: c.state for name, c in _components.items()}
+
+
+def components_ready() -> bool:
+    return all(c.state == "ready" for c in _components.values() if c.required)
+
+
+class ProbeCache:
+    """Runs a blocking probe in a thread at most once per ttl seconds and caches the outcome."""
+
+    def __init__(self, probe: Callable[[], Any], ttl: float = READINESS_CACHE_SECONDS, timeout: float = PROBE_TIMEOUT_SECONDS):
+        self.probe = probe
+        self.ttl = ttl
+        self.timeout = timeout
+        self._result: Optional[Tuple[bool, str, float]] = None
+        self._lock = asyncio.Lock()
+
+    async def check(self) -> Tuple[bool, str, float]:
+        """Return (ok, detail, checked_at)."""
+        if self._result and time.time() - self._result[2] < self.ttl:
+            return self._result
+        async with self._lock:
+            if self._result and time.time() - self._result[2] < self.ttl:
+                return self._result
+            try:
+                await asyncio.wait_for(asyncio.to_thread(self.probe), self.timeout)
+                self._result = (True, "ok", time.time())
+            except asyncio.TimeoutError:
+                self._result = (False, f"probe timed out after {self.timeout}s", time.time())
+            except Exception as e:
+                self._result = (False, str(e), time.time())
+            return self._result
+
+
+def startup_report() -> Dict[str, Any]:
+    """Startup-time breakdown: import phases, per-component load times and warmup span."""
+    started, finished = _warmup["started"], _warmup["finished"]
+    return {
+        "uptime_seconds": time.time() - STARTED_AT,
+        "phases": dict(_phases),
+        "components": {name: c.as_dict() for name, c in _components.items()},
+        "warmup_seconds": finished - started if started and finished else None,
+        "ready_after_seconds": finished - STARTED_AT if finished else None,
+    }
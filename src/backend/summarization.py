@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import os
+from typing import List, Optional
+from src.backend.chunking import count_tokens, iter_text_chunks
+from src.backend.llm_client import INTERACTIVE, LLM_MODEL, chat_completion
+from src.backend.logger import get_logger
+from src.backend.metrics import record_cache
+from src.backend.shared_state import get_shared_state
+
+logger = get_logger(__name__)
+
+SUMMARY_SEGMENT_TOKENS = int(os.getenv("SUMMARY_SEGMENT_TOKENS", "2000"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+# Partial summaries are combined in groups of at most this many tokens per reduce call
+SUMMARY_REDUCE_TOKENS = int(os.getenv("SUMMARY_REDUCE_TOKENS", "3000"))
+SUMMARY_CACHE_TTL_SECONDS = float(os.getenv("SUMMARY_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+SUMMARY_MAX_TOKENS = 256
+# Bump when the prompts change so cached summaries made with the old prompts are not reused
+SUMMARY_PROMPT_VERSION = "1"
+
+MAP_PROMPT = "Summarize the following part of a conversation in a concise, clear paragraph. Keep names, decisions and open questions:\n\n{text}"
+REDUCE_PROMPT = "The following are summaries of consecutive parts of one conversation, in order. Combine them into one concise, clear paragraph:\n\n{text}"
+
+
+def segment_lines(lines: List[str], max_tokens: Optional[int] = None) -> List[str]:
+    """Pack lines into token-bounded segments, greedily from the start.
+
+    Packing from the start keeps the boundaries of earlier segments fixed when lines are appended,
+    so a thread that grew only produces new segments at its tail. Lines longer than a segment are
+    split on their own.
+    """
+    max_tokens = max_tokens or SUMMARY_SEGMENT_TOKENS
+    segments: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for line in lines:
+        tokens = count_tokens(line)
+        pieces = [line] if tokens <= max_tokens else list(iter_text_chunks(line, max_tokens=max_tokens, overlap_tokens=0))
+        for piece in pieces:
+            piece_tokens = tokens if len(pieces) == 1 else count_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                segments.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        segments.append("\n".join(current))
+    return segments
+
+
+def _cache_key(kind: str, text: str, model: str) -> str:
+    digest = hashlib.sha256(f"{SUMMARY_PROMPT_VERSION}\0{model}\0{kind}\0{text}".encode()).hexdigest()
+    return f"summary:{digest}"
+
+
+class ThreadSummarizer:
+    """Hierarchical (map-reduce) summarization with summaries cached by content hash."""
+
+    def __init__(self, model: str = LLM_MODEL, concurrency: int = SUMMARY_CONCURRENCY, priority: str = INTERACTIVE):
+        self.model = model
+        self.priority = priority
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.llm_calls = 0
+
+    async def _summarize(self, kind: str, text: str) -> str:
+        state = get_shared_state()
+        key = _cache_key(kind, text, self.model)
+        cached: Optional[str] = state.cache_get(key)
+        record_cache(f"summary_{kind}", cached is not None)
+        if cached is not None:
+            return cached
+        prompt = (MAP_PROMPT if kind == "map" else REDUCE_PROMPT).format(text=text)
+        async with self._semaphore:
+            self.llm_calls += 1
+            response = await chat_completion(
+                [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": prompt}],
+                model=self.model,
+                priority=self.priority,
+                max_tokens=SUMMARY_MAX_TOKENS,
+                temperature=0.5,
+            )
+        summary = response.choices[0].message.content.strip()
+        state.cache_set(key, summary, SUMMARY_CACHE_TTL_SECONDS)
+        return summary
+
+    async def summarize(self, lines: List[str]) -> str:
+        """Summarize segments concurrently, then reduce the partial summaries level by level."""
+        summaries = list(await asyncio.gather(*(self._summarize("map", s) for s in segment_lines(lines))))
+        while len(summaries) > 1:
+            groups = segment_lines(summaries, SUMMARY_REDUCE_TOKENS)
+            if len(groups) == len(summaries) and len(groups) > 1:
+                # No two partial summaries fit one reduce call; pair them up so every level shrinks
+                groups = ["\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+            summaries = list(await asyncio.gather(*(self._summarize("reduce", g) for g in groups)))
+        logger.info(f"Summarized {len(lines)} lines with {self.llm_calls} LLM calls")
+        return summaries[0] if summaries else ""
+
+
+async def summarize_lines(lines: List[str], model: str = LLM_MODEL, priority: str = INTERACTIVE) -> str:
+    return await ThreadSummarizer(model, priority=priority).summarize(lines)
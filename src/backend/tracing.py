@@ -0,0 +1,295 @@
+import atexit
+import json
+import multiprocessing.util
+import os
+import queue
+import re
+import secrets
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock, Thread
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from src.backend.logger import add_context_provider, get_logger
+from src.backend.metrics import QUERY_STAGE_SECONDS, INGEST_STAGE_SECONDS, TRACE_SPANS_DROPPED
+from src.backend.shared_state import get_shared_state
+
+logger = get_logger(__name__)
+
+TRACE_HEADER = "X-Trace-Id"
+TRACE_STORE_MAX_TRACES = int(os.getenv("TRACE_STORE_MAX_TRACES", "1000"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+# Finished spans waiting for the writer thread; beyond this new spans are dropped (and counted), so
+# recording a span never blocks the event loop
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+TRACE_WRITE_BATCH = int(os.getenv("TRACE_WRITE_BATCH", "200"))
+# When set, finished spans are appended to this file as OTLP/JSON lines (collector file receiver format).
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "vita-backend")
+# Requests to these paths are not traced.
+UNTRACED_PATHS = {"/metrics", "/health", "/health/live", "/health/ready", "/debug/traces", "/debug/startup"}
+
+STAGE_HISTOGRAMS = {"query": QUERY_STAGE_SECONDS, "ingest": INGEST_STAGE_SECONDS}
+
+_TRACE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+_trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+_span_id: ContextVar[Optional[str]] = ContextVar("span_id", default=None)
+
+
+def new_trace_id() -> str:
+    """32 hex characters, the W3C/OTLP trace ID format."""
+    return uuid.uuid4().hex
+
+
+def parse_trace_id(value: Optional[str]) -> str:
+    """Use an incoming trace ID if it is well-formed, otherwise start a new trace."""
+    value = (value or "").strip().lower().replace("-", "")
+    return value if _TRACE_ID_PATTERN.match(value) else new_trace_id()
+
+
+def current_context() -> Tuple[Optional[str], Optional[str]]:
+    """(trace_id, span_id) of the active span, for handing the trace to background work."""
+    return _trace_id.get(), _span_id.get()
+
+
+# Log records carry the trace they were logged in
+add_context_provider(lambda: {"trace_id": _trace_id.get()})
+
+
+class SpanStore:
+    """Keeps the spans of the most recent traces in shared state and optionally exports them to a file.
+
+    Spans recorded by API, ingestion and bot processes all land in the same store, so a trace that
+    continues in a worker process is complete when read back from any of them. record() only queues
+    the span; a background thread writes queued spans in batches.
+    """
+
+    def __init__(self, max_traces: int = TRACE_STORE_MAX_TRACES, export_path: str = TRACE_EXPORT_PATH):
+        self.max_traces = max_traces
+        self.export_path = export_path
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(TRACE_QUEUE_SIZE)
+        self._writer: Optional[Thread] = None
+        self._pid = 0
+        self._lock = Lock()
+
+    def record(self, span: Dict[str, Any]) -> None:
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            TRACE_SPANS_DROPPED.inc()
+
+    def flush(self) -> None:
+        """Wait until every span queued so far has been written."""
+        if self._writer is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        self.flush()
+        spans = get_shared_state().trace_spans(trace_id)
+        return summarize_trace(trace_id, spans) if spans else None
+
+    def slowest(self, limit: int = 10) -> List[Dict[str, Any]]:
+        self.flush()
+        return [trace for trace in map(self.get, get_shared_state().slowest_traces(limit)) if trace is not None]
+
+    def clear(self) -> None:
+        self.flush()
+        get_shared_state().clear_spans()
+
+    def _ensure_writer(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # The writer thread does not survive fork, and the queue may have been locked at the time
+                self._queue = queue.Queue(TRACE_QUEUE_SIZE)
+                self._writer = Thread(target=self._write_loop, name="span-writer", daemon=True)
+                self._writer.start()
+                self._pid = os.getpid()
+                # multiprocessing children skip atexit; their finalizers run on exit instead
+                multiprocessing.util.Finalize(None, self.flush, exitpriority=0)
+
+    def _write_loop(self) -> None:
+        spans_queue = self._queue
+        while True:
+            batch = [spans_queue.get()]
+            while len(batch) < TRACE_WRITE_BATCH:
+                try:
+                    batch.append(spans_queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                get_shared_state().record_spans(batch, self.max_traces, TRACE_MAX_SPANS)
+            except Exception as e:
+                logger.error(f"Failed to record {len(batch)} spans: {e}")
+            if self.export_path:
+                self._export(batch)
+            for _ in batch:
+                spans_queue.task_done()
+
+    def _export(self, spans: List[Dict[str, Any]]) -> None:
+        try:
+            with open(self.export_path, "a") as f:
+                f.writelines(json.dumps(to_otlp(span)) + "\n" for span in spans)
+        except Exception as e:
+            logger.error(f"Failed to export spans: {e}")
+
+
+def summarize_trace(trace_id: str, spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Trace duration (first span start to last span end), spans in start order and total time per stage."""
+    spans = sorted(spans, key=lambda s: s["start_ns"])
+    start = spans[0]["start_ns"]
+    end = max(s["end_ns"] for s in spans)
+    root = next((s for s in spans if s["parent_id"] is None), spans[0])
+    stages: Dict[str, float] = {}
+    for s in spans:
+        stages[s["name"]] = stages.get(s["name"], 0.0) + (s["end_ns"] - s["start_ns"]) / 1e6
+    return {
+        "trace_id": trace_id,
+        "name": root["name"],
+        "start": start / 1e9,
+        "duration_ms": (end - start) / 1e6,
+        "stages_ms": stages,
+        "spans": [
+            {
+                "name": s["name"],
+                "span_id": s["span_id"],
+                "parent_id": s["parent_id"],
+                "offset_ms": (s["start_ns"] - start) / 1e6,
+                "duration_ms": (s["end_ns"] - s["start_ns"]) / 1e6,
+                "status": s["status"],
+                "attributes": s["attributes"],
+            }
+            for s in spans
+        ],
+    }
+
+
+def to_otlp(span: Dict[str, Any]) -> Dict[str, Any]:
+    """Wrap one span in an OTLP/JSON ExportTraceServiceRequest."""
+    otlp_span = {
+        "traceId": span["trace_id"],
+        "spanId": span["span_id"],
+        "name": span["name"],
+        "kind": 1,
+        "startTimeUnixNano": str(span["start_ns"]),
+        "endTimeUnixNano": str(span["end_ns"]),
+        "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in span["attributes"].items()],
+        "status": {"code": 2 if span["status"] == "error" else 1},
+    }
+    if span["parent_id"]:
+        otlp_span["parentSpanId"] = span["parent_id"]
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [otlp_span]}],
+        }]
+    }
+
+
+span_store = SpanStore()
+atexit.register(span_store.flush)
+
+
+def record_span(name: str, trace_id: str, span_id: str, parent_id: Optional[str], start_ns: int,
+                end_ns: int, status: str = "ok", **attributes: Any) -> None:
+    span_store.record({
+        "trace_id": trace_id,
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "name": name,
+        "start_ns": start_ns,
+        "end_ns": end_ns,
+        "status": status,
+        "attributes": attributes,
+    })
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """Record a child span of the active span. Does nothing outside a trace."""
+    trace_id = _trace_id.get()
+    if trace_id is None:
+        yield
+        return
+    parent_id = _span_id.get()
+    span_id = secrets.token_hex(8)
+    token = _span_id.set(span_id)
+    start_ns = time.time_ns()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _span_id.reset(token)
+        record_span(name, trace_id, span_id, parent_id, start_ns, time.time_ns(), status, **attributes)
+
+
+@contextmanager
+def continue_trace(trace_id: Optional[str], parent_id: Optional[str] = None) -> Iterator[None]:
+    """Make spans recorded in this block children of parent_id in trace_id (e.g. in a background task)."""
+    trace_token = _trace_id.set(trace_id)
+    span_token = _span_id.set(parent_id)
+    try:
+        yield
+    finally:
+        _span_id.reset(span_token)
+        _trace_id.reset(trace_token)
+
+
+@contextmanager
+def stage(kind: str, name: str) -> Iterator[None]:
+    """Time a pipeline stage into its latency histogram and record it as a span."""
+    start = time.perf_counter()
+    try:
+        with span(f"{kind}.{name}"):
+            yield
+    finally:
+        STAGE_HISTOGRAMS[kind].observe(time.perf_counter() - start, stage=name)
+
+
+class TracingMiddleware:
+    """ASGI middleware that opens a trace per HTTP request.
+
+    The trace ID comes from the X-Trace-Id request header (or is generated) and is echoed in the
+    response. The request span ends when the response body has been sent; background tasks that
+    run afterwards add their spans to the same trace.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in UNTRACED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        header = TRACE_HEADER.lower().encode()
+        raw = next((v for k, v in scope.get("headers", []) if k == header), None)
+        trace_id = parse_trace_id(raw.decode("latin-1") if raw else None)
+        span_id = secrets.token_hex(8)
+        start_ns = time.time_ns()
+        state = {"status_code": 500, "done": False}
+
+        def finish(status: str) -> None:
+            if not state["done"]:
+                state["done"] = True
+                record_span(f"{scope['method']} {scope['path']}", trace_id, span_id, None, start_ns, time.time_ns(),
+                            status, status_code=state["status_code"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status_code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(header, trace_id.encode())]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish("error" if state["status_code"] >= 500 else "ok")
+
+        with continue_trace(trace_id, span_id):
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                finish("error")
@@ -1,20 +1,19 @@
 # Utility functions will be implemented here 
 
 import re
-import spacy
 from typing import List, Dict, Any
 
-nlp = spacy.blank("en")
-
 EMOJI_PATTERN = re.compile(r"[\U00010000-\U0010ffff]+", flags=re.UNICODE)
 PII_PATTERN = re.compile(r"\b(\d{3}[-.]?\d{2}[-.]?\d{4}|\d{16}|[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,})\b")
+NOISE_PATTERN = re.compile(r"\+1|^/\w+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
 
 
 def clean_text(text: str) -> str:
     """Remove emojis, spam, and bot commands from text."""
     text = EMOJI_PATTERN.sub("", text)
-    text = re.sub(r"\+1|^/\w+", "", text)  # Remove '+1' and bot commands
-    text = re.sub(r"\s+", " ", text).strip()
+    text = NOISE_PATTERN.sub("", text)  # Remove '+1' and bot commands
+    text = WHITESPACE_PATTERN.sub(" ", text).strip()
     return text
 
 def redact_pii(text: str) -> str:
@@ -33,4 +32,4 @@ def split_text_for_embedding(text: str, max_length: int = 4000, overlap: int = 2
         if end == text_length:
             break
         start = end - overlap  # overlap for context
-    return chunks 
\ No newline at end of file
+    return chunks
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+from src.backend.doc_store import get_doc_store
+from src.backend.embedding import PINECONE_POOL_SIZE, active_target, index
+from src.backend.logger import get_logger
+from src.backend.metrics import UPSERT_BATCH, VECTOR_STORE_ERRORS, VECTOR_STORE_SECONDS
+
+logger = get_logger(__name__)
+
+UPSERT_BATCH_SIZE = 100
+DELETE_BATCH_SIZE = 1000
+# Pinecone rejects upsert requests over 2 MB; batches are also cut at this estimated JSON size
+UPSERT_MAX_BATCH_BYTES = int(os.getenv("UPSERT_MAX_BATCH_BYTES", str(1_500_000)))
+# Upsert batches of one call sent at once
+UPSERT_PARALLELISM = int(os.getenv("UPSERT_PARALLELISM", "4"))
+# Index calls are blocking HTTP round trips; they run in this many threads, off the event loop
+VECTOR_STORE_THREADS = int(os.getenv("VECTOR_STORE_THREADS", str(PINECONE_POOL_SIZE)))
+VECTOR_STORE_TIMEOUT_SECONDS = float(os.getenv("VECTOR_STORE_TIMEOUT_SECONDS", "10"))
+# Rough JSON size of one vector component (a float32 printed in full)
+_VALUE_BYTES = 20
+
+_executor = ThreadPoolExecutor(max_workers=VECTOR_STORE_THREADS, thread_name_prefix="vector-store")
+
+
+class VectorStoreTimeout(TimeoutError):
+    """An index call did not finish within its timeout."""
+
+
+async def _run(operation: str, call: Callable[[], Any], timeout: float) -> Any:
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        # The grace lets the client raise its own timeout first
+        return await asyncio.wait_for(
+            loop.run_in_executor(_executor, contextvars.copy_context().run, call), timeout + 1
+        )
+    except asyncio.TimeoutError:
+        VECTOR_STORE_ERRORS.inc(operation=operation, reason="timeout")
+        raise VectorStoreTimeout(f"Vector store {operation} timed out after {timeout:.0f}s")
+    except Exception:
+        VECTOR_STORE_ERRORS.inc(operation=operation, reason="error")
+        raise
+    finally:
+        VECTOR_STORE_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+
+async def index_call(operation: str, *args: Any, timeout: float = VECTOR_STORE_TIMEOUT_SECONDS, **kwargs: Any) -> Any:
+    """Run index.<operation>(*args, **kwargs) in the vector store pool, with a timeout and latency metrics.
+
+    The call runs in the caller's context, so it is scoped to the current guild's namespace and
+    logged for a running re-index exactly as a direct call would be. The timeout is also passed
+    to the HTTP request, so a hung call does not keep holding a pool thread.
+    """
+    return await _run(operation, partial(getattr(index, operation), *args, _request_timeout=timeout, **kwargs), timeout)
+
+
+def message_vector_prefix(message_id: str) -> str:
+    """ID prefix shared by every chunk vector of a single message."""
+    return f"{message_id}#"
+
+def message_vector_id(message_id: str, chunk_index: int) -> str:
+    """Deterministic vector ID for a chunk of a single message."""
+    return f"{message_vector_prefix(message_id)}{chunk_index}"
+
+def thread_vector_prefix(thread_id: str) -> str:
+    """ID prefix shared by every chunk vector of an ingested thread document."""
+    return f"thread:{thread_id}#"
+
+def thread_vector_id(thread_id: str, chunk_index: int) -> str:
+    """Deterministic vector ID for a chunk of an ingested thread document."""
+    return f"{thread_vector_prefix(thread_id)}{chunk_index}"
+
+async def list_vector_ids(prefix: str) -> List[str]:
+    """List the IDs of all vectors whose ID starts with prefix."""
+    timeout = VECTOR_STORE_TIMEOUT_SECONDS
+    # index.list fetches its pages lazily, so they are read in the pool too
+    return await _run("list", lambda: [i for page in index.list(prefix=prefix, _request_timeout=timeout) for i in page],
+                      timeout)
+
+async def message_vector_ids(message_ids: Iterable[str]) -> List[str]:
+    """List the IDs of every chunk vector stored for the given messages."""
+    pages = await asyncio.gather(*(list_vector_ids(message_vector_prefix(m)) for m in message_ids))
+    return [i for page in pages for i in page]
+
+def _vector_bytes(vector: Dict[str, Any]) -> int:
+    return len(vector["id"]) + _VALUE_BYTES * len(vector["values"]) + len(json.dumps(vector.get("metadata") or {}, default=str))
+
+def upsert_batches(vectors: List[Dict[str, Any]], batch_size: int = UPSERT_BATCH_SIZE,
+                   max_bytes: int = UPSERT_MAX_BATCH_BYTES) -> Iterator[List[Dict[str, Any]]]:
+    """Split vectors into batches of at most batch_size vectors and about max_bytes of request body."""
+    batch: List[Dict[str, Any]] = []
+    size = 0
+    for vector in vectors:
+        vector_size = _vector_bytes(vector)
+        if batch and (len(batch) >= batch_size or size + vector_size > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(vector)
+        size += vector_size
+    if batch:
+        yield batch
+
+async def upsert_vectors(vectors: List[Dict[str, Any]], batch_size: int = UPSERT_BATCH_SIZE,
+                         parallelism: int = UPSERT_PARALLELISM) -> None:
+    """Upsert vectors in size-bounded batches, up to `parallelism` batches in flight at once."""
+    slots = asyncio.Semaphore(parallelism)
+
+    async def send(batch: List[Dict[str, Any]]) -> None:
+        async with slots:
+            UPSERT_BATCH.observe(len(batch))
+            await index_call("upsert", vectors=batch)
+
+    await asyncio.gather(*(send(batch) for batch in upsert_batches(vectors, batch_size)))
+
+async def delete_vectors(ids: List[str], batch_size: int = DELETE_BATCH_SIZE) -> int:
+    """Delete vectors by ID in batches and return how many IDs were deleted."""
+    await asyncio.gather(*(index_call("delete", ids=ids[start:start + batch_size])
+                           for start in range(0, len(ids), batch_size)))
+    get_doc_store().delete(active_target()["index"], ids)
+    if ids:
+        logger.info(f"Deleted {len(ids)} vectors")
+    return len(ids)
@@ -0,0 +1,214 @@
+import datetime
+import json
+import os
+import sqlite3
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from src.backend.chunking import count_tokens
+
+WINDOW_STATE_PATH = os.getenv("WINDOW_STATE_PATH", "conversation_windows.db")
+WINDOW_GAP_MINUTES = int(os.getenv("WINDOW_GAP_MINUTES", "10"))
+WINDOW_MAX_TOKENS = int(os.getenv("WINDOW_MAX_TOKENS", "400"))
+# Messages longer than this are embedded on their own instead of being packed into a window.
+WINDOW_MESSAGE_MAX_TOKENS = int(os.getenv("WINDOW_MESSAGE_MAX_TOKENS", "200"))
+
+
+# Messages packed into windows are registered for near-duplicate detection under their own keys,
+# since one window vector holds many messages
+_WINDOW_MESSAGE_KEY_PREFIX = "window-message:"
+
+
+def window_message_key(message_id: str) -> str:
+    return f"{_WINDOW_MESSAGE_KEY_PREFIX}{message_id}"
+
+
+def window_message_of(key: str) -> Optional[str]:
+    """Message ID of a window_message_key, or None for any other key."""
+    return key[len(_WINDOW_MESSAGE_KEY_PREFIX):] if key.startswith(_WINDOW_MESSAGE_KEY_PREFIX) else None
+
+
+def conversation_key(channel_id: str, thread_id: Optional[str]) -> str:
+    """Messages are packed per channel, or per thread when they belong to one."""
+    return f"{channel_id}:{thread_id or ''}"
+
+
+def window_line(message: Dict[str, Any]) -> str:
+    return f"{message['user_id']}: {message['text']}"
+
+
+def render_window(window: Dict[str, Any]) -> Tuple[str, List[str]]:
+    """Render a window to chunk text plus "start:end" character offsets of each message."""
+    parts: List[str] = []
+    offsets: List[str] = []
+    pos = 0
+    for message in window["messages"]:
+        line = window_line(message)
+        offsets.append(f"{pos}:{pos + len(line)}")
+        parts.append(line)
+        pos += len(line) + 1
+    return "\n".join(parts), offsets
+
+
+def _parse_ts(timestamp: str) -> datetime.datetime:
+    ts = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return ts if ts.tzinfo else ts.replace(tzinfo=datetime.timezone.utc)
+
+
+def _new_window(conversation: str, message: Dict[str, Any], channel_id: str, thread_id: Optional[str]) -> Dict[str, Any]:
+    return {
+        "window_id": f"win:{conversation}:{message['message_id']}",
+        "conversation": conversation,
+        "channel_id": channel_id,
+        "thread_id": thread_id or "",
+        "messages": [],
+        "tokens": 0,
+    }
+
+
+def pack_messages(
+    open_window: Optional[Dict[str, Any]],
+    messages: Iterable[Dict[str, Any]],
+    channel_id: str,
+    thread_id: Optional[str],
+    gap_minutes: int = WINDOW_GAP_MINUTES,
+    max_tokens: int = WINDOW_MAX_TOKENS,
+) -> List[Dict[str, Any]]:
+    """Pack consecutive messages of one conversation into token-bounded windows.
+
+    `open_window` is the conversation's last window, which messages within the gap of its last
+    message may extend; earlier windows are never reopened. Returns every window that changed (the extended open window
+    first, if any), in order; the last one is the new open window.
+    """
+    conversation = conversation_key(channel_id, thread_id)
+    gap = datetime.timedelta(minutes=gap_minutes)
+    window = open_window
+    touched: List[Dict[str, Any]] = []
+    for message in sorted(messages, key=lambda m: _parse_ts(m["timestamp"])):
+        tokens = count_tokens(window_line(message)) + 1
+        if window is not None and window["messages"]:
+            last_ts = _parse_ts(window["messages"][-1]["timestamp"])
+            fits = window["tokens"] + tokens <= max_tokens
+            # Messages older than the open window (e.g. a newest-first backfill) never join it either
+            if not fits or abs(_parse_ts(message["timestamp"]) - last_ts) > gap:
+                window = None
+        if window is None:
+            window = _new_window(conversation, message, channel_id, thread_id)
+        if not touched or touched[-1] is not window:
+            touched.append(window)
+        window["messages"].append(message)
+        window["tokens"] += tokens
+    return touched
+
+
+class WindowStore:
+    """SQLite-backed window state: the open window per conversation and message -> window index."""
+
+    def __init__(self, path: str = WINDOW_STATE_PATH):
+        self.path = path
+        self._lock = Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid = 0
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS windows (window_id TEXT PRIMARY KEY, conversation TEXT, data TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS open_windows (conversation TEXT PRIMARY KEY, window_id TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS window_messages (message_id TEXT PRIMARY KEY, window_id TEXT)"
+            )
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per process: worker processes share the database file but never a connection
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._pid = os.getpid()
+        return self._db
+
+    def open_window(self, conversation: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT w.data FROM open_windows o JOIN windows w ON w.window_id = o.window_id WHERE o.conversation = ?",
+                (conversation,),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def windows_for_messages(self, message_ids: Iterable[str]) -> List[Dict[str, Any]]:
+        ids = list(message_ids)
+        if not ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT DISTINCT w.data FROM window_messages m JOIN windows w ON w.window_id = m.window_id "
+                f"WHERE m.message_id IN ({','.join('?' * len(ids))})",
+                ids,
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def save(self, windows: List[Dict[str, Any]], open_window: Optional[Dict[str, Any]] = None) -> None:
+        """Persist changed windows (and optionally the conversation's new open window) atomically."""
+        with self._lock, self._conn:
+            for window in windows:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO windows (window_id, conversation, data) VALUES (?, ?, ?)",
+                    (window["window_id"], window["conversation"], json.dumps(window)),
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO window_messages (message_id, window_id) VALUES (?, ?)",
+                    [(m["message_id"], window["window_id"]) for m in window["messages"]],
+                )
+            if open_window is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO open_windows (conversation, window_id) VALUES (?, ?)",
+                    (open_window["conversation"], open_window["window_id"]),
+                )
+
+    def remove_messages(self, message_ids: Iterable[str]) -> None:
+        ids = list(message_ids)
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM window_messages WHERE message_id = ?", [(i,) for i in ids])
+
+    def delete_windows(self, window_ids: Iterable[str]) -> None:
+        ids = list(window_ids)
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM windows WHERE window_id = ?", [(i,) for i in ids])
+            self._conn.executemany("DELETE FROM open_windows WHERE window_id = ?", [(i,) for i in ids])
+
+
+_store: Optional[WindowStore] = None
+
+
+def get_window_store() -> WindowStore:
+    global _store
+    if _store is None:
+        _store = WindowStore()
+    return _store
+
+
+def apply_message_changes(
+    windows: List[Dict[str, Any]], edited: Dict[str, str], deleted: Iterable[str]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Apply edited texts / deletions to stored windows.
+
+    Returns (changed, emptied): windows that must be re-embedded and windows left without messages.
+    Edited windows are not re-split, so an edit that lengthens a message may push its window past
+    WINDOW_MAX_TOKENS.
+    """
+    deleted = set(deleted)
+    changed: List[Dict[str, Any]] = []
+    emptied: List[Dict[str, Any]] = []
+    for window in windows:
+        messages = []
+        for message in window["messages"]:
+            if message["message_id"] in deleted:
+                continue
+            if message["message_id"] in edited:
+                message = {**message, "text": edited[message["message_id"]]}
+            messages.append(message)
+        window = {**window, "messages": messages}
+        window["tokens"] = sum(count_tokens(window_line(m)) + 1 for m in messages)
+        (changed if messages else emptied).append(window)
+    return changed, emptied
@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+import os
+import signal
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+from src.backend.logger import get_logger
+from src.backend.metrics import publish_snapshots, track_task
+from src.backend.shared_state import LEASE_TTL_SECONDS, OWNER_ID, LeaseLost, get_shared_state, keep_renewed
+from src.backend.sharding import guild_scope
+from src.backend.tracing import continue_trace, span
+
+logger = get_logger(__name__)
+
+INGEST_WORKER_CONCURRENCY = int(os.getenv("INGEST_WORKER_CONCURRENCY", "4"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+
+_job_attempt: ContextVar[int] = ContextVar("job_attempt", default=0)
+
+
+def job_attempt() -> int:
+    """Attempt number of the queued job the current task runs as; 0 outside ingestion workers.
+
+    Tasks re-raise failures inside a job, so that it is retried (up to JOB_MAX_ATTEMPTS) and
+    only dead-lettered by the worker once it is out of attempts.
+    """
+    return _job_attempt.get()
+
+
+async def run_jobs(stop: asyncio.Event, shard: Optional[int] = None) -> None:
+    """Claim and run queued ingestion jobs (of one shard's guilds, if given) until stop is set; the job in hand is always finished.
+
+    A job's lease is renewed while it runs; if another worker has claimed it meanwhile, it is abandoned.
+    """
+    from src.backend.admission import admission
+    from src.backend.api import BULK_JOB_PRIORITY, JOB_HANDLERS, request_guild
+    from src.backend.ingestion import log_to_dlq
+
+    state = get_shared_state()
+    owner = f"{OWNER_ID}-{uuid.uuid4().hex[:8]}"
+    while not stop.is_set():
+        # While interactive latency is at risk only non-bulk jobs are claimed; bulk ones stay queued
+        min_priority = BULK_JOB_PRIORITY + 1 if admission.under_pressure() else BULK_JOB_PRIORITY
+        job = await asyncio.to_thread(state.claim_job, LEASE_TTL_SECONDS, owner, min_priority, shard)
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        func, model = JOB_HANDLERS[job["kind"]]
+        token = _job_attempt.set(job["attempts"])
+        try:
+            req = model(**job["payload"])
+            async with keep_renewed(lambda: state.renew_job(job["id"], owner), LEASE_TTL_SECONDS, f"job {job['id']}"):
+                with continue_trace(*(job["context"] or [None, None])), span(f"task.{job['kind']}"), track_task(job["kind"]), \
+                        guild_scope(request_guild(req)):
+                    await func(req)
+            state.complete_job(job["id"])
+        except LeaseLost as e:
+            logger.warning(f"{e}; abandoned job {job['id']} ({job['kind']}) to the worker that claimed it")
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}: {e}")
+            if not state.fail_job(job["id"], str(e)):
+                log_to_dlq({
+                    "original_request": job["payload"],
+                    "error_message": str(e),
+                    "failed_at_step": f"job_{job['kind']}",
+                    "timestamp": datetime.datetime.utcnow().isoformat()
+                })
+        finally:
+            _job_attempt.reset(token)
+
+
+async def serve(concurrency: int = INGEST_WORKER_CONCURRENCY, shard: Optional[int] = None) -> None:
+    """Run an ingestion worker: `concurrency` job loops sharing one event loop, drained on SIGTERM/SIGINT."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    routed = f" for guild shard {shard}" if shard is not None else ""
+    logger.info(f"Ingestion worker {os.getpid()} started with {concurrency} job loops{routed}")
+    publisher = asyncio.create_task(publish_snapshots())
+    await asyncio.gather(*(run_jobs(stop, shard) for _ in range(concurrency)))
+    publisher.cancel()
+    logger.info(f"Ingestion worker {os.getpid()} drained and stopped")
+
+
+def main(shard: Optional[int] = None) -> None:
+    asyncio.run(serve(shard=shard))
+
+
+if __name__ == "__main__":
+    main()
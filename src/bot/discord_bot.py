@@ -7,16 +7,27 @@ from discord import app_commands, Interaction
 from dotenv import load_dotenv
 import aiohttp
 import asyncio
-from typing import Any, Dict, List, Optional
+import signal
+from typing import Any, Dict, List, Optional, Tuple
 from src.backend.utils import clean_text, redact_pii
 from src.backend.logger import get_logger
+from src.backend.sharding import pick_for_guild
+from src.backend.tracing import TRACE_HEADER, new_trace_id
+from src.bot.message_cache import ThreadMessageCache
 from discord.ui import View, Button
 
 load_dotenv()
 
 DISCORD_BOT_TOKEN: str = os.getenv("DISCORD_BOT_TOKEN", "")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+# Backends to spread guilds over (comma-separated); each guild's requests always go to the same one
+BACKEND_URLS = [url.strip() for url in os.getenv("BACKEND_URLS", BACKEND_URL).split(",") if url.strip()]
+# Gateway shards: unset lets Discord recommend a count; DISCORD_SHARD_IDS runs a subset in this process
+DISCORD_SHARD_COUNT = int(os.getenv("DISCORD_SHARD_COUNT", "0")) or None
+DISCORD_SHARD_IDS = [int(i) for i in os.getenv("DISCORD_SHARD_IDS", "").split(",") if i.strip()] or None
 BACKEND_API_KEY = os.getenv("BACKEND_API_KEY", "your_secret_api_key_here")
+# Attempts for a bulk backend call the backend sheds (503/429) while it serves interactive queries
+BULK_RETRY_ATTEMPTS = int(os.getenv("BULK_RETRY_ATTEMPTS", "6"))
 logger = get_logger(__name__)
 
 intents = discord.Intents.default()
@@ -27,7 +38,7 @@ intents.members = True
 intents.reactions = True
 intents.typing = False
 
-class MyBot(commands.Bot):
+class MyBot(commands.AutoShardedBot):
     def __init__(self, *args: Any, **kwargs: Any):
         super().__init__(*args, **kwargs)
         self.http_session: Optional[aiohttp.ClientSession] = None
@@ -39,16 +50,36 @@ class MyBot(commands.Bot):
             for guild in self.guilds:
                 self.tree.copy_global_to(guild=guild)
                 await self.tree.sync(guild=guild)
-            print("Slash commands synced.")
+            logger.info("Slash commands synced.")
         except Exception as e:
-            print(f"Error syncing commands: {e}")
+            logger.error(f"Error syncing commands: {e}")
 
     async def close(self) -> None:
         if self.http_session:
             await self.http_session.close()
         await super().close()
 
-bot = MyBot(command_prefix="!", intents=intents)
+bot = MyBot(command_prefix="!", intents=intents, shard_count=DISCORD_SHARD_COUNT, shard_ids=DISCORD_SHARD_IDS)
+thread_cache = ThreadMessageCache()
+
+def backend_url(guild_id: Optional[Any]) -> str:
+    """Backend serving a guild (see BACKEND_URLS)."""
+    return pick_for_guild(str(guild_id) if guild_id else None, BACKEND_URLS)
+
+def backend_headers(trace_id: Optional[str] = None) -> Dict[str, str]:
+    """Headers for a backend call. Each interaction or gateway event gets its own trace ID."""
+    return {"X-API-Key": BACKEND_API_KEY, TRACE_HEADER: trace_id or new_trace_id()}
+
+async def post_bulk(session: aiohttp.ClientSession, path: str, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """POST bulk work to the guild's backend, backing off as long as it is shed (honouring Retry-After)."""
+    for attempt in range(BULK_RETRY_ATTEMPTS):
+        async with session.post(f"{backend_url(payload.get('guild_id'))}{path}", json=payload, headers=backend_headers()) as resp:
+            if resp.status not in (429, 503) or attempt == BULK_RETRY_ATTEMPTS - 1:
+                return resp.status, (await resp.json() if resp.status == 200 else {})
+            retry_after = float(resp.headers.get("Retry-After", 2 ** attempt))
+        logger.info(f"Backend busy, retrying {path} in {retry_after:.0f}s")
+        await asyncio.sleep(retry_after)
+    return 503, {}
 
 def get_user_roles(member: discord.abc.User) -> List[str]:
     """Get a list of role names for a user if available."""
@@ -56,11 +87,61 @@ def get_user_roles(member: discord.abc.User) -> List[str]:
         return [role.name for role in member.roles if role.name != "@everyone"]
     return []
 
+def message_payload(m: discord.Message, thread_id: Optional[str] = None) -> Dict[str, Any]:
+    """Build the backend ingestion payload for a message."""
+    if thread_id is None and m.thread:
+        thread_id = str(m.thread.id)
+    return {
+        "message_id": str(m.id),
+        "channel_id": str(m.channel.id),
+        "user_id": str(m.author.id),
+        "content": m.content,
+        "timestamp": m.created_at.isoformat(),
+        "attachments": [a.url for a in m.attachments],
+        "thread_id": thread_id,
+        "roles": get_user_roles(m.author),
+        "guild_id": str(m.guild.id) if m.guild else None,
+    }
+
+async def get_thread_messages(thread: Any) -> List[Dict[str, Any]]:
+    """Return a thread's message payloads, walking the full history only on a cache miss."""
+    thread_id = str(thread.id)
+    messages = thread_cache.get(thread_id)
+    if messages is not None:
+        return messages
+    messages = []
+    async for m in thread.history(limit=None, oldest_first=True):
+        messages.append(message_payload(m, thread_id))
+    thread_cache.put(thread_id, messages)
+    return messages
+
+async def send_thread_for_ingestion(thread: Any) -> None:
+    """Send a thread's full message list to the backend for (re-)ingestion."""
+    messages = await get_thread_messages(thread)
+    guild_id = str(thread.guild.id) if getattr(thread, "guild", None) else None
+    payload = {"thread_id": str(thread.id), "parent_message_id": str(thread.parent_id) if hasattr(thread, "parent_id") else None,
+               "messages": messages, "guild_id": guild_id}
+    try:
+        async with bot.http_session.post(f"{backend_url(guild_id)}/ingest_thread", json=payload, headers=backend_headers()) as resp:
+            if resp.status not in (200, 202):
+                logger.error(f"Thread ingestion failed: {resp.status}, {await resp.text()}")
+    except Exception as e:
+        logger.error(f"Error sending thread to backend: {e}")
+
+async def send_index_changes(changes: List[Dict[str, Any]], guild_id: Optional[int]) -> None:
+    """Forward a guild's message edits/deletes to the backend so it can update only the affected vectors."""
+    payload = {"changes": changes, "guild_id": str(guild_id) if guild_id else None}
+    try:
+        async with bot.http_session.post(f"{backend_url(guild_id)}/index_changes", json=payload, headers=backend_headers()) as resp:
+            if resp.status != 200:
+                logger.error(f"Index change sync failed: {resp.status}, {await resp.text()}")
+    except Exception as e:
+        logger.error(f"Error sending index changes to backend: {e}")
+
 @bot.event
 async def on_ready() -> None:
     """Event handler for when the bot is ready."""
-    print(f"Logged in as {bot.user} (ID: {bot.user.id})")
-    print("------")
+    logger.info(f"Logged in as {bot.user} (ID: {bot.user.id}) on {len(bot.shards)} shard(s) of {bot.shard_count}")
 
 @bot.event
 async def on_message(message: discord.Message) -> None:
@@ -71,45 +152,66 @@ async def on_message(message: discord.Message) -> None:
     # If the message is in a thread, fetch the whole thread and send to /ingest_thread
     if message.thread or isinstance(message.channel, discord.Thread):
         thread = message.thread or message.channel
-        messages = []
-        async for m in thread.history(limit=None, oldest_first=True):
-            messages.append({
-                "message_id": str(m.id),
-                "channel_id": str(m.channel.id),
-                "user_id": str(m.author.id),
-                "content": m.content,
-                "timestamp": m.created_at.isoformat(),
-                "attachments": [a.url for a in m.attachments],
-                "thread_id": str(thread.id),
-                "roles": get_user_roles(m.author),
-            })
-        payload = {"thread_id": str(thread.id), "parent_message_id": str(thread.parent_id) if hasattr(thread, "parent_id") else None, "messages": messages}
-        try:
-            async with bot.http_session.post(f"{BACKEND_URL}/ingest_thread", json=payload, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
-                if resp.status != 200:
-                    logger.error(f"Thread ingestion failed: {resp.status}, {await resp.text()}")
-        except Exception as e:
-            logger.error(f"Error sending thread to backend: {e}")
+        if message.channel.id == thread.id:
+            thread_cache.append(str(thread.id), message_payload(message, str(thread.id)))
+        await send_thread_for_ingestion(thread)
         return
 
     # Otherwise, single message ingestion as before
-    ingest_payload = {
-        "message_id": str(message.id),
-        "channel_id": str(message.channel.id),
-        "user_id": str(message.author.id),
-        "content": message.content,
-        "timestamp": message.created_at.isoformat(),
-        "attachments": [a.url for a in message.attachments],
-        "thread_id": str(message.thread.id) if message.thread else None,
-        "roles": get_user_roles(message.author),
-    }
+    ingest_payload = message_payload(message)
     try:
-        async with bot.http_session.post(f"{BACKEND_URL}/ingest", json=ingest_payload, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
+        async with bot.http_session.post(f"{backend_url(message.guild and message.guild.id)}/ingest", json=ingest_payload, headers=backend_headers()) as resp:
             if resp.status != 200:
                 logger.error(f"Ingestion failed: {resp.status}, {await resp.text()}")
     except Exception as e:
         logger.error(f"Error sending to backend: {e}")
 
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent) -> None:
+    """Keep cached thread messages and the index in sync with edits."""
+    message = payload.message
+    thread_cache.update(
+        str(payload.channel_id),
+        str(payload.message_id),
+        content=message.content,
+        attachments=[a.url for a in message.attachments],
+    )
+    # Embed unfurls also arrive as edits; only content/attachment changes affect the index
+    if message.author.bot or not bot.http_session or not ({"content", "attachments"} & payload.data.keys()):
+        return
+    if isinstance(message.channel, discord.Thread):
+        await send_thread_for_ingestion(message.channel)
+    else:
+        await send_index_changes([{"action": "edit", "message": message_payload(message)}], payload.guild_id)
+
+async def handle_deleted_messages(channel_id: int, message_ids: List[str], guild_id: Optional[int]) -> None:
+    """Drop deleted messages from the thread cache and the index."""
+    thread_cache.remove(str(channel_id), message_ids)
+    if not bot.http_session:
+        return
+    channel = bot.get_channel(channel_id)
+    if isinstance(channel, discord.Thread):
+        await send_thread_for_ingestion(channel)
+    else:
+        await send_index_changes([{"action": "delete", "message_ids": message_ids}], guild_id)
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent) -> None:
+    """Event handler for a single deleted message."""
+    await handle_deleted_messages(payload.channel_id, [str(payload.message_id)], payload.guild_id)
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent) -> None:
+    """Event handler for bulk-deleted messages; forwarded as one change event."""
+    await handle_deleted_messages(payload.channel_id, [str(i) for i in payload.message_ids], payload.guild_id)
+
+@bot.event
+async def on_raw_thread_delete(payload: discord.RawThreadDeleteEvent) -> None:
+    """Forget a deleted thread and remove it from the index."""
+    thread_cache.invalidate(str(payload.thread_id))
+    if bot.http_session:
+        await send_index_changes([{"action": "delete_thread", "thread_id": str(payload.thread_id)}], payload.guild_id)
+
 class CommandCog(commands.Cog):
     def __init__(self, bot: MyBot):
         self.bot = bot
@@ -126,14 +228,16 @@ class CommandCog(commands.Cog):
         payload = {
             "user_id": str(interaction.user.id),
             "channel_id": str(interaction.channel.id),
+            "guild_id": str(interaction.guild_id) if interaction.guild_id else None,
             "roles": user_roles,
             "question": question,
             "top_k": 5
         }
         
         assert self.bot.http_session is not None
+        trace_id = new_trace_id()
         try:
-            async with self.bot.http_session.post(f"{BACKEND_URL}/query", json=payload, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
+            async with self.bot.http_session.post(f"{backend_url(interaction.guild_id)}/query", json=payload, headers=backend_headers(trace_id)) as resp:
                 if resp.status == 200:
                     data = await resp.json()
                     answer = data.get("answer", "No answer could be generated.")
@@ -150,21 +254,26 @@ class CommandCog(commands.Cog):
                     )
                     embed.add_field(name="Confidence", value=f"{confidence:.2%}", inline=True)
                     embed.add_field(name="Citations", value=citation_text, inline=False)
+                    embed.set_footer(text=f"Trace: {trace_id}")
                     
                     view = FeedbackView(question, answer, citations, self.bot)
                     await interaction.followup.send(embed=embed, view=view)
+                elif resp.status == 429:
+                    retry_after = resp.headers.get("Retry-After", "a few")
+                    await interaction.followup.send(f"I'm answering a lot of questions right now. Please try again in {retry_after} seconds.")
                 else:
                     error_text = await resp.text()
-                    await interaction.followup.send(f"Sorry, there was an error processing your question. ({resp.status}):\n`{error_text}`")
+                    await interaction.followup.send(f"Sorry, there was an error processing your question. ({resp.status}, trace {trace_id}):\n`{error_text}`")
         except Exception as e:
+            logger.error(f"/ask failed (trace {trace_id}): {e}")
             await interaction.followup.send(f"An unexpected error occurred while contacting the backend: {e}")
 
     @app_commands.command(name="delete", description="Delete your own message from the knowledge base.")
     async def delete(self, interaction: Interaction, message_id: str) -> None:
         """Allows a user to delete their own message from the knowledge base."""
         await interaction.response.defer()
-        payload = {"user_id": str(interaction.user.id), "message_id": message_id}
-        async with self.bot.http_session.post(f"{BACKEND_URL}/delete", json=payload, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
+        payload = {"user_id": str(interaction.user.id), "message_id": message_id, "guild_id": str(interaction.guild_id) if interaction.guild_id else None}
+        async with self.bot.http_session.post(f"{backend_url(interaction.guild_id)}/delete", json=payload, headers=backend_headers()) as resp:
             if resp.status == 200:
                 await interaction.followup.send("Message deleted from knowledge base.")
             else:
@@ -174,8 +283,8 @@ class CommandCog(commands.Cog):
     async def redact(self, interaction: Interaction, message_id: str) -> None:
         """Allows a user to redact their own message in the knowledge base."""
         await interaction.response.defer()
-        payload = {"user_id": str(interaction.user.id), "message_id": message_id}
-        async with self.bot.http_session.post(f"{BACKEND_URL}/redact", json=payload, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
+        payload = {"user_id": str(interaction.user.id), "message_id": message_id, "guild_id": str(interaction.guild_id) if interaction.guild_id else None}
+        async with self.bot.http_session.post(f"{backend_url(interaction.guild_id)}/redact", json=payload, headers=backend_headers()) as resp:
             if resp.status == 200:
                 await interaction.followup.send("Message redacted in knowledge base.")
             else:
@@ -191,7 +300,7 @@ class CommandCog(commands.Cog):
             "feedback": feedback,
             "comment": comment
         }
-        async with self.bot.http_session.post(f"{BACKEND_URL}/feedback", json=payload, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
+        async with self.bot.http_session.post(f"{backend_url(interaction.guild_id)}/feedback", json=payload, headers=backend_headers()) as resp:
             if resp.status == 200:
                 await interaction.followup.send("Feedback logged. Thank you!")
             else:
@@ -228,41 +337,30 @@ class CommandCog(commands.Cog):
             
             try:
                 message_batch = []
-                async for message in channel.history(limit=None):
+                async for message in channel.history(limit=None, oldest_first=True):
                     if message.author.bot or (not message.content and not message.attachments):
                         continue
                     
-                    message_batch.append({
-                        "message_id": str(message.id),
-                        "channel_id": str(message.channel.id),
-                        "user_id": str(message.author.id),
-                        "content": message.content,
-                        "timestamp": message.created_at.isoformat(),
-                        "attachments": [a.url for a in message.attachments],
-                        "thread_id": str(message.thread.id) if message.thread else None,
-                        "roles": get_user_roles(message.author),
-                    })
+                    message_batch.append(message_payload(message))
 
                     if len(message_batch) >= 50:
-                        async with self.bot.http_session.post(f"{BACKEND_URL}/batch_ingest", json={"messages": message_batch}, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
-                            if resp.status == 200:
-                                result = await resp.json()
-                                total_ingested += result.get("processed", 0)
-                                total_failed += result.get("failed", 0)
-                            else:
-                                total_failed += len(message_batch)
-                                logger.error(f"Batch failed for #{channel.name} with status {resp.status}")
-                        message_batch = []
-                
-                if message_batch:
-                    async with self.bot.http_session.post(f"{BACKEND_URL}/batch_ingest", json={"messages": message_batch}, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
-                        if resp.status == 200:
-                            result = await resp.json()
+                        status, result = await post_bulk(self.bot.http_session, "/batch_ingest", {"messages": message_batch, "guild_id": str(guild.id)})
+                        if status == 200:
                             total_ingested += result.get("processed", 0)
                             total_failed += result.get("failed", 0)
                         else:
                             total_failed += len(message_batch)
-                            logger.error(f"Final batch failed for #{channel.name} with status {resp.status}")
+                            logger.error(f"Batch failed for #{channel.name} with status {status}")
+                        message_batch = []
+                
+                if message_batch:
+                    status, result = await post_bulk(self.bot.http_session, "/batch_ingest", {"messages": message_batch, "guild_id": str(guild.id)})
+                    if status == 200:
+                        total_ingested += result.get("processed", 0)
+                        total_failed += result.get("failed", 0)
+                    else:
+                        total_failed += len(message_batch)
+                        logger.error(f"Final batch failed for #{channel.name} with status {status}")
             except discord.Forbidden:
                 logger.info(f"Permissions error in #{channel.name}. Skipping.")
                 continue
@@ -279,20 +377,9 @@ class CommandCog(commands.Cog):
             await interaction.followup.send("This command can only be used in a thread.", ephemeral=True)
             return
         thread = interaction.channel
-        messages = []
-        async for m in thread.history(limit=None, oldest_first=True):
-            messages.append({
-                "message_id": str(m.id),
-                "channel_id": str(m.channel.id),
-                "user_id": str(m.author.id),
-                "content": m.content,
-                "timestamp": m.created_at.isoformat(),
-                "attachments": [a.url for a in m.attachments],
-                "thread_id": str(thread.id),
-                "roles": get_user_roles(m.author),
-            })
+        messages = await get_thread_messages(thread)
         payload = {"thread_id": str(thread.id), "parent_message_id": str(thread.parent_id) if hasattr(thread, "parent_id") else None, "messages": messages}
-        async with self.bot.http_session.post(f"{BACKEND_URL}/summarize", json=payload, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
+        async with self.bot.http_session.post(f"{backend_url(interaction.guild_id)}/summarize", json=payload, headers=backend_headers()) as resp:
             if resp.status == 200:
                 data = await resp.json()
                 summary = data.get("summary", "No summary could be generated.")
@@ -324,14 +411,24 @@ class FeedbackView(View):
             "sources": self.sources,
             "feedback": feedback_type
         }
-        async with self.bot.http_session.post(f"{BACKEND_URL}/feedback", json=payload, headers={"X-API-Key": BACKEND_API_KEY}) as resp:
+        async with self.bot.http_session.post(f"{backend_url(interaction.guild_id)}/feedback", json=payload, headers=backend_headers()) as resp:
             if resp.status == 200:
                 await interaction.response.send_message("Thank you for your feedback!", ephemeral=True)
             else:
                 await interaction.response.send_message("Failed to log feedback.", ephemeral=True)
 
-if __name__ == "__main__":
+async def serve():
+    """Run the bot until SIGTERM/SIGINT, then close the gateway connection and HTTP session cleanly."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(bot.close()))
+    async with bot:
+        await bot.start(DISCORD_BOT_TOKEN)
+
+def run():
     if not DISCORD_BOT_TOKEN:
         raise ValueError("DISCORD_BOT_TOKEN is not set in the environment.")
-    
-    asyncio.run(bot.start(DISCORD_BOT_TOKEN)) 
\ No newline at end of file
+    asyncio.run(serve())
+
+if __name__ == "__main__":
+    run() 
\ No newline at end of file
@@ -0,0 +1,92 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+THREAD_CACHE_MAX_THREADS = int(os.getenv("THREAD_CACHE_MAX_THREADS", "256"))
+THREAD_CACHE_MAX_MESSAGES = int(os.getenv("THREAD_CACHE_MAX_MESSAGES", "1000"))
+
+
+class ThreadMessageCache:
+    """Bounded cache of message payloads per Discord thread.
+
+    Threads are kept in LRU order and the least recently used thread is evicted once
+    `max_threads` is exceeded. A thread that grows past `max_messages` is dropped from
+    the cache entirely so that callers fall back to a full history fetch instead of
+    working from a partial thread.
+    """
+
+    def __init__(self, max_threads: int = THREAD_CACHE_MAX_THREADS, max_messages: int = THREAD_CACHE_MAX_MESSAGES):
+        self.max_threads = max_threads
+        self.max_messages = max_messages
+        self._threads: "OrderedDict[str, OrderedDict[str, Dict[str, Any]]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, thread_id: str) -> bool:
+        return thread_id in self._threads
+
+    def __len__(self) -> int:
+        return len(self._threads)
+
+    def get(self, thread_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Return the cached payloads of a thread in posting order, or None on a miss."""
+        with self._lock:
+            messages = self._threads.get(thread_id)
+            if messages is None:
+                self.misses += 1
+                return None
+            self._threads.move_to_end(thread_id)
+            self.hits += 1
+            return list(messages.values())
+
+    def put(self, thread_id: str, messages: List[Dict[str, Any]]) -> None:
+        """Store the full message history of a thread, replacing any cached entry."""
+        with self._lock:
+            if len(messages) > self.max_messages:
+                self._threads.pop(thread_id, None)
+                return
+            self._threads[thread_id] = OrderedDict((m["message_id"], m) for m in messages)
+            self._threads.move_to_end(thread_id)
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+
+    def append(self, thread_id: str, message: Dict[str, Any]) -> bool:
+        """Add a new message to a cached thread. Returns False if the thread is not cached."""
+        with self._lock:
+            messages = self._threads.get(thread_id)
+            if messages is None:
+                return False
+            messages[message["message_id"]] = message
+            if len(messages) > self.max_messages:
+                del self._threads[thread_id]
+                return False
+            self._threads.move_to_end(thread_id)
+            return True
+
+    def update(self, thread_id: str, message_id: str, **fields: Any) -> bool:
+        """Apply an edit to a cached message. Returns False if the message is not cached."""
+        with self._lock:
+            messages = self._threads.get(thread_id)
+            if messages is None or message_id not in messages:
+                return False
+            messages[message_id] = {**messages[message_id], **fields}
+            return True
+
+    def remove(self, thread_id: str, message_ids: List[str]) -> int:
+        """Drop deleted messages from a cached thread and return how many were removed."""
+        with self._lock:
+            messages = self._threads.get(thread_id)
+            if messages is None:
+                return 0
+            removed = 0
+            for message_id in message_ids:
+                if messages.pop(message_id, None) is not None:
+                    removed += 1
+            return removed
+
+    def invalidate(self, thread_id: str) -> None:
+        """Forget a thread entirely, e.g. when it is deleted."""
+        with self._lock:
+            self._threads.pop(thread_id, None)
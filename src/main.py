@@ -1,37 +1,145 @@
-# Entrypoint for the VITA Discord AI Knowledge Assistant 
+# Entrypoint for the VITA Discord AI Knowledge Assistant
+#
+# Runs a small supervisor that forks one process per role:
+#   api      - API_WORKERS uvicorn servers sharing one pre-bound listening socket
+#   ingest   - INGEST_WORKERS processes draining the shared ingestion job queue (with
+#              INGEST_ROUTING=guild, worker i only runs the jobs of the guilds hashed to shard i)
+#   bot      - the Discord bot (RUN_BOT)
+# Heavy models are loaded once in the supervisor before forking so workers share the pages.
+# Cross-process state (processed IDs, leases, caches, jobs) lives in src.backend.shared_state.
+import gc
 import multiprocessing
 import os
 import signal
 import sys
 import time
 
-def run_backend():
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+INGEST_ROUTING = os.getenv("INGEST_ROUTING", "any").lower()
+RUN_BOT = os.getenv("RUN_BOT", "true").lower() in ("1", "true", "yes")
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "true").lower() in ("1", "true", "yes")
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("SHUTDOWN_GRACE_SECONDS", "30"))
+RESTART_BACKOFF_SECONDS = float(os.getenv("RESTART_BACKOFF_SECONDS", "1"))
+RESTART_BACKOFF_MAX_SECONDS = 60.0
+
+if INGEST_WORKERS > 0:
+    # API workers enqueue ingestion instead of running it in-process
+    os.environ.setdefault("INGEST_MODE", "queue")
+# Tokenizer thread pools do not survive fork
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+
+def _reset_signals():
+    # Children install their own handlers; drop the supervisor's
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+def run_api(config, sock):
+    _reset_signals()
     import uvicorn
-    uvicorn.run("src.backend.api:app", host="0.0.0.0", port=8000, reload=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def run_ingest(shard=None):
+    _reset_signals()
+    from src.backend.worker import main as worker_main
+    worker_main(shard)
+
 
 def run_bot():
-    import src.bot.discord_bot
+    _reset_signals()
+    from src.bot.discord_bot import run
+    run()
 
-def main():
-    backend_proc = multiprocessing.Process(target=run_backend)
-    bot_proc = multiprocessing.Process(target=run_bot)
-    backend_proc.start()
-    bot_proc.start()
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
+
+def preload():
+    """Import the backend and load its models in the supervisor, then freeze the heap for copy-on-write."""
+    from src.backend import startup
+    import src.backend.api  # noqa: F401  registers the components
+    # The Pinecone client holds network connections, which must not be shared across fork
+    startup.preload(skip=("pinecone_index", "embedding_index_check"))
+    gc.freeze()
+
+
+class Supervisor:
+    def __init__(self):
+        self.ctx = multiprocessing.get_context("fork")
+        self.roles = {}
+        self.procs = {}
+        self.failures = {}
+        self.stopping = False
+
+    def add(self, name, target, *args):
+        self.roles[name] = (target, args)
+
+    def start(self, name):
+        target, args = self.roles[name]
+        proc = self.ctx.Process(target=target, args=args, name=name)
+        proc.start()
+        self.procs[name] = proc
+        print(f"Started {name} (pid {proc.pid})")
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for name in self.roles:
+            self.start(name)
+        while not self.stopping:
+            time.sleep(0.5)
+            for name, proc in list(self.procs.items()):
+                if self.stopping or proc.is_alive():
+                    continue
+                failures = self.failures.get(name, 0) + 1
+                self.failures[name] = failures
+                delay = min(RESTART_BACKOFF_SECONDS * 2 ** (failures - 1), RESTART_BACKOFF_MAX_SECONDS)
+                print(f"{name} exited with code {proc.exitcode}; restarting in {delay:.0f}s")
+                time.sleep(delay)
+                if not self.stopping:
+                    self.start(name)
+        self.drain()
+
+    def drain(self):
+        """SIGTERM every child (uvicorn finishes in-flight requests, workers finish their job), then kill stragglers."""
         print("Shutting down...")
-        backend_proc.terminate()
-        bot_proc.terminate()
-        backend_proc.join()
-        bot_proc.join()
-        sys.exit(0)
+        for proc in self.procs.values():
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGTERM)
+        deadline = time.monotonic() + SHUTDOWN_GRACE_SECONDS
+        for name, proc in self.procs.items():
+            proc.join(max(0.0, deadline - time.monotonic()))
+            if proc.is_alive():
+                print(f"{name} did not stop within {SHUTDOWN_GRACE_SECONDS:.0f}s; killing")
+                proc.kill()
+                proc.join()
+
+
+def main():
+    import uvicorn
+
+    if PRELOAD_MODELS:
+        preload()
+    config = uvicorn.Config(
+        "src.backend.api:app", host=API_HOST, port=API_PORT, reload=False,
+        timeout_graceful_shutdown=int(SHUTDOWN_GRACE_SECONDS),
+    )
+    sock = config.bind_socket()
+    supervisor = Supervisor()
+    for i in range(API_WORKERS):
+        supervisor.add(f"api-{i}", run_api, config, sock)
+    for i in range(INGEST_WORKERS):
+        supervisor.add(f"ingest-{i}", run_ingest, i if INGEST_ROUTING == "guild" else None)
+    if RUN_BOT:
+        supervisor.add("bot", run_bot)
+    supervisor.run()
+    sys.exit(0)
+
 
 if __name__ == "__main__":
     main()
-
-# To run the bot, use:
-# python -m src.bot.discord_bot
-# To run the backend and scheduler, use:
-# python -m src.main 
\ No newline at end of file
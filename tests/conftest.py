@@ -0,0 +1,36 @@
+import pytest
+from src.backend import doc_store, embedding, near_duplicates, shared_state, windowing
+
+
+@pytest.fixture
+def state(monkeypatch, tmp_path):
+    """A fresh shared state database; tmp_path is also the working directory."""
+    monkeypatch.chdir(tmp_path)
+    state = shared_state.SharedState(str(tmp_path / "state.db"))
+    monkeypatch.setattr(shared_state, "_state", state)
+    return state
+
+
+@pytest.fixture
+def stores(state, monkeypatch, tmp_path):
+    """Fresh document, near-duplicate and conversation window stores."""
+    monkeypatch.setattr(doc_store, "_store", doc_store.DocStore(str(tmp_path / "docs.db")))
+    monkeypatch.setattr(near_duplicates, "_index", near_duplicates.NearDuplicateIndex(str(tmp_path / "dups.db")))
+    monkeypatch.setattr(windowing, "_store", windowing.WindowStore(str(tmp_path / "windows.db")))
+
+
+@pytest.fixture
+def configure_index(state, monkeypatch):
+    """Make test indexes the configured target: configure_index(index) or configure_index({name: index}, "name")."""
+
+    def configure(index, name="test", namespaced=False):
+        monkeypatch.setattr(embedding, "default_target", lambda: {"index": name, "provider": "fake", "model": "a",
+                                                                  "namespaced": namespaced})
+        if isinstance(index, dict):
+            monkeypatch.setattr(embedding, "get_index", lambda n=None: index[n or embedding.active_target()["index"]])
+        else:
+            monkeypatch.setattr(embedding, "get_index", lambda n=None: index)
+        embedding.reset_index_config_cache()
+        return index
+
+    return configure
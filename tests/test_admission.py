@@ -0,0 +1,102 @@
+import asyncio
+import pytest
+from src.backend import admission as admission_module, shared_state
+from src.backend.admission import AdmissionController, AdmissionRejected
+from src.backend.llm_client import BULK, INTERACTIVE
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(state, monkeypatch):
+    monkeypatch.setattr(admission_module, "_POLL_SECONDS", 0.01)
+
+
+def test_query_over_user_limit_waits_then_is_shed():
+    controller = AdmissionController(max_per_user=1, queue_timeout=0.05)
+
+    async def scenario():
+        async with controller.query("g", "u"):
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with controller.query("g", "u"):
+                    pass
+            # Another user of the same guild is unaffected
+            async with controller.query("g", "other"):
+                pass
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert (rejected.priority, rejected.reason) == (INTERACTIVE, "user_limit")
+    assert controller.in_flight[INTERACTIVE] == 0 and not controller.per_user
+
+
+def test_queued_query_is_admitted_when_a_slot_frees():
+    controller = AdmissionController(max_concurrency=1, queue_timeout=1)
+    order = []
+
+    async def run(name, hold):
+        async with controller.query("g", name):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def scenario():
+        await asyncio.gather(run("a", 0.05), run("b", 0))
+
+    asyncio.run(scenario())
+    assert order == ["a", "b"]
+    # b queued on the process-wide limit, which counts as interactive pressure
+    assert controller.under_pressure()
+
+
+def test_full_queue_is_shed_immediately():
+    controller = AdmissionController(max_concurrency=1, max_queued=0)
+
+    async def scenario():
+        async with controller.query("g", "a"):
+            async with controller.query("g", "b"):
+                pass
+
+    with pytest.raises(AdmissionRejected, match="queue_full"):
+        asyncio.run(scenario())
+
+
+def test_slow_queries_put_bulk_under_pressure_across_processes(monkeypatch):
+    monkeypatch.setattr(admission_module, "QUERY_LATENCY_SLO_SECONDS", 1.0)
+    api_process, worker_process = AdmissionController(), AdmissionController()
+    assert not worker_process.under_pressure()
+    for _ in range(5):
+        api_process.record_latency(0.9)
+    assert api_process.under_pressure()
+    # Published through shared state for workers in other processes, which re-read it periodically
+    worker_process._shared_checked_at = 0
+    assert worker_process.under_pressure()
+    for _ in range(50):
+        api_process.record_latency(0.1)
+    assert not api_process._pressure
+
+
+def test_bulk_yields_while_under_pressure():
+    controller = AdmissionController()
+    controller._set_pressure(True)
+    assert asyncio.run(controller.yield_to_interactive(max_wait=0.05)) >= 0.05
+    controller._pressure = False
+    shared_state.get_shared_state().cache_set(admission_module.PRESSURE_KEY, False, 1)
+    controller._shared_checked_at = 0
+    assert asyncio.run(controller.yield_to_interactive(max_wait=0.05)) < 0.05
+
+
+def test_bulk_is_shed_before_interactive():
+    controller = AdmissionController(bulk_concurrency=1, bulk_max_queued=1)
+    controller.admit_bulk()
+    controller.in_flight[BULK] = 1
+    # A bulk backlog is tolerated until interactive traffic needs the room...
+    controller.admit_bulk()
+    controller._set_pressure(True)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit_bulk()
+    assert (rejected.value.priority, rejected.value.reason) == (BULK, "interactive_pressure")
+    controller._pressure = False
+    controller.queued[BULK] = 1
+    controller._shared_checked_at = float("inf")
+    controller._shared_pressure = False
+    # ...or it is full
+    with pytest.raises(AdmissionRejected, match="queue_full"):
+        controller.admit_bulk()
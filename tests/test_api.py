@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+import spacy
+from benchmarks.offline import InMemoryIndex
+from src.backend import api, ingestion, shared_state, worker
+
+
+pytestmark = pytest.mark.usefixtures("state")
+
+
+def _thread(*contents):
+    messages = [api.IngestRequest(message_id=str(i), channel_id="t", user_id="u", content=c, timestamp="2024-01-01T00:00:00")
+                for i, c in enumerate(contents)]
+    return api.ThreadIngestRequest(thread_id="t", messages=messages)
+
+
+def test_thread_changes_during_ingestion_are_coalesced(monkeypatch):
+    ingested = []
+
+    async def ingest_thread(req):
+        ingested.append([m.content for m in req.messages])
+        if len(ingested) == 1:
+            # Two changes arrive while the first ingestion runs; only the latest needs applying
+            await api.run_thread_ingestion_task(_thread("edited"))
+            await api.run_thread_ingestion_task(_thread("edited", "reply"))
+
+    monkeypatch.setattr(api, "_ingest_thread", ingest_thread)
+    asyncio.run(api.run_thread_ingestion_task(_thread("original")))
+    assert ingested == [["original"], ["edited", "reply"]]
+    assert shared_state.get_shared_state().cache_get(api.thread_pending_key("t")) is None
+
+
+def test_deleting_a_thread_removes_its_document(stores, configure_index, monkeypatch):
+    index = configure_index(InMemoryIndex(4))
+    monkeypatch.setattr(api, "get_nlp", lambda: spacy.blank("en"))
+    index.upsert([{"id": i, "values": [1.0, 0.0, 0.0, 0.0], "metadata": {}} for i in ("thread:t#0", "thread:t#1", "m#0")])
+    change = api.MessageChange(action="delete_thread", thread_id="t")
+    asyncio.run(api.run_index_changes_task(api.IndexChangesRequest(changes=[change])))
+    assert list(index.namespace()) == ["m#0"]
+
+
+def test_windows_cite_each_of_their_messages():
+    window = {"message_id": "1", "message_ids": ["1", "2", "3"], "channel_id": "c", "duplicate_sources": ["d:9"]}
+    single = {"message_id": "2", "channel_id": "c"}
+    citations = api.build_citations([window, single])
+    assert [(c["channel_id"], c["message_id"]) for c in citations] == [("c", "1"), ("c", "2"), ("c", "3"), ("d", "9")]
+
+
+def test_failed_queued_jobs_are_retried_then_dead_lettered(monkeypatch):
+    attempts, dead_letters = [], []
+
+    async def apply_window_changes(edited, deleted):
+        attempts.append(worker.job_attempt())
+        raise RuntimeError("index unavailable")
+
+    monkeypatch.setattr(api, "apply_window_changes", apply_window_changes)
+    monkeypatch.setattr(api, "log_to_dlq", dead_letters.append)
+    monkeypatch.setattr(ingestion, "log_to_dlq", dead_letters.append)
+    monkeypatch.setattr(worker, "JOB_POLL_SECONDS", 0.01)
+    state = shared_state.get_shared_state()
+    state.enqueue_job("index_changes", {"changes": [{"action": "delete", "message_ids": ["1"]}]})
+
+    async def scenario():
+        stop = asyncio.Event()
+
+        async def stop_when_drained():
+            while state.queue_depth():
+                await asyncio.sleep(0.01)
+            stop.set()
+
+        await asyncio.gather(worker.run_jobs(stop), stop_when_drained())
+
+    asyncio.run(scenario())
+    assert attempts == [1, 2, 3]
+    assert [entry["failed_at_step"] for entry in dead_letters] == ["job_index_changes"]
@@ -1,4 +1,6 @@
 import pytest
+from src.backend import chunking
+from src.backend.chunking import TextChunker, _sized_units, count_tokens, iter_text_chunks
 from src.backend.utils import split_text_for_embedding
 
 def test_split_text_for_embedding():
@@ -8,3 +10,62 @@ def test_split_text_for_embedding():
     assert all(len(chunk) <= 4000 for chunk in chunks)
     assert chunks[0][-200:] == chunks[1][:200]
     assert chunks[1][-200:] == chunks[2][:200]
+
+def _paragraphs(n):
+    sentence = "The release was deployed to production after review."
+    return "\n\n".join(" ".join([sentence] * 6) for _ in range(n))
+
+def test_iter_text_chunks_respects_token_limit_and_boundaries():
+    text = _paragraphs(20)
+    chunks = list(iter_text_chunks(text, max_tokens=120, overlap_tokens=20))
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 120 for chunk in chunks)
+    assert all(chunk.endswith(".") for chunk in chunks)
+
+def test_iter_text_chunks_streams_pieces():
+    text = _paragraphs(10)
+    pieces = (text[i:i + 50] for i in range(0, len(text), 50))
+    assert list(iter_text_chunks(pieces, max_tokens=100, overlap_tokens=10)) == list(iter_text_chunks(text, max_tokens=100, overlap_tokens=10))
+
+def test_boundary_split_across_pieces_matches_whole_text():
+    for pieces in (["a \n", "\n b"], ["end.", " ", " next"]):
+        assert list(iter_text_chunks(iter(pieces), max_tokens=3, overlap_tokens=0)) == \
+            list(iter_text_chunks("".join(pieces), max_tokens=3, overlap_tokens=0))
+
+def test_iter_text_chunks_hard_splits_unbroken_text():
+    chunks = list(iter_text_chunks("A" * 9500, max_tokens=500, overlap_tokens=0))
+    assert "".join(chunks) == "A" * 9500
+    assert all(count_tokens(chunk) <= 500 for chunk in chunks)
+
+def test_hard_split_never_cuts_multibyte_characters():
+
+    class ByteEncoding:
+        def encode(self, text):
+            return list(text.encode("utf-8"))
+
+        def decode(self, tokens):
+            return bytes(tokens).decode("utf-8", errors="replace")
+    text = "né 🙂 " * 50
+    parts = [part for part, _, _ in _sized_units(text, ByteEncoding(), 7)]
+    assert "".join(parts) == text
+    assert not any("\ufffd" in part for part in parts)
+
+def test_tokenizer_fallback_is_retried(monkeypatch):
+    results = [None, "real"]
+    monkeypatch.setattr(chunking, "_encodings", {})
+    monkeypatch.setattr(chunking, "_retry_at", {})
+    monkeypatch.setattr(chunking, "_load_encoding", lambda model: results.pop(0))
+    assert isinstance(chunking.get_encoding("m"), chunking.ApproxEncoding)
+    assert isinstance(chunking.get_encoding("m"), chunking.ApproxEncoding)
+    chunking._retry_at.clear()  # the retry interval has passed
+    assert chunking.get_encoding("m") == "real"
+    assert chunking.get_encoding("m") == "real"
+    assert results == []
+
+def test_text_chunker_emits_chunks_before_all_text_is_fed():
+    text = _paragraphs(10)
+    chunker = TextChunker(max_tokens=100, overlap_tokens=10)
+    early = list(chunker.feed(text[:len(text) // 2]))
+    assert early
+    chunks = early + list(chunker.feed(text[len(text) // 2:])) + list(chunker.close())
+    assert chunks == list(iter_text_chunks(text, max_tokens=100, overlap_tokens=10))
@@ -0,0 +1,46 @@
+import numpy as np
+from src.backend.context_selection import drop_duplicates, mmr_select, select_context, shortlist, trim_overlaps
+
+
+def _chunk(text, message_id="m1", chunk_index=0):
+    return {"chunk_text": text, "message_id": message_id, "chunk_index": chunk_index}
+
+
+def test_trim_overlaps_cuts_repeated_prefix_of_next_chunk():
+    first = "The deploy failed because the migration locked the users table for ten minutes. "
+    second = "locked the users table for ten minutes. We rolled back and added an index."
+    trimmed = trim_overlaps([_chunk(first, chunk_index=0), _chunk(second, chunk_index=1)])
+    assert trimmed[1]["chunk_text"] == "We rolled back and added an index."
+    assert trimmed[0]["chunk_text"] == first
+    # Chunks of other messages are left alone
+    other = trim_overlaps([_chunk(first, chunk_index=0), _chunk(second, "m2", chunk_index=1)])
+    assert other[1]["chunk_text"] == second
+
+
+def test_drop_duplicates_removes_identical_and_contained_text():
+    chunks = [_chunk("Release is on Friday at noon.", "a"), _chunk("release is on  friday at noon.", "b"),
+              _chunk("on Friday", "c"), _chunk("Standup moved to 10am.", "d")]
+    assert [c["message_id"] for c in drop_duplicates(chunks)] == ["a", "d"]
+
+
+def test_mmr_prefers_diverse_candidates_and_skips_near_duplicates():
+    query = [1.0, 0.0, 0.0]
+    candidates = [[1.0, 0.1, 0.0], [1.0, 0.1001, 0.0], [0.7, 0.0, 0.7]]
+    assert mmr_select(query, candidates, k=3) == [0, 2]
+    assert mmr_select(query, candidates, k=3, lambda_=1.0, duplicate_similarity=1.1) == [0, 1, 2]
+
+
+def test_select_context_reports_tokens_saved():
+    rng = np.random.default_rng(0)
+    chunks = [_chunk(f"distinct message number {i} " * 5, str(i)) for i in range(6)]
+    chunks.append(_chunk(chunks[0]["chunk_text"], "dup"))
+    selected, stats = select_context(rng.normal(size=8), chunks, [rng.normal(size=8) for _ in chunks], k=3)
+    assert len(selected) == 3
+    assert stats["tokens_saved"] == stats["candidate_tokens"] - stats["selected_tokens"] > 0
+
+
+def test_shortlist_keeps_rank_order_and_falls_back_without_vectors():
+    chunks = [{"vector_id": str(i)} for i in range(4)]
+    vectors = [[1.0, 0.0], [1.0, 0.0], [0.0, 1.0], [0.7, 0.7]]
+    assert [c["vector_id"] for c in shortlist([1.0, 0.0], chunks, vectors, n=2)] == ["0", "3"]
+    assert shortlist([1.0, 0.0], chunks, [None] * 4, n=2) == chunks[:2]
@@ -0,0 +1,29 @@
+from src.backend.doc_store import DocStore, split_metadata
+
+
+def test_split_keeps_only_filterable_fields_in_metadata():
+    slim, doc = split_metadata({"message_id": "1", "roles": ["a"], "chunk_text": "hello", "entities": ["Bob"]})
+    assert slim == {"message_id": "1", "roles": ["a"]}
+    assert doc == {"chunk_text": "hello", "entities": ["Bob"]}
+
+
+def test_documents_round_trip_per_index(tmp_path):
+    store = DocStore(str(tmp_path / "docs.db"))
+    text = "the deploy checklist lives in the wiki " * 50
+    store.put("live", {"1#0": {"chunk_text": text}, "1#1": {"chunk_text": "tail"}})
+    store.put("next", {"1#0": {"chunk_text": "re-chunked"}})
+    assert store.get("live", ["1#0", "missing"]) == {"1#0": {"chunk_text": text}}
+    assert store.get("next", ["1#0"])["1#0"]["chunk_text"] == "re-chunked"
+    blob = store._conn.execute("SELECT data FROM docs WHERE vector_id = '1#0' AND index_name = 'live'").fetchone()[0]
+    assert len(blob) < len(text) / 5
+
+
+def test_update_delete_and_drop(tmp_path):
+    store = DocStore(str(tmp_path / "docs.db"))
+    store.put("live", {"1#0": {"chunk_text": "secret", "entities": ["Bob"]}})
+    assert store.update("live", ["1#0", "2#0"], chunk_text="[REDACTED]") == ["1#0"]
+    assert store.get("live", ["1#0"])["1#0"] == {"chunk_text": "[REDACTED]", "entities": ["Bob"]}
+    store.delete("live", ["1#0"])
+    assert store.get("live", ["1#0"]) == {}
+    store.put("live", {"2#0": {"chunk_text": "x"}})
+    assert store.drop("live") == 1
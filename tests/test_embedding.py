@@ -0,0 +1,80 @@
+import asyncio
+import numpy as np
+import pytest
+from src.backend import embedding
+
+
+class FakeModel:
+    max_seq_length = 512
+
+    def __init__(self):
+        self.batches = []
+
+    def get_sentence_embedding_dimension(self):
+        return 4
+
+    def encode(self, texts, batch_size, normalize_embeddings, convert_to_numpy):
+        self.batches.append(list(texts))
+        return np.array([[float(len(t)), 0.0, 0.0, 0.0] for t in texts])
+
+
+class FakeIndex:
+    def __init__(self, dimension):
+        self.dimension = dimension
+
+    def describe_index_stats(self):
+        return {"dimension": self.dimension, "total_vector_count": 0}
+
+
+@pytest.fixture
+def local_provider(state, monkeypatch):
+    provider = embedding.LocalEmbeddingProvider(model="fake", batch_size=2, query_prefix="query: ")
+    provider._model = FakeModel()
+    embedding.reset_index_config_cache()
+    monkeypatch.setattr(embedding, "get_embedding_provider", lambda: provider)
+    return provider
+
+
+def test_local_provider_batches_and_prefixes_queries(local_provider):
+    vectors = asyncio.run(embedding.embed_chunks(["a", "bb", "ccc"]))
+    assert [v[0] for v in vectors] == [1.0, 2.0, 3.0]
+    assert local_provider._model.batches == [["a", "bb"], ["ccc"]]
+    assert asyncio.run(embedding.embed_query("x"))[0] == len("query: x")
+
+
+def test_index_check_rejects_dimension_mismatch(local_provider, monkeypatch):
+    monkeypatch.setattr(embedding, "get_index", lambda name=None: FakeIndex(1536))
+    with pytest.raises(embedding.EmbeddingConfigError, match="dimension"):
+        embedding.check_index_compatibility()
+
+
+def test_index_check_rejects_model_switch(local_provider, monkeypatch):
+    monkeypatch.setattr(embedding, "get_index", lambda name=None: FakeIndex(4))
+    embedding.check_index_compatibility()
+    local_provider.model = "other"
+    with pytest.raises(embedding.EmbeddingConfigError, match="local:fake"):
+        embedding.check_index_compatibility()
+
+
+def test_openai_dimensions_shorten_vectors_and_change_model_id():
+    provider = embedding.OpenAIEmbeddingProvider("text-embedding-3-small", dimensions=512)
+    assert provider.dimension == 512
+    assert provider.model_id == "openai:text-embedding-3-small@512"
+    with pytest.raises(embedding.EmbeddingConfigError, match="shortened"):
+        embedding.OpenAIEmbeddingProvider("text-embedding-ada-002", dimensions=512)
+
+
+def test_openai_provider_splits_large_inputs_into_bounded_requests(monkeypatch):
+    from src.backend import llm_client
+    requests = []
+
+    async def create_embeddings(texts, model, priority, dimensions):
+        requests.append(len(texts))
+        return [[float(len(t))] for t in texts]
+
+    monkeypatch.setattr(llm_client, "create_embeddings", create_embeddings)
+    monkeypatch.setattr(embedding, "OPENAI_EMBEDDING_MAX_BATCH", 4)
+    texts = ["x" * n for n in range(10)]
+    vectors = asyncio.run(embedding.OpenAIEmbeddingProvider("text-embedding-3-small").embed(texts))
+    assert requests == [4, 4, 2]
+    assert vectors == [[float(n)] for n in range(10)]
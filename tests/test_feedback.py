@@ -0,0 +1,12 @@
+from src.backend import feedback
+
+
+def test_dlq_is_appended_and_reads_older_array_files(monkeypatch, tmp_path):
+    path = tmp_path / "dead_letter_queue.json"
+    # Written by the previous format: the whole queue as one JSON array
+    path.write_text('[{"failed_at_step": "ingestion", "n": 1}]')
+    monkeypatch.setattr(feedback, "DLQ_PATH", str(path))
+    feedback.log_to_dlq({"failed_at_step": "ingestion", "n": 2})
+    feedback.log_to_dlq({"type": "embedding_or_storage", "n": 3})
+    assert [entry["n"] for entry in feedback.load_dlq()] == [1, 2, 3]
+    assert path.read_text().count("\n") == 2
@@ -0,0 +1,38 @@
+import asyncio
+from types import SimpleNamespace
+from src.backend import file_processor
+
+
+def test_csv_is_partitioned_in_row_blocks(monkeypatch):
+    monkeypatch.setattr(file_processor, "ATTACHMENT_CSV_ROWS_PER_PART", 2)
+    parts = []
+
+    def partition_csv(file):
+        parts.append(file.read().decode())
+        return [SimpleNamespace(text=f"part {len(parts)}"), SimpleNamespace(text="")]
+
+    monkeypatch.setattr(file_processor, "get_partitioner", lambda extension: partition_csv)
+    content = b'id,note\r\n1,"two\r\nlines"\r\n2,b\r\n3,c\r\n'
+    assert list(file_processor.partition_parts(".csv", content)) == [["part 1"], ["part 2"]]
+    # A quoted line break stays within its row
+    assert parts == ['id,note\r\n1,"two\r\nlines"\r\n', "2,b\r\n3,c\r\n"]
+
+
+def test_document_text_is_yielded_a_part_at_a_time(monkeypatch):
+    partitioned = []
+
+    def partition_parts(extension, content):
+        for part in range(3):
+            partitioned.append(part)
+            yield [f"page {part}"]
+
+    monkeypatch.setattr(file_processor, "partition_parts", partition_parts)
+
+    async def consume():
+        seen = []
+        async for piece in file_processor._iter_document_text(".pdf", b""):
+            # Later parts are not partitioned until this one has been consumed
+            seen.append((piece, len(partitioned)))
+        return seen
+
+    assert asyncio.run(consume()) == [("page 0\n", 1), ("page 1\n", 2), ("page 2\n", 3)]
@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from benchmarks.offline import InMemoryIndex, hashed_embedding
+from src.backend import doc_store, embedding, index_migration, shared_state
+from src.backend.sharding import guild_scope
+
+
+class FakeProvider(embedding.EmbeddingProvider):
+    dimension = 8
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.calls = 0
+
+    async def embed(self, texts):
+        self.calls += 1
+        return [hashed_embedding(t, self.dimension) for t in texts]
+
+    async def embed_query(self, text):
+        return hashed_embedding(text, self.dimension)
+
+
+def _vector(vector_id, text, **meta):
+    return {"id": vector_id, "values": hashed_embedding(text, 8), "metadata": dict(meta, chunk_text=text)}
+
+
+@pytest.fixture
+def indexes(stores, configure_index, monkeypatch):
+    monkeypatch.setattr(embedding, "INDEX_CONFIG_TTL_SECONDS", 0)
+    monkeypatch.setattr(index_migration, "INDEX_CONFIG_TTL_SECONDS", 0)
+    monkeypatch.setattr(index_migration, "MIGRATION_PAGE_SIZE", 2)
+    providers = {}
+    monkeypatch.setattr(index_migration, "provider_for", lambda p, m, d=0: providers.setdefault((p, m), FakeProvider(m)))
+    indexes = configure_index({"old": InMemoryIndex(8), "new": InMemoryIndex(8)}, "old")
+    monkeypatch.setattr(index_migration, "get_index", embedding.get_index)
+    indexes["old"].upsert([
+        _vector("1#0", "first message", message_id="1"),
+        _vector("2#0", "second message", message_id="2"),
+        _vector("3#0", "third message", message_id="3"),
+        _vector("thread:9", "", thread_id="9"),
+    ])
+    return indexes
+
+
+def test_backfill_copies_every_page_and_skips_vectors_without_text(indexes):
+    migration = asyncio.run(index_migration.start("new", "fake", "b"))
+    assert sorted(indexes["new"]._vectors) == ["1#0", "2#0", "3#0"]
+    assert migration["stats"] == {"copied": 3, "skipped": 1}
+    assert embedding.current_migration()["backfill_done"] is True
+    assert embedding.current_migration()["checkpoint"] is None
+
+
+def test_writes_during_migration_are_replayed_before_cutover(indexes):
+    asyncio.run(index_migration.start("new", "fake", "b"))
+    embedding.index.upsert(vectors=[_vector("4#0", "late message", message_id="4")])
+    embedding.index.delete(ids=["1#0"])
+    assert shared_state.get_shared_state().pending_vector_changes() == 2
+    asyncio.run(index_migration.cutover())
+    assert sorted(indexes["new"]._vectors) == ["2#0", "3#0", "4#0"]
+    assert embedding.active_target() == {"index": "new", "provider": "fake", "model": "b", "dimensions": 0, "namespaced": False}
+    assert embedding.current_migration() is None
+    # After cutover, writes go to the new index and are no longer logged
+    embedding.index.upsert(vectors=[_vector("5#0", "newest", message_id="5")])
+    assert "5#0" in indexes["new"]._vectors and "5#0" not in indexes["old"]._vectors
+    assert shared_state.get_shared_state().pending_vector_changes() == 0
+    assert index_migration.rollback()["index"] == "old"
+    assert embedding.active_target()["index"] == "old"
+
+
+def test_rechunk_rebuilds_messages_from_their_stored_chunks(indexes, monkeypatch):
+    indexes["old"].upsert([
+        _vector("7#0", "the release is planned for friday afternoon", message_id="7", chunk_index=0),
+        _vector("7#1", "planned for friday afternoon, after the freeze", message_id="7", chunk_index=1),
+    ])
+    monkeypatch.setattr(index_migration, "iter_text_chunks", lambda text: iter([text]))
+    asyncio.run(index_migration.start("new", "fake", "b", rechunk=True))
+    assert "7#1" not in indexes["new"]._vectors
+    stored = doc_store.get_doc_store().get("new", ["7#0"])["7#0"]
+    assert stored["chunk_text"] == "the release is planned for friday afternoon, after the freeze"
+    assert "chunk_text" not in indexes["new"]._vectors["7#0"]["metadata"]
+
+
+def test_namespaced_migration_splits_vectors_by_guild_and_replays_into_their_namespace(indexes):
+    indexes["old"].upsert([_vector("8#0", "guild message", message_id="8", guild_id="42")])
+    asyncio.run(index_migration.start("new", "fake", "b", namespaced=True))
+    assert list(indexes["new"].namespace("guild-42")) == ["8#0"]
+    # Vectors indexed without a guild stay in the default namespace
+    assert sorted(indexes["new"]._vectors) == ["1#0", "2#0", "3#0"]
+    with guild_scope("42"):
+        embedding.index.delete(ids=["8#0"])
+    asyncio.run(index_migration.cutover())
+    assert indexes["new"].namespace("guild-42") == {}
+    with guild_scope("42"):
+        embedding.index.upsert(vectors=[_vector("9#0", "after cutover", message_id="9", guild_id="42")])
+    assert "9#0" in indexes["new"].namespace("guild-42") and "9#0" not in indexes["new"]._vectors
@@ -0,0 +1,122 @@
+import asyncio
+import time
+import httpx
+import pytest
+from openai import RateLimitError
+from src.backend import llm_client, shared_state
+from src.backend.llm_client import BULK, INTERACTIVE, LLMGovernor, TokenBucket
+
+
+pytestmark = pytest.mark.usefixtures("state")
+
+
+def rate_limit_error(retry_after=None):
+    headers = {"retry-after": retry_after} if retry_after else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://api.test/v1"))
+    return RateLimitError("rate limited", response=response, body=None)
+
+
+def test_bucket_wait_time_respects_reserve():
+    bucket = TokenBucket("b", rate_per_minute=60)
+    assert bucket.take(50) == 0
+    assert bucket.take(5, reserve=0.2) > 0
+    assert bucket.take(5) == 0
+
+
+def test_bulk_waits_while_interactive_is_queued():
+    governor = LLMGovernor("m", requests_per_minute=600, tokens_per_minute=1e6, max_concurrency=4, bulk_concurrency=1)
+    governor.interactive_waiting = 1
+    assert asyncio.run(governor._try_acquire(BULK, 10)) > 0
+    assert asyncio.run(governor._try_acquire(INTERACTIVE, 10)) == 0
+    governor.interactive_waiting = 0
+    governor.in_flight[BULK] = 1
+    assert asyncio.run(governor._try_acquire(BULK, 10)) > 0
+
+
+def test_processes_share_one_budget():
+    # Governors for the same model in two processes (API and ingest worker) draw on the same buckets
+    api = LLMGovernor("m", requests_per_minute=2, tokens_per_minute=1e6)
+    worker = LLMGovernor("m", requests_per_minute=2, tokens_per_minute=1e6, reserve=0.0)
+    assert asyncio.run(worker._try_acquire(BULK, 10)) == 0
+    assert asyncio.run(worker._try_acquire(BULK, 10)) == 0
+    assert asyncio.run(api._try_acquire(INTERACTIVE, 10)) > 0
+    assert api.requests.level < 1
+
+
+def test_bulk_yields_to_interactive_waiting_in_another_process():
+    api = LLMGovernor("m", requests_per_minute=1, tokens_per_minute=1e6)
+    worker = LLMGovernor("m", requests_per_minute=600, tokens_per_minute=1e6, reserve=0.0)
+    api.requests.take(1)
+
+    async def ask():
+        await asyncio.wait_for(api.acquire(INTERACTIVE, 10), timeout=0.2)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(ask())
+    assert asyncio.run(worker._try_acquire(BULK, 10)) > 0
+
+
+def test_shared_state_is_not_touched_on_the_event_loop(monkeypatch):
+    take_tokens = shared_state.SharedState.take_tokens
+
+    def slow_take_tokens(self, *args, **kwargs):
+        time.sleep(0.2)  # a contended database
+        return take_tokens(self, *args, **kwargs)
+    monkeypatch.setattr(shared_state.SharedState, "take_tokens", slow_take_tokens)
+    governor = LLMGovernor("m", requests_per_minute=600, tokens_per_minute=1e6)
+
+    async def scenario():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+        ticker = asyncio.create_task(tick())
+        await governor.acquire(INTERACTIVE, 10)
+        ticker.cancel()
+        return ticks
+    assert asyncio.run(scenario()) > 5
+
+
+def test_token_estimate_is_reconciled_with_usage():
+    governor = LLMGovernor("m", requests_per_minute=600, tokens_per_minute=1000)
+
+    async def run():
+        async with governor.slot(INTERACTIVE, 300) as usage:
+            usage["used_tokens"] = 100
+    asyncio.run(run())
+    assert 890 < governor.tokens.level <= 1000
+
+
+def test_retry_after_header_sets_minimum_backoff():
+    error = rate_limit_error("7")
+    assert llm_client.retry_after(error) == 7
+    assert llm_client.backoff_delay(0, error) >= 7
+
+
+def test_rate_limited_call_falls_back_to_cheaper_model(monkeypatch):
+    monkeypatch.setattr(llm_client, "_governors", {})
+    monkeypatch.setattr(llm_client, "estimate_tokens", lambda texts, max_tokens=0: 10)
+    models = []
+
+    async def call(model):
+        models.append(model)
+        if model == "primary":
+            raise rate_limit_error()
+        return "answer"
+
+    result = asyncio.run(llm_client.call_with_governor("primary", INTERACTIVE, 10, call, fallback_model="cheap"))
+    assert result == "answer"
+    assert models == ["primary", "cheap"]
+    assert llm_client.get_governor("primary").requests.level < 1
+
+
+def test_non_retryable_errors_propagate(monkeypatch):
+    monkeypatch.setattr(llm_client, "_governors", {})
+
+    async def call(model):
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(llm_client.call_with_governor("m", BULK, 10, call))
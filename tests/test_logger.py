@@ -0,0 +1,47 @@
+import json
+import logging
+import queue
+from src.backend import logger as logger_module
+from src.backend.logger import AsyncQueueHandler, JsonFormatter, RateLimitFilter
+from src.backend.metrics import LOG_RECORDS_DROPPED
+
+
+def _record(msg="event %s", args=(1,), level=logging.DEBUG, lineno=10, created=100.0):
+    record = logging.LogRecord("vita.test", level, "module.py", lineno, msg, args, None)
+    record.created = created
+    return record
+
+
+def test_repetitive_records_are_rate_limited_per_call_site():
+    limiter = RateLimitFilter(burst=2, window=10, level=logging.INFO)
+    before = LOG_RECORDS_DROPPED.value(reason="rate_limited")
+    passed = [limiter.filter(_record(created=100.0 + i)) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert LOG_RECORDS_DROPPED.value(reason="rate_limited") - before == 3
+    # Other call sites and warnings are unaffected
+    assert limiter.filter(_record(lineno=11))
+    assert limiter.filter(_record(level=logging.WARNING, created=104.0))
+    # The first record of the next window reports what was suppressed
+    record = _record(created=111.0)
+    assert limiter.filter(record) and record.suppressed == 3
+
+
+def test_records_are_formatted_as_json_with_extra_and_context_fields(monkeypatch):
+    monkeypatch.setattr(logger_module, "_context_providers", [lambda: {"trace_id": "abc", "span_id": None}])
+    handler = AsyncQueueHandler(queue.Queue())
+    record = _record(level=logging.INFO)
+    record.job = "j1"
+    handler.emit(record)
+    entry = json.loads(JsonFormatter().format(handler.queue.get_nowait()))
+    assert entry["msg"] == "event 1" and entry["level"] == "INFO" and entry["logger"] == "vita.test"
+    assert entry["job"] == "j1" and entry["trace_id"] == "abc"
+    assert "span_id" not in entry
+
+
+def test_full_queue_drops_records_instead_of_blocking():
+    handler = AsyncQueueHandler(queue.Queue(1))
+    before = LOG_RECORDS_DROPPED.value(reason="queue_full")
+    handler.emit(_record())
+    handler.emit(_record())
+    assert handler.queue.qsize() == 1
+    assert LOG_RECORDS_DROPPED.value(reason="queue_full") - before == 1
@@ -0,0 +1,35 @@
+from src.bot.message_cache import ThreadMessageCache
+
+def _msg(message_id, content="hi"):
+    return {"message_id": message_id, "content": content}
+
+def test_thread_cache_miss_then_hit():
+    cache = ThreadMessageCache(max_threads=2, max_messages=10)
+    assert cache.get("t1") is None
+    cache.put("t1", [_msg("1"), _msg("2")])
+    assert [m["message_id"] for m in cache.get("t1")] == ["1", "2"]
+    assert cache.append("t1", _msg("3"))
+    assert not cache.append("t2", _msg("4"))
+    assert [m["message_id"] for m in cache.get("t1")] == ["1", "2", "3"]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+def test_thread_cache_edits_and_deletes():
+    cache = ThreadMessageCache()
+    cache.put("t1", [_msg("1"), _msg("2"), _msg("3")])
+    assert cache.update("t1", "2", content="edited")
+    assert not cache.update("t1", "9", content="missing")
+    assert cache.remove("t1", ["1", "3", "9"]) == 2
+    assert cache.get("t1") == [{"message_id": "2", "content": "edited"}]
+
+def test_thread_cache_bounds():
+    cache = ThreadMessageCache(max_threads=2, max_messages=2)
+    cache.put("t1", [_msg("1")])
+    cache.put("t2", [_msg("2")])
+    cache.get("t1")
+    cache.put("t3", [_msg("3")])
+    assert "t2" not in cache and "t1" in cache and "t3" in cache
+    cache.append("t1", _msg("4"))
+    assert not cache.append("t1", _msg("5"))
+    assert "t1" not in cache
+    cache.put("t4", [_msg("6"), _msg("7"), _msg("8")])
+    assert "t4" not in cache
@@ -0,0 +1,63 @@
+from src.backend.metrics import counter, gauge, histogram, render_all_processes, render_prometheus
+
+
+def test_histogram_buckets_are_cumulative():
+    h = histogram("test_latency_seconds", "Test latency.", ["stage"], buckets=(0.1, 1.0))
+    h.observe(0.05, stage="a")
+    h.observe(0.5, stage="a")
+    h.observe(5.0, stage="a")
+    counts, total, count = h.snapshot(stage="a")
+    assert counts == [1, 1, 1]
+    assert count == 3 and abs(total - 5.55) < 1e-9
+    text = render_prometheus()
+    assert 'test_latency_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{stage="a"} 3' in text
+
+
+def test_counter_and_gauge_render():
+    c = counter("test_events_total", "Test events.", ["kind"])
+    c.inc(kind="x")
+    c.inc(2, kind="x")
+    g = gauge("test_depth", "Test depth.")
+    g.inc()
+    g.dec()
+    g.set(7)
+    text = render_prometheus()
+    assert "# TYPE test_events_total counter" in text
+    assert 'test_events_total{kind="x"} 3' in text
+    assert "test_depth 7" in text
+    # Registering the same name again returns the existing metric
+    assert counter("test_events_total", "Test events.", ["kind"]) is c
+
+
+def test_histogram_quantile_is_the_bucket_bound():
+    h = histogram("test_quantile_seconds", "Test quantile.", ["guild"], buckets=(0.1, 1.0))
+    assert h.quantile(0.95, guild="a") is None
+    for value in (0.05, 0.05, 0.5, 0.5, 2.0):
+        h.observe(value, guild="a")
+    assert h.quantile(0.4, guild="a") == 0.1
+    assert h.quantile(0.8, guild="a") == 1.0
+    assert h.quantile(0.95, guild="a") == float("inf")
+    assert h.label_sets() == [{"guild": "a"}]
+
+
+def test_scrape_merges_every_processs_snapshot(state):
+    counter("test_merged_total", "Test merged.", ["kind"]).inc(2, kind="x")
+    gauge("test_merged_ratio", "Test ratio.", merge="max").set(0.5)
+    gauge("test_merged_in_flight", "Test in flight.").set(1)
+    histogram("test_merged_seconds", "Test merged latency.", buckets=(1.0,)).observe(0.5)
+    # Last snapshot published by another worker process
+    state.cache_set("metrics:999999", {
+        "test_merged_total": [[["x"], 3]],
+        "test_merged_ratio": [[[], 0.9]],
+        "test_merged_in_flight": [[[], 2]],
+        "test_merged_seconds": [[[], [[0, 1], 2.0, 1]]],
+    })
+    text = render_all_processes()
+    assert 'test_merged_total{kind="x"} 5' in text
+    assert "test_merged_ratio 0.9" in text
+    assert "test_merged_in_flight 3" in text
+    assert 'test_merged_seconds_bucket{le="1"} 1' in text
+    assert "test_merged_seconds_count 2" in text
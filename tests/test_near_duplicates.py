@@ -0,0 +1,96 @@
+import asyncio
+import pytest
+from benchmarks.offline import InMemoryIndex, hashed_embedding
+from src.backend.near_duplicates import NearDuplicateIndex, hamming_distance, simhash
+
+ANNOUNCEMENT = ("Reminder: the quarterly all-hands meeting is on Thursday at 3pm in the main hall. "
+                "Please bring your questions for the leadership team and review the agenda beforehand.")
+
+
+def test_simhash_is_close_for_near_identical_text():
+    edited = ANNOUNCEMENT.replace("Thursday", "Friday")
+    other = "Deploys are frozen until the incident review is complete; ping the on-call engineer for exceptions."
+    assert hamming_distance(simhash(ANNOUNCEMENT), simhash(ANNOUNCEMENT.upper() + "  ")) == 0
+    assert hamming_distance(simhash(ANNOUNCEMENT), simhash(edited)) < hamming_distance(simhash(ANNOUNCEMENT), simhash(other))
+
+
+def test_find_respects_scope_and_threshold(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "dups.db"), max_distance=3)
+    index.add([("m1#0", ANNOUNCEMENT)], scope="")
+    assert index.find(ANNOUNCEMENT + " ", scope="") == "m1#0"
+    assert index.find(ANNOUNCEMENT, scope="admin") is None
+    assert index.find("too short", scope="") is None
+    assert index.find("An unrelated message about the release checklist and the staging database migration plan.", scope="") is None
+
+
+def test_links_are_tracked_and_removed(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "dups.db"))
+    index.add([("m1#0", ANNOUNCEMENT)], scope="")
+    assert index.link("m1#0", "m2", "c2") == ["c2:m2"]
+    assert index.link("m1#0", "m3", "c3") == ["c2:m2", "c3:m3"]
+    assert index.unlink(["m2"]) == {"m1#0": ["c3:m3"]}
+    index.forget(["m1#0"])
+    assert index.find(ANNOUNCEMENT, scope="") is None
+    assert index.sources("m1#0") == []
+
+
+def test_changing_threshold_rebands_stored_signatures(tmp_path):
+    path = str(tmp_path / "dups.db")
+    NearDuplicateIndex(path, max_distance=1).add([("m1#0", ANNOUNCEMENT)], scope="")
+    assert NearDuplicateIndex(path, max_distance=5).find(ANNOUNCEMENT, scope="") == "m1#0"
+
+
+@pytest.fixture
+def backend(stores, configure_index, monkeypatch):
+    import spacy
+    from src.backend import api
+    index = configure_index(InMemoryIndex(16))
+
+    async def embed_chunks(texts):
+        return [hashed_embedding(t, 16) for t in texts]
+
+    monkeypatch.setattr(api, "embed_chunks", embed_chunks)
+    monkeypatch.setattr(api, "get_nlp", lambda: spacy.blank("en"))
+    return api, index
+
+
+def _ingest(api, message_id, content, minute=0):
+    request = api.IngestRequest(message_id=message_id, channel_id="c", user_id="u", content=content,
+                                timestamp=f"2024-01-01T00:{minute:02d}:00+00:00")
+    asyncio.run(api.run_ingestion_task(request))
+
+
+def test_duplicates_stay_retrievable_when_the_canonical_message_is_deleted(backend, monkeypatch):
+    api, index = backend
+    # Standalone message vectors rather than conversation windows
+    monkeypatch.setattr(api, "WINDOW_MESSAGE_MAX_TOKENS", 0)
+    _ingest(api, "m1", ANNOUNCEMENT)
+    _ingest(api, "m2", ANNOUNCEMENT.upper())
+    _ingest(api, "m3", ANNOUNCEMENT)
+    assert list(index.namespace()) == ["m1#0"]
+    assert index.namespace()["m1#0"]["metadata"]["duplicate_sources"] == ["c:m2", "c:m3"]
+
+    asyncio.run(api._delete_message("m1"))
+    # The oldest duplicate took the deleted message's place and still cites the other one
+    assert list(index.namespace()) == ["m2#0"]
+    matches = index.query(hashed_embedding(ANNOUNCEMENT, 16), top_k=1, include_metadata=True).matches
+    assert matches[0].metadata["message_id"] == "m2"
+    assert matches[0].metadata["duplicate_sources"] == ["c:m3"]
+    assert api.get_near_duplicates().find(ANNOUNCEMENT, scope="") == "m2#0"
+
+
+def test_repeated_short_messages_are_linked_instead_of_packed_into_windows(backend):
+    api, index = backend
+    _ingest(api, "m1", ANNOUNCEMENT)
+    _ingest(api, "m2", "Sounds good, see you there", minute=1)
+    _ingest(api, "m3", ANNOUNCEMENT, minute=2)
+    (window,) = api.get_window_store().windows_for_messages(["m1", "m2", "m3"])
+    assert [m["message_id"] for m in window["messages"]] == ["m1", "m2"]
+    assert list(index.namespace()) == [window["window_id"]]
+    assert index.namespace()[window["window_id"]]["metadata"]["duplicate_sources"] == ["c:m3"]
+
+    # Deleting the repeated message gives the repeat a vector of its own
+    asyncio.run(api._delete_message("m1"))
+    assert sorted(index.namespace()) == ["m3#0", window["window_id"]]
+    assert index.namespace()[window["window_id"]]["metadata"]["duplicate_sources"] == []
+    assert api.get_near_duplicates().find(ANNOUNCEMENT, scope="") == "m3#0"
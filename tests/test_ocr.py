@@ -0,0 +1,69 @@
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+from src.backend import ocr
+
+
+def _png(image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _screenshot(background=255, ink=0, size=(800, 400)):
+    image = Image.new("L", size, background)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=18)
+    for row in range(8):
+        draw.text((20, 20 + row * 45), f"user{row}: the deploy finished at 10:{row}5, see the logs", fill=ink, font=font)
+    return image
+
+
+def _photo(size=(800, 400)):
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, size=(size[1], size[0]), dtype=np.uint8))
+
+
+def test_text_is_detected_in_screenshots_but_not_in_noise_or_flat_images():
+    assert ocr.likely_has_text(_screenshot())
+    assert ocr.likely_has_text(_screenshot(background=30, ink=220))
+    assert not ocr.likely_has_text(_photo())
+    gradient = np.tile(np.linspace(0, 255, 800, dtype=np.uint8), (400, 1))
+    assert not ocr.likely_has_text(Image.fromarray(gradient))
+
+
+def test_preprocess_upscales_inverts_dark_mode_and_binarizes():
+    prepared = ocr.preprocess(_screenshot(background=30, ink=220, size=(400, 200)))
+    assert prepared.size == (1200, 600)
+    pixels = np.asarray(prepared)
+    assert set(np.unique(pixels)) == {0, 255}
+    # Mostly light background after inversion
+    assert pixels.mean() > 128
+
+
+def test_ocr_skips_small_and_textless_images_without_running_tesseract(monkeypatch):
+    import pytesseract
+    monkeypatch.setattr(pytesseract, "image_to_string", lambda *a, **kw: pytest.fail("tesseract should not run"))
+    assert ocr.ocr_image(_png(Image.new("RGB", (64, 64), "red"))) == ("", "skipped_small")
+    assert ocr.ocr_image(_png(_photo())) == ("", "skipped_no_text")
+
+
+def test_ocr_uses_screenshot_settings_and_reports_timeouts(monkeypatch):
+    import pytesseract
+    calls = []
+
+    def image_to_string(image, lang, config, timeout):
+        calls.append((image.mode, config, timeout))
+        return " deploy finished \n"
+
+    monkeypatch.setattr(pytesseract, "image_to_string", image_to_string)
+    transparent = _screenshot().convert("RGBA")
+    assert ocr.ocr_image(_png(transparent)) == ("deploy finished", "ok")
+    assert calls == [("L", ocr.OCR_TESSERACT_CONFIG, ocr.OCR_TIMEOUT_SECONDS)]
+
+    def timeout(*args, **kwargs):
+        raise RuntimeError("Tesseract process timeout")
+
+    monkeypatch.setattr(pytesseract, "image_to_string", timeout)
+    assert ocr.ocr_image(_png(_screenshot())) == ("", "timeout")
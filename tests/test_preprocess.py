@@ -0,0 +1,26 @@
+import pytest
+from src.backend.preprocess import preprocess_text, preprocess_texts
+from src.backend.utils import clean_text, redact_pii
+
+SAMPLES = [
+    "/remind me in 5 minutes",
+    "😀/cmd hello",
+    "+1 agreed   with   this",
+    "mail me at john.doe@example.com 👍",
+    "ssn 123-45-6789, card 1234567812345678",
+    "great idea+1!",
+    "hi😀there x@y.com",
+    "john+1@example.com",
+    "  \t leading and trailing \n ",
+    "",
+]
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_preprocess_text_matches_legacy_pipeline(text):
+    assert preprocess_text(text) == redact_pii(clean_text(text))
+
+def test_preprocess_texts_batch(monkeypatch):
+    expected = [redact_pii(clean_text(t)) for t in SAMPLES]
+    assert preprocess_texts(SAMPLES) == expected
+    monkeypatch.setattr("src.backend.preprocess.PREPROCESS_PARALLEL_MIN_BATCH", 1)
+    assert preprocess_texts(SAMPLES, processes=2) == expected
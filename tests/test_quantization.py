@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from src.backend.quantization import QuantizedMatrix, search, shorten
+
+
+def _unit(rows):
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def corpus():
+    rng = np.random.default_rng(0)
+    return _unit(rng.standard_normal((500, 64)).astype(np.float32)), _unit(rng.standard_normal((20, 64)).astype(np.float32))
+
+
+@pytest.mark.parametrize("storage,ratio", [("float16", 2), ("int8", 4)])
+def test_quantized_storage_shrinks_and_rescoring_recovers_exact_top_k(corpus, storage, ratio):
+    vectors, queries = corpus
+    matrix = QuantizedMatrix(vectors, storage)
+    assert matrix.nbytes <= vectors.nbytes / ratio + 4 * len(vectors)
+    assert np.abs(matrix.dequantize() - vectors).max() < 0.01
+    for query in queries:
+        exact = np.argsort(-(vectors @ query))[:5]
+        top, scores = search(matrix, query, 5, lambda rows: vectors[rows], rescore_factor=4)
+        assert top.tolist() == exact.tolist()
+        assert np.allclose(scores, vectors[exact] @ query)
+
+
+def test_search_handles_small_and_empty_matrices():
+    assert search(QuantizedMatrix(np.zeros((0, 4)), "int8"), np.ones(4), 3, lambda rows: None)[0].size == 0
+    top, _ = search(QuantizedMatrix(np.eye(3), "int8"), np.array([0.0, 1.0, 0.0]), 10, lambda rows: np.eye(3)[rows])
+    assert top.tolist()[0] == 1 and len(top) == 3
+
+
+def test_shorten_truncates_and_renormalises():
+    short = shorten([[3.0, 4.0, 12.0]], 2)
+    assert np.allclose(short, [[0.6, 0.8]])
+    assert shorten([[1.0, 0.0]], 0).shape == (1, 2)
@@ -0,0 +1,52 @@
+import pytest
+from benchmarks.offline import InMemoryIndex, hashed_embedding
+from src.backend import embedding, shared_state
+from src.backend.sharding import guild_scope, guild_shard, namespace_for, pick_for_guild
+
+
+@pytest.fixture
+def namespaced_index(configure_index):
+    return configure_index(InMemoryIndex(8), "kb", namespaced=True)
+
+
+def _vector(vector_id, text):
+    return {"id": vector_id, "values": hashed_embedding(text, 8), "metadata": {"message_id": vector_id}}
+
+
+def test_index_calls_stay_in_the_current_guilds_namespace(namespaced_index):
+    with guild_scope("1"):
+        embedding.index.upsert(vectors=[_vector("a", "release notes")])
+    with guild_scope("2"):
+        embedding.index.upsert(vectors=[_vector("b", "release notes")])
+        matches = embedding.index.query(vector=hashed_embedding("release notes", 8), top_k=5).matches
+        assert [m.id for m in matches] == ["b"]
+        assert list(embedding.index.fetch(ids=["a", "b"]).vectors) == ["b"]
+        embedding.index.delete(ids=["a"])
+    assert list(namespaced_index.namespace("guild-1")) == ["a"]
+    assert embedding.index_namespaces() == {"guild-1": 1, "guild-2": 1}
+    # Outside any guild (DMs, legacy content) the default namespace is used
+    assert embedding.index.query(vector=hashed_embedding("release notes", 8), top_k=5).matches == []
+
+
+def test_flat_index_ignores_guilds():
+    assert namespace_for("1", namespaced=False) == ""
+    assert namespace_for(None, namespaced=True) == ""
+    assert namespace_for("1", namespaced=True) == "guild-1"
+
+
+def test_guilds_map_to_stable_shards_and_backends():
+    shards = [guild_shard(str(g), 4) for g in range(100)]
+    assert shards == [guild_shard(str(g), 4) for g in range(100)]
+    assert set(shards) == {0, 1, 2, 3}
+    assert guild_shard(None, 4) == 0 and guild_shard("5", 1) == 0
+    backends = ["http://a", "http://b"]
+    assert pick_for_guild("123", backends) == backends[guild_shard("123", 2)]
+
+
+def test_workers_only_claim_their_shards_jobs(tmp_path):
+    state = shared_state.SharedState(str(tmp_path / "state.db"))
+    first = state.enqueue_job("ingest", {"n": 1}, shard=1)
+    second = state.enqueue_job("ingest", {"n": 2}, shard=0)
+    assert state.claim_job(owner="w0", shard=0)["id"] == second
+    assert state.claim_job(owner="w0", shard=0) is None
+    assert state.claim_job(owner="w1", shard=1)["id"] == first
@@ -0,0 +1,83 @@
+import asyncio
+import time
+import pytest
+from src.backend.shared_state import LeaseLost, SharedState, keep_renewed
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return SharedState(str(tmp_path / "state.db"))
+
+
+def test_processed_ids_are_shared_between_handles(state):
+    state.mark_processed_many(["1", "2"])
+    other = SharedState(state.path)
+    assert other.is_processed("1")
+    assert not other.is_processed("3")
+    assert other.processed_subset(["1", "2", "3"]) == {"1", "2"}
+
+
+def test_lease_is_exclusive_until_released_or_expired(state):
+    assert state.acquire_lease("k", owner="a")
+    assert not state.acquire_lease("k", owner="b")
+    state.release_lease("k", owner="a")
+    assert state.acquire_lease("k", owner="b")
+    assert state.acquire_lease("short", ttl=0.01, owner="a")
+    time.sleep(0.02)
+    assert state.acquire_lease("short", owner="b")
+
+
+def test_cache_entries_expire(state):
+    state.cache_set("forever", {"a": 1})
+    state.cache_set("brief", [1], ttl=0.01)
+    time.sleep(0.02)
+    assert state.cache_get("forever") == {"a": 1}
+    assert state.cache_get("brief") is None
+
+
+def test_jobs_are_claimed_by_priority_and_retried(state):
+    low = state.enqueue_job("batch_ingest", {"n": 1}, priority=0)
+    high = state.enqueue_job("ingest", {"n": 2}, ["t", "s"], priority=1)
+    assert state.queue_depth() == {"batch_ingest": 1, "ingest": 1}
+    job = state.claim_job(owner="w1")
+    assert job["id"] == high and job["context"] == ["t", "s"] and job["attempts"] == 1
+    assert state.claim_job(owner="w2")["id"] == low
+    assert state.claim_job(owner="w3") is None
+    assert state.fail_job(high, "boom", max_attempts=2)
+    assert state.claim_job(owner="w1")["attempts"] == 2
+    assert not state.fail_job(high, "boom", max_attempts=2)
+    state.complete_job(low)
+    assert state.queue_depth() == {}
+
+
+def test_expired_job_lease_is_reclaimed(state):
+    job_id = state.enqueue_job("ingest", {})
+    assert state.claim_job(ttl=0.01, owner="crashed")["id"] == job_id
+    time.sleep(0.02)
+    assert state.claim_job(owner="w2")["id"] == job_id
+
+
+def test_lock_is_renewed_while_held(state):
+    async def hold():
+        async with state.lock("k", ttl=0.05):
+            await asyncio.sleep(0.2)
+            return state.acquire_lease("k", owner="other")
+    assert asyncio.run(hold()) is False
+    assert state.acquire_lease("k", owner="other")
+
+
+def test_work_is_abandoned_when_its_job_is_claimed_elsewhere(state):
+    job_id = state.enqueue_job("ingest", {})
+    state.claim_job(ttl=0.05, owner="slow")
+    finished = []
+
+    async def work():
+        async with keep_renewed(lambda: state.renew_job(job_id, "slow", 0.05), 0.05, "job"):
+            await asyncio.sleep(0.2)
+            finished.append(True)
+    # Another worker takes the job over, e.g. after this one stalled past the lease
+    state._conn().execute("UPDATE jobs SET owner = 'other' WHERE id = ?", (job_id,))
+    with pytest.raises(LeaseLost):
+        asyncio.run(work())
+    assert not finished
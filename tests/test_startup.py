@@ -0,0 +1,33 @@
+import asyncio
+from src.backend import startup
+
+
+def test_probe_result_is_cached_until_ttl():
+    calls = []
+    probe = startup.ProbeCache(lambda: calls.append(1), ttl=60)
+    ok, detail, _ = asyncio.run(probe.check())
+    asyncio.run(probe.check())
+    assert ok and detail == "ok"
+    assert len(calls) == 1
+
+
+def test_failing_probe_reports_error():
+    def probe():
+        raise RuntimeError("index unreachable")
+    ok, detail, _ = asyncio.run(startup.ProbeCache(probe, ttl=0).check())
+    assert not ok and "unreachable" in detail
+
+
+def test_warmup_loads_components_and_tracks_readiness(monkeypatch):
+    monkeypatch.setattr(startup, "_components", {})
+    loaded = []
+    startup.register_component("model", lambda: loaded.append("model"))
+    startup.register_component("optional", lambda: 1 / 0, required=False)
+    assert not startup.components_ready()
+    asyncio.run(startup.warmup())
+    assert loaded == ["model"]
+    assert startup.components_ready()
+    report = startup.startup_report()
+    assert report["components"]["model"]["state"] == "ready"
+    assert report["components"]["optional"]["state"] == "failed"
+    assert report["warmup_seconds"] is not None
@@ -0,0 +1,51 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from src.backend import summarization
+
+
+@pytest.fixture
+def fake_llm(state, monkeypatch):
+    prompts = []
+
+    async def chat_completion(messages, **kwargs):
+        prompt = messages[-1]["content"]
+        prompts.append(prompt)
+        kind = "map" if prompt.startswith("Summarize") else "reduce"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"{kind}#{len(prompts)}"))])
+
+    monkeypatch.setattr(summarization, "chat_completion", chat_completion)
+    return prompts
+
+
+def _lines(n):
+    return [f"user{i % 3} (2024-01-01T00:{i % 60:02d}): message number {i} about the release plan" for i in range(n)]
+
+
+def test_segments_are_bounded_and_stable_when_thread_grows():
+    segments = summarization.segment_lines(_lines(40), max_tokens=60)
+    assert len(segments) > 1
+    assert all(summarization.count_tokens(s) <= 60 for s in segments)
+    grown = summarization.segment_lines(_lines(50), max_tokens=60)
+    assert grown[:len(segments) - 1] == segments[:-1]
+
+
+def test_short_thread_needs_a_single_call(fake_llm):
+    assert asyncio.run(summarization.summarize_lines(_lines(3))) == "map#1"
+    assert len(fake_llm) == 1
+
+
+def test_grown_thread_only_summarizes_new_tail(fake_llm, monkeypatch):
+    monkeypatch.setattr(summarization, "SUMMARY_SEGMENT_TOKENS", 60)
+    monkeypatch.setattr(summarization, "SUMMARY_REDUCE_TOKENS", 40)
+    asyncio.run(summarization.summarize_lines(_lines(40)))
+    first_run = len(fake_llm)
+    segments = len(summarization.segment_lines(_lines(40), 60))
+    assert first_run > segments  # map calls plus at least one reduce level
+    fake_llm.clear()
+    asyncio.run(summarization.summarize_lines(_lines(40)))
+    assert fake_llm == []
+    asyncio.run(summarization.summarize_lines(_lines(45)))
+    map_calls = [p for p in fake_llm if p.startswith("Summarize")]
+    grown_segments = len(summarization.segment_lines(_lines(45), 60))
+    assert len(map_calls) == grown_segments - segments + 1
@@ -0,0 +1,95 @@
+import threading
+import pytest
+from fastapi import BackgroundTasks, FastAPI
+from fastapi.testclient import TestClient
+from src.backend import shared_state
+from src.backend.shared_state import SharedState
+from src.backend.tracing import TRACE_HEADER, SpanStore, TracingMiddleware, continue_trace, parse_trace_id, span, span_store, stage
+
+
+pytestmark = pytest.mark.usefixtures("state")
+
+
+def make_app():
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    async def background():
+        with span("task.work"):
+            pass
+
+    @app.get("/work")
+    async def work(background_tasks: BackgroundTasks):
+        with stage("query", "embed"):
+            with span("inner"):
+                pass
+        background_tasks.add_task(background)
+        return {"ok": True}
+
+    return app
+
+
+def test_trace_id_is_propagated_and_spans_nest():
+    span_store.clear()
+    trace_id = "0123456789abcdef0123456789abcdef"
+    resp = TestClient(make_app()).get("/work", headers={TRACE_HEADER: trace_id})
+    assert resp.headers[TRACE_HEADER.lower()] == trace_id
+    trace = span_store.get(trace_id)
+    spans = {s["name"]: s for s in trace["spans"]}
+    assert trace["name"] == "GET /work"
+    assert spans["query.embed"]["parent_id"] == spans["GET /work"]["span_id"]
+    assert spans["inner"]["parent_id"] == spans["query.embed"]["span_id"]
+    assert spans["task.work"]["parent_id"] == spans["GET /work"]["span_id"]
+    assert "query.embed" in trace["stages_ms"]
+
+
+def test_slowest_orders_by_duration_and_invalid_ids_are_replaced():
+    span_store.clear()
+    client = TestClient(make_app())
+    ids = [client.get("/work").headers[TRACE_HEADER.lower()] for _ in range(3)]
+    slowest = span_store.slowest(2)
+    assert len(slowest) == 2
+    assert slowest[0]["duration_ms"] >= slowest[1]["duration_ms"]
+    assert {t["trace_id"] for t in slowest} <= set(ids)
+    assert parse_trace_id("not-a-trace") != "not-a-trace"
+    assert parse_trace_id("0123456789ABCDEF0123456789ABCDEF") == "0123456789abcdef0123456789abcdef"
+
+
+def test_spans_from_other_processes_join_the_trace(tmp_path, monkeypatch):
+    trace_id = "0123456789abcdef0123456789abcdef"
+    resp = TestClient(make_app()).get("/work", headers={TRACE_HEADER: trace_id})
+    request_span = next(s for s in span_store.get(trace_id)["spans"] if s["name"] == "GET /work")
+    # An ingest worker process opens its own connection to the same database
+    monkeypatch.setattr(shared_state, "_state", SharedState(str(tmp_path / "state.db")))
+    with continue_trace(trace_id, request_span["span_id"]), span("ingest.embed"):
+        pass
+    assert resp.status_code == 200
+    assert "ingest.embed" in span_store.get(trace_id)["stages_ms"]
+
+
+def test_store_keeps_only_recent_traces():
+    store = SpanStore(max_traces=2)
+    for i in range(3):
+        trace_id = f"{i:032x}"
+        store.record({"trace_id": trace_id, "span_id": "s", "parent_id": None, "name": "n",
+                      "start_ns": 0, "end_ns": i + 1, "status": "ok", "attributes": {}})
+    assert store.get(f"{0:032x}") is None
+    assert [t["trace_id"] for t in store.slowest()] == [f"{2:032x}", f"{1:032x}"]
+
+
+def test_recording_only_queues_the_span(monkeypatch):
+    writes, database_free = [], threading.Event()
+
+    def record_spans(self, spans, *limits):
+        database_free.wait(5)
+        writes.append(len(spans))
+    monkeypatch.setattr(shared_state.SharedState, "record_spans", record_spans)
+    store = SpanStore()
+    for i in range(5):
+        store.record({"trace_id": "t", "span_id": str(i), "parent_id": None, "name": "n",
+                      "start_ns": 0, "end_ns": 1, "status": "ok", "attributes": {}})
+    # Every span was recorded while the writer was stuck on the database
+    assert writes == []
+    database_free.set()
+    store.flush()
+    assert sum(writes) == 5 and len(writes) <= 2
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from benchmarks.offline import InMemoryIndex
+from src.backend import vector_store
+from src.backend.metrics import VECTOR_STORE_ERRORS
+from src.backend.sharding import guild_scope
+
+
+class SlowIndex(InMemoryIndex):
+    """Records how many upserts overlap and which namespace and timeout each call got."""
+
+    def __init__(self, delay=0.02):
+        super().__init__(4)
+        self.delay = delay
+        self.running = self.peak = 0
+        self.calls = []
+        self._count_lock = threading.Lock()
+
+    def upsert(self, vectors, namespace="", **kwargs):
+        with self._count_lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.calls.append((len(vectors), namespace, kwargs.get("_request_timeout")))
+        time.sleep(self.delay)
+        super().upsert(vectors, namespace=namespace)
+        with self._count_lock:
+            self.running -= 1
+
+
+def _vectors(n, metadata_bytes=10):
+    return [{"id": f"m#{i}", "values": [1.0, float(i), 0.0, 0.0], "metadata": {"t": "x" * metadata_bytes}} for i in range(n)]
+
+
+@pytest.fixture
+def index(stores, configure_index):
+    return configure_index(SlowIndex(), namespaced=True)
+
+
+def test_upsert_batches_are_bounded_by_count_and_size():
+    assert [len(b) for b in vector_store.upsert_batches(_vectors(250), batch_size=100)] == [100, 100, 50]
+    # ~1 KB per vector: a 5 KB budget fits four
+    assert [len(b) for b in vector_store.upsert_batches(_vectors(10, 1000), max_bytes=5000)] == [4, 4, 2]
+
+
+def test_upserts_run_in_parallel_in_the_callers_namespace(index):
+    async def scenario():
+        with guild_scope("42"):
+            await vector_store.upsert_vectors(_vectors(10), batch_size=2, parallelism=3)
+
+    asyncio.run(scenario())
+    assert index.peak == 3
+    assert sorted(index.calls) == [(2, "guild-42", vector_store.VECTOR_STORE_TIMEOUT_SECONDS)] * 5
+    assert len(index.namespace("guild-42")) == 10
+
+
+def test_calls_that_exceed_their_timeout_fail(index, monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(vector_store, "_executor", executor)
+    index.delay = 1.2
+    before = VECTOR_STORE_ERRORS.value(operation="upsert", reason="timeout")
+    with pytest.raises(vector_store.VectorStoreTimeout, match="upsert"):
+        asyncio.run(vector_store.index_call("upsert", vectors=_vectors(1), timeout=0.1))
+    assert VECTOR_STORE_ERRORS.value(operation="upsert", reason="timeout") - before == 1
+    # Let the abandoned call finish while the test's shared state is still in place
+    executor.shutdown(wait=True)
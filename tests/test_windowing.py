@@ -0,0 +1,43 @@
+from src.backend.windowing import WindowStore, apply_message_changes, pack_messages, render_window
+
+def _msg(message_id, minute, text="short message", user_id="u1"):
+    return {"message_id": message_id, "user_id": user_id, "timestamp": f"2024-01-01T00:{minute:02d}:00+00:00", "text": text}
+
+def test_pack_messages_splits_on_time_gap_and_token_budget():
+    windows = pack_messages(None, [_msg("1", 0), _msg("2", 5), _msg("3", 30)], "c1", None)
+    assert [[m["message_id"] for m in w["messages"]] for w in windows] == [["1", "2"], ["3"]]
+    windows = pack_messages(None, [_msg(str(i), i % 10, "word " * 20) for i in range(10)], "c1", None, max_tokens=60)
+    assert len(windows) > 1
+    assert all(w["tokens"] <= 60 for w in windows)
+
+def test_pack_messages_reopens_only_the_open_window():
+    first = pack_messages(None, [_msg("1", 0)], "c1", "t1")
+    touched = pack_messages(first[-1], [_msg("2", 1)], "c1", "t1")
+    assert len(touched) == 1 and touched[0]["window_id"] == first[0]["window_id"]
+    assert [m["message_id"] for m in touched[0]["messages"]] == ["1", "2"]
+
+def test_pack_messages_keeps_older_batches_out_of_the_open_window():
+    # A backfill read newest-first: each batch is older than the window the previous one left open
+    first = pack_messages(None, [_msg("3", 50)], "c1", None)
+    touched = pack_messages(first[-1], [_msg("1", 0), _msg("2", 5)], "c1", None)
+    assert [[m["message_id"] for m in w["messages"]] for w in touched] == [["1", "2"]]
+    assert touched[0]["window_id"] != first[0]["window_id"]
+    windows = pack_messages(None, [_msg("3", 50), _msg("1", 0), _msg("2", 5)], "c1", None)
+    assert [[m["message_id"] for m in w["messages"]] for w in windows] == [["1", "2"], ["3"]]
+
+def test_render_window_offsets_point_at_messages():
+    window = pack_messages(None, [_msg("1", 0, "hello"), _msg("2", 1, "world", "u2")], "c1", None)[0]
+    text, offsets = render_window(window)
+    spans = [tuple(map(int, o.split(":"))) for o in offsets]
+    assert [text[a:b] for a, b in spans] == ["u1: hello", "u2: world"]
+
+def test_window_store_and_changes(tmp_path):
+    store = WindowStore(str(tmp_path / "windows.db"))
+    windows = pack_messages(None, [_msg("1", 0), _msg("2", 1)], "c1", None)
+    store.save(windows, open_window=windows[-1])
+    assert store.open_window("c1:")["window_id"] == windows[0]["window_id"]
+    stored = store.windows_for_messages(["2"])
+    changed, emptied = apply_message_changes(stored, {"2": "edited"}, {"1"})
+    assert [m["text"] for m in changed[0]["messages"]] == ["edited"] and not emptied
+    changed, emptied = apply_message_changes(stored, {}, {"1", "2"})
+    assert not changed and len(emptied) == 1